@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'PlaceTown.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from backend.bot.ingress import webhook_application  # noqa: E402 needs the configured settings
+
+application = webhook_application(django_application)
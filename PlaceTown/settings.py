@@ -166,6 +166,99 @@ DJANGO_TELEGRAMBOT = {
     ],
 }
 
+# TelegramUser column values are cached per process, every update still gets its own TelegramUser instance.
+TELEGRAM_USER_CACHE = {
+    'MAX_SIZE': 1024,
+    'TTL': 30,
+}
+
+# Server-side state of inline keyboards, used by handlers with STATE_STORE and by oversized callback_data.
+BOT_NAVIGATION_STATE = {
+    'BACKEND': 'backend.bot.navigation.DatabaseStateBackend',
+    'CACHE_SIZE': 4096,
+}
+
+# Rendered company cards, invalidated by model signals within the process and expired after TTL seconds.
+COMPANY_CARD_CACHE = {
+    'MAX_SIZE': 2048,
+    'TTL': 300,
+}
+
+# Optional distance limit of the "nearby" companies filter, in kilometres.
+NEARBY_RADIUS_KM = None
+
+# Cached category tree, rebuilt on category and company changes or at the latest after TTL seconds.
+CATEGORY_TREE = {
+    'TTL': 300,
+}
+
+# News notifications: Telegram allows about 30 messages per second per bot.
+NEWS_BROADCAST = {
+    'RATE': 30,
+    'WORKERS': 8,
+    'CHUNK_SIZE': 500,
+    'MAX_RETRIES': 5,
+}
+
+# Database backed jobs, claimed by the poller of the ASGI server or of `manage.py run_jobs`. LEASE is
+# the number of seconds after which a job of a silent process is claimed again, SHUTDOWN_TIMEOUT how
+# long the server waits for running jobs on shutdown.
+JOB_QUEUE = {
+    'POLL_INTERVAL': 1,
+    'BATCH_SIZE': 10,
+    'WORKERS': 4,
+    'LEASE': 300,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_DELAY': 30,
+    'SHUTDOWN_TIMEOUT': 10,
+}
+
+# Threads sending and deleting order status messages off the update handling thread.
+ORDER_NOTIFICATIONS = {
+    'WORKERS': 8,
+}
+
+# Slot booking: how many days ahead the booking calendar offers free slots.
+BOOKING = {
+    'HORIZON_DAYS': 60,
+}
+
+# Updates of one chat are handled in order on one of LANES threads, different chats in parallel.
+UPDATE_SCHEDULER = {
+    'LANES': 8,
+}
+
+# ASGI webhook: at most QUEUE_SIZE updates wait for the lanes. When no slot frees up within
+# ENQUEUE_TIMEOUT seconds Telegram is answered 429 and retries the update.
+WEBHOOK_INGRESS = {
+    'QUEUE_SIZE': 1000,
+    'ENQUEUE_TIMEOUT': 2,
+    'RETRY_AFTER': 5,
+}
+
+# Bot API connection pool, by default one keep-alive connection for every lane, notification,
+# broadcast and job thread.
+BOT_API = {
+    'CON_POOL_SIZE': None,
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 5,
+}
+
+# Seconds a keyset list total from `count=EXACT_COUNT` or `count=ESTIMATED_COUNT` is reused.
+KEYSET_PAGINATION = {
+    'COUNT_TTL': 600,
+}
+
+# Chat actions of handlers decorated with send_action: shown only after DELAY seconds, at most once
+# per chat and action within INTERVAL seconds, and not while more than SHED_QUEUE_DEPTH updates wait.
+# CHAT_ACTIONS_LOAD_SHEDDING=1 in the environment turns chat actions off in every process.
+CHAT_ACTIONS = {
+    'DELAY': 0.5,
+    'INTERVAL': 5,
+    'SHED_QUEUE_DEPTH': 200,
+    'LOAD_SHEDDING': os.environ.get('CHAT_ACTIONS_LOAD_SHEDDING') == '1',
+}
+
 GEOS_LIBRARY_PATH = os.environ.get('GEOS_LIBRARY_PATH')
 GDAL_LIBRARY_PATH = os.environ.get('GDAL_LIBRARY_PATH')
 
@@ -14,12 +14,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django_telegrambot import urls as telegrambot_urls
-from backend.views import base
+from backend.bot.ingress import webhook_prefix
+from backend.views import base, webhook, webhook_metrics
 
 urlpatterns = [
+    path('admin/webhook-metrics/', webhook_metrics, name='webhook-metrics'),
     path('admin/', admin.site.urls, name='admin'),
+    re_path(r'^{}(?P<bot_token>.+?)/$'.format(webhook_prefix()[1:]), webhook, name='webhook'),
     path('', include(telegrambot_urls)),
     path('', base)
 ]
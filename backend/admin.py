@@ -1,11 +1,10 @@
 from django.contrib import admin
 from django.contrib.auth.models import Group
 from django.urls import resolve
-from django_telegrambot.apps import DjangoTelegramBot
 from telegram.ext import JobQueue
 
 from backend import models as back_models
-from backend.bot import job_callbacks
+from backend.bot import job_callbacks, jobs  # noqa: F401 job_callbacks registers the jobs
 
 admin.site.unregister(Group)
 
@@ -125,13 +124,13 @@ class CompanyAdmin(admin.ModelAdmin):
     def save_formset(self, request, form, formset, change):
         instances = formset.save()
         if issubclass(formset.model, back_models.News):
-            dp = DjangoTelegramBot.dispatcher
             for instance in instances:
                 if not instance.notification_users:
                     continue
                 print('Set notification news {}'.format(instance.title))
-                dp.job_queue.run_once(job_callbacks.notification_user_news, when=10, context=instance)
-            dp.job_queue.start()
+                jobs.schedule(
+                    'notification_user_news', delay=10, dedup_key=f'news:{instance.id}', news_id=instance.id
+                )
 
 
 @admin.register(back_models.Category)
@@ -5,3 +5,6 @@ from django.utils.translation import gettext_lazy as _
 class BackendConfig(AppConfig):
     name = 'backend'
     verbose_name = _('backend')
+
+    def ready(self):
+        from backend import signals  # noqa: F401
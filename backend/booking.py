@@ -0,0 +1,82 @@
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+
+from backend import schedule
+from backend.models import Order, Service, ServiceAvailability, TelegramUser
+
+BOOKING = getattr(settings, 'BOOKING', {})
+HORIZON_DAYS = BOOKING.get('HORIZON_DAYS', 60)
+
+
+class ServiceBooked(Exception):
+    pass
+
+
+def active_bookings():
+    """Orders holding a whole booking service, slot orders only hold their slot."""
+    return Order.objects.filter(booking=True, slot_start__isnull=True)
+
+
+def is_available(service: Service) -> bool:
+    if service.type != Service.BOOKING or service.is_slot_booking:
+        return True
+    return not active_bookings().filter(service=service).exists()
+
+
+def available_services(services):
+    """Excludes the booking services held by an active order, a lookup on the partial `order_active_booking` index."""
+    return services.annotate(
+        is_booked=models.Exists(active_bookings().filter(service=models.OuterRef('pk')))
+    ).filter(is_booked=False)
+
+
+def create_order(customer: TelegramUser, service: Service, slot_start: datetime.datetime = None) -> Order:
+    """
+    Creates an order for `service`. A booking service, or its slot starting at `slot_start`, is reserved by
+    the order until it is rejected or done; the unique indexes make concurrent reservations fail with
+    `ServiceBooked`.
+    """
+    try:
+        with transaction.atomic():
+            return Order.objects.create(
+                customer=customer, service=service, slot_start=slot_start, booking=service.type == Service.BOOKING
+            )
+    except IntegrityError:
+        raise ServiceBooked(service.id)
+
+
+def booking_days(today: datetime.date = None):
+    today = today or datetime.date.today()
+    return today, today + datetime.timedelta(days=HORIZON_DAYS)
+
+
+def free_slots(service: Service, day: datetime.date, bitmap: bytes, now: datetime.datetime = None):
+    """Start times of the free slots of `day` in `bitmap`, skipping the slots already begun."""
+    now = now or datetime.datetime.now()
+    after = -1
+    if day == now.date():
+        after = now.hour * 60 + now.minute
+    elif day < now.date():
+        return []
+    midnight = datetime.datetime.combine(day, datetime.time())
+    return [
+        midnight + datetime.timedelta(minutes=index * service.slot_length)
+        for index in schedule.bitmap_slots(bitmap, after, service.slot_length)
+    ]
+
+
+def month_availability(service: Service, year: int, month: int, now: datetime.datetime = None):
+    """Days of the month within the booking horizon having a free slot, from one query on the availability index."""
+    now = now or datetime.datetime.now()
+    first, last = booking_days(now.date())
+    month_first = datetime.date(year, month, 1)
+    month_last = (month_first + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+    first, last = max(first, month_first), min(last, month_last)
+    if first > last:
+        return set()
+    return {
+        day for day, bitmap in ServiceAvailability.days(service, first, last).items()
+        if free_slots(service, day, bitmap, now)
+    }
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import models
+from telegram import Bot, InlineKeyboardButton as InlBtn, InlineKeyboardMarkup, ParseMode
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+
+from backend.bot.i18n import catalogs
+from backend.models import Broadcast, TelegramUser, WatchCompanyTelegramUser, telegram_user_cache
+
+log = logging.getLogger(__name__)
+
+NEWS_BROADCAST = getattr(settings, 'NEWS_BROADCAST', {})
+
+SENT, FAILED, BLOCKED = 'sent', 'failed', 'blocked'
+
+
+class TokenBucket:
+    """Blocking rate limiter shared by the sending threads, `pause()` holds every sender back."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    delay = (1 - self._tokens) / self.rate
+                else:
+                    self._updated = self._paused_until
+                    delay = self._paused_until - now
+            time.sleep(delay)
+
+
+class NewsBroadcaster:
+    """
+    Sends a news notification to every watcher of its company.
+
+    Recipients are read in keyset chunks ordered by watch id, the messages of a chunk are sent by a thread
+    pool throttled by a `TokenBucket`, and `Broadcast.last_watch_id` is stored after each chunk so an
+    interrupted broadcast resumes from the first unfinished chunk.
+    """
+
+    def __init__(self, bot: Bot, rate: float = None, workers: int = None, chunk_size: int = None,
+                 max_retries: int = None):
+        self.bot = bot
+        self.bucket = TokenBucket(rate or NEWS_BROADCAST.get('RATE', 30))
+        self.workers = workers or NEWS_BROADCAST.get('WORKERS', 8)
+        self.chunk_size = chunk_size or NEWS_BROADCAST.get('CHUNK_SIZE', 500)
+        self.max_retries = max_retries or NEWS_BROADCAST.get('MAX_RETRIES', 5)
+
+    @staticmethod
+    def render(broadcast: Broadcast, lang: str):
+        from backend.bot.handlers.callbacks import CompanyDetailCallback
+        news = broadcast.news
+        t = catalogs.get(lang)
+        text = t('notification_news').format(
+            company=news.company.name,
+            title=news.title,
+            description=news.description,
+            time_news=broadcast.created.strftime('%d-%m-%y %H:%M')
+        )
+        markup = InlineKeyboardMarkup([[
+            InlBtn(t('company'), callback_data=CompanyDetailCallback.set_data(id=news.company_id))
+        ]])
+        return text, markup
+
+    @staticmethod
+    def recipients(broadcast: Broadcast, chunk_size: int):
+        """The next chunk after `last_watch_id`, a short keyset query instead of a cursor held open for hours."""
+        return list(
+            WatchCompanyTelegramUser.objects
+            .filter(company_id=broadcast.news.company_id, telegram_user__blocked=False)
+            .filter(id__gt=broadcast.last_watch_id)
+            .order_by('id')
+            .values_list('id', 'telegram_user_id', 'telegram_user__lang')[:chunk_size]
+        )
+
+    def send(self, chat_id: int, text: str, markup: InlineKeyboardMarkup):
+        for attempt in range(self.max_retries):
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(chat_id=chat_id, text=text, reply_markup=markup, parse_mode=ParseMode.HTML)
+                return SENT
+            except RetryAfter as e:
+                log.warning('Broadcast throttled by Telegram for %s seconds', e.retry_after)
+                self.bucket.pause(e.retry_after)
+            except Unauthorized:
+                return BLOCKED
+            except BadRequest as e:
+                log.warning('Broadcast message to %s rejected: %s', chat_id, e)
+                return FAILED
+            except NetworkError as e:
+                log.warning('Broadcast message to %s failed: %s', chat_id, e)
+                time.sleep(min(2 ** attempt, 30))
+        return FAILED
+
+    def run(self, broadcast: Broadcast):
+        if broadcast.status == Broadcast.DONE:
+            return broadcast
+        Broadcast.objects.filter(pk=broadcast.pk).update(status=Broadcast.RUNNING)
+        messages = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='broadcast') as executor:
+            while True:
+                chunk = self.recipients(broadcast, self.chunk_size)
+                if not chunk:
+                    break
+                futures = []
+                for watch_id, chat_id, lang in chunk:
+                    if lang not in messages:
+                        messages[lang] = self.render(broadcast, lang)
+                    futures.append(executor.submit(self.send, chat_id, *messages[lang]))
+
+                results = [future.result() for future in futures]
+                blocked = [chunk[index][1] for index, result in enumerate(results) if result == BLOCKED]
+                if blocked:
+                    TelegramUser.objects.filter(id__in=blocked).update(blocked=True)
+                    for user_id in blocked:
+                        telegram_user_cache.delete(user_id)
+
+                broadcast.last_watch_id = chunk[-1][0]
+                Broadcast.objects.filter(pk=broadcast.pk).update(
+                    last_watch_id=broadcast.last_watch_id,
+                    sent=models.F('sent') + results.count(SENT),
+                    failed=models.F('failed') + results.count(FAILED),
+                    blocked=models.F('blocked') + len(blocked),
+                )
+        Broadcast.objects.filter(pk=broadcast.pk).update(status=Broadcast.DONE)
+        broadcast.refresh_from_db()
+        log.info('Broadcast %s finished: %s sent, %s failed, %s blocked',
+                 broadcast.pk, broadcast.sent, broadcast.failed, broadcast.blocked)
+        return broadcast
+
@@ -0,0 +1,34 @@
+import itertools
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+from backend.cache import TTLCache
+
+COMPANY_CARD_CACHE = getattr(settings, 'COMPANY_CARD_CACHE', {})
+
+card_cache = TTLCache(max_size=COMPANY_CARD_CACHE.get('MAX_SIZE', 2048), ttl=COMPANY_CARD_CACHE.get('TTL', 300))
+# (telegram user id, company id) -> whether the user has graded the company; present only once the watch exists
+viewer_cache = TTLCache(max_size=COMPANY_CARD_CACHE.get('MAX_SIZE', 2048) * 8, ttl=COMPANY_CARD_CACHE.get('TTL', 300))
+
+_versions = {}
+_counter = itertools.count(1)
+_lock = threading.Lock()
+
+
+def company_version(company_id):
+    return _versions.get(company_id, 0)
+
+
+def invalidate_company(company_id):
+    with _lock:
+        _versions[company_id] = next(_counter)
+
+
+def invalidate_viewer(user_id, company_id):
+    viewer_cache.delete((user_id, company_id))
+
+
+def card_key(company_id, version, lang, is_graded, ct_pg):
+    return company_id, version, lang, is_graded, ct_pg, timezone.now().date()
@@ -0,0 +1,138 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import models
+
+from backend.bot.i18n import catalogs
+
+CATEGORY_TREE = getattr(settings, 'CATEGORY_TREE', {})
+
+
+class CategoryNode:
+    __slots__ = ('id', 'name', 'parent_id', 'tree_id', 'lft', 'rght', 'level', 'hidden',
+                 'labels', 'company_count', 'children', 'subtree_ids', 'hidden_ranges')
+
+    def __init__(self, id, name, parent_id, tree_id, lft, rght, level, hidden):
+        self.id = id
+        self.name = name
+        self.parent_id = parent_id
+        self.tree_id = tree_id
+        self.lft = lft
+        self.rght = rght
+        self.level = level
+        self.hidden = hidden
+        self.labels = {}
+        self.company_count = 0
+        self.children = []
+        self.subtree_ids = []
+        self.hidden_ranges = []
+
+    @property
+    def is_leaf(self):
+        return not self.children
+
+    def label(self, lang):
+        return self.labels.get(lang, self.name)
+
+
+class CategoryTree:
+    """
+    Snapshot of the visible `Category` tree with per-language labels and company counts per subtree.
+
+    A category is hidden together with its whole subtree. The snapshot is rebuilt lazily on the first
+    access after `invalidate()` or after `ttl` seconds, which covers bulk MPTT operations sending no signals.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        from backend.models import Category, Company
+        rows = Category.objects.order_by('tree_id', 'lft') \
+            .values_list('id', 'name', 'parent_id', 'tree_id', 'lft', 'rght', 'level', 'hidden')
+        counts = dict(
+            Company.objects.order_by().values('category_id').annotate(count=models.Count('id'))
+            .values_list('category_id', 'count')
+        )
+
+        nodes, roots = {}, []
+        for row in rows:
+            node = CategoryNode(*row)
+            parent = nodes.get(node.parent_id)
+            if node.hidden or (node.parent_id and (parent is None or parent.hidden)):
+                node.hidden = True
+            nodes[node.id] = node
+            if node.hidden and parent is not None and not parent.hidden:
+                while parent is not None:
+                    parent.hidden_ranges.append((node.lft, node.rght))
+                    parent = nodes.get(parent.parent_id)
+
+        visible = [node for node in nodes.values() if not node.hidden]
+        for code, name in settings.LANGUAGES:
+            t = catalogs.get(code)
+            for node in visible:
+                node.labels[code] = t(node.name)
+
+        for node in reversed(visible):
+            node.company_count += counts.get(node.id, 0)
+            node.subtree_ids.insert(0, node.id)
+            if node.parent_id:
+                parent = nodes[node.parent_id]
+                parent.company_count += node.company_count
+                parent.subtree_ids[:0] = node.subtree_ids
+                parent.children.insert(0, node)
+            else:
+                roots.insert(0, node)
+        return time.monotonic() + self.ttl, nodes, roots
+
+    def _get(self):
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] < time.monotonic():
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot[0] < time.monotonic():
+                    snapshot = self._snapshot = self._build()
+        return snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def get(self, category_id):
+        node = self._get()[1].get(category_id)
+        return None if node is None or node.hidden else node
+
+    def children(self, category_id=None):
+        if category_id is None:
+            return self._get()[2]
+        node = self.get(category_id)
+        return node.children if node else []
+
+    def subtree_ids(self, category_id):
+        node = self.get(category_id)
+        return node.subtree_ids if node else []
+
+    def companies_filter(self, category_id, prefix='category'):
+        """`Q` selecting the companies of the visible subtree of `category_id` by a `lft`/`rght` range scan."""
+        node = self.get(category_id)
+        if node is None:
+            return models.Q(pk__in=[])
+        if node.is_leaf:
+            return models.Q(**{f'{prefix}_id': node.id})
+        condition = models.Q(**{
+            f'{prefix}__tree_id': node.tree_id, f'{prefix}__lft__gte': node.lft, f'{prefix}__rght__lte': node.rght
+        })
+        for lft, rght in node.hidden_ranges:
+            condition &= ~models.Q(**{f'{prefix}__lft__gte': lft, f'{prefix}__rght__lte': rght})
+        return condition
+
+    def rows(self, category_id=None, lang=None):
+        return [
+            {'cid': node.id, 'name': node.label(lang), 'count': node.company_count}
+            for node in self.children(category_id)
+        ]
+
+
+tree = CategoryTree(ttl=CATEGORY_TREE.get('TTL', 300))
@@ -0,0 +1,111 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from telegram import Bot
+from telegram.error import TelegramError
+
+from backend.bot import notifications
+from backend.bot.scheduler import scheduler
+from backend.cache import TTLCache
+
+log = logging.getLogger(__name__)
+
+CHAT_ACTIONS = getattr(settings, 'CHAT_ACTIONS', {})
+
+
+class ChatActionIndicator:
+    """
+    Shows a chat action only for handlers still running `delay` seconds after they started.
+
+    A single timer thread fires the due actions, the request itself runs on the notification executor so
+    neither the handler nor the timer waits for the Bot API. Telegram shows an action for about five
+    seconds, so an action is sent at most once per chat and action within `interval` seconds. Nothing is
+    sent while load shedding is on, from the LOAD_SHEDDING setting or `load_shedding.set()`, or while the
+    update lanes have more than `shed_depth` updates waiting.
+    """
+
+    def __init__(self, delay: float = None, interval: float = None, shed_depth: int = None,
+                 load_shedding: bool = None):
+        self.delay = CHAT_ACTIONS.get('DELAY', 0.5) if delay is None else delay
+        self.shed_depth = CHAT_ACTIONS.get('SHED_QUEUE_DEPTH', 200) if shed_depth is None else shed_depth
+        self.recent = TTLCache(max_size=4096, ttl=interval or CHAT_ACTIONS.get('INTERVAL', 5))
+        self.load_shedding = threading.Event()
+        if CHAT_ACTIONS.get('LOAD_SHEDDING', False) if load_shedding is None else load_shedding:
+            self.load_shedding.set()
+        self.metrics = {'scheduled': 0, 'sent': 0, 'deduplicated': 0, 'shed': 0}
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @property
+    def shedding(self):
+        if self.load_shedding.is_set():
+            return True
+        return bool(self.shed_depth) and scheduler.depth > self.shed_depth
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-actions', daemon=True)
+                self._thread.start()
+
+    def schedule(self, bot: Bot, chat_id: int, action: str) -> list:
+        """Returns a handle, the action is not sent if `cancel(handle)` is called within `delay` seconds."""
+        handle = [bot, chat_id, action]
+        shedding = self.shedding
+        self.start()
+        with self._condition:
+            if shedding:
+                self.metrics['shed'] += 1
+                return handle
+            self.metrics['scheduled'] += 1
+            heapq.heappush(self._heap, (time.monotonic() + self.delay, next(self._counter), handle))
+            self._condition.notify()
+        return handle
+
+    @staticmethod
+    def cancel(handle: list):
+        handle[0] = None
+
+    def fire(self, bot: Bot, chat_id: int, action: str):
+        with self._condition:
+            if self.shedding:
+                metric = 'shed'
+            elif (chat_id, action) in self.recent:
+                metric = 'deduplicated'
+            else:
+                metric = 'sent'
+                self.recent.set((chat_id, action), True)
+            self.metrics[metric] += 1
+        if metric == 'sent':
+            notifications.executor.submit(self._send, bot, chat_id, action)
+
+    @property
+    def stats(self):
+        with self._condition:
+            return dict(self.metrics, pending=len(self._heap), shedding=self.shedding)
+
+    @staticmethod
+    def _send(bot: Bot, chat_id: int, action: str):
+        try:
+            bot.send_chat_action(chat_id=chat_id, action=action)
+        except TelegramError as e:
+            log.warning('Chat action for %s failed: %s', chat_id, e)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                due, number, handle = heapq.heappop(self._heap)
+            bot, chat_id, action = handle
+            if bot is not None:
+                self.fire(bot, chat_id, action)
+
+
+indicator = ChatActionIndicator()
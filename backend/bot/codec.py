@@ -0,0 +1,110 @@
+"""
+Compact `callback_data` encoding.
+
+A payload is the varint bitmask of the fields present followed by their packed values, in schema order,
+encoded as unpadded base64url. Fields are identified by position only, so schemas must stay append-only:
+reordering or removing a field breaks the inline keyboards already sent to users.
+"""
+import base64
+
+
+def write_varint(value: int, buffer: bytearray):
+    while value > 0x7f:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data: bytes, pos: int):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+class Field:
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def pack(self, value, buffer: bytearray):
+        raise NotImplementedError
+
+    def unpack(self, data: bytes, pos: int):
+        raise NotImplementedError
+
+
+class Int(Field):
+
+    def pack(self, value, buffer: bytearray):
+        value = int(value)
+        write_varint(value << 1 if value >= 0 else (-value << 1) - 1, buffer)
+
+    def unpack(self, data: bytes, pos: int):
+        value, pos = read_varint(data, pos)
+        return (value >> 1) ^ -(value & 1), pos
+
+
+class Str(Field):
+
+    def pack(self, value, buffer: bytearray):
+        value = str(value).encode('utf-8')
+        write_varint(len(value), buffer)
+        buffer.extend(value)
+
+    def unpack(self, data: bytes, pos: int):
+        length, pos = read_varint(data, pos)
+        return data[pos:pos + length].decode('utf-8'), pos + length
+
+
+class Choice(Field):
+
+    def __init__(self, name: str, choices):
+        super(Choice, self).__init__(name)
+        self.choices = tuple(choices)
+        self._indexes = {choice: index for index, choice in enumerate(self.choices)}
+
+    def pack(self, value, buffer: bytearray):
+        if value not in self._indexes:
+            raise ValueError(f'{value!r} is not a valid choice for {self.name}')
+        write_varint(self._indexes[value], buffer)
+
+    def unpack(self, data: bytes, pos: int):
+        index, pos = read_varint(data, pos)
+        return self.choices[index], pos
+
+
+class Schema:
+
+    def __init__(self, *fields: Field):
+        self.fields = fields
+        self._positions = {field.name: position for position, field in enumerate(fields)}
+
+    def pack(self, values: dict) -> str:
+        mask, present = 0, []
+        for key, value in values.items():
+            if key not in self._positions:
+                raise ValueError(f'Field {key} is not declared in schema')
+            if value is None:
+                continue
+            mask |= 1 << self._positions[key]
+            present.append((self._positions[key], value))
+
+        buffer = bytearray()
+        write_varint(mask, buffer)
+        for position, value in sorted(present, key=lambda x: x[0]):
+            self.fields[position].pack(value, buffer)
+        return base64.urlsafe_b64encode(bytes(buffer)).rstrip(b'=').decode('ascii')
+
+    def unpack(self, payload: str) -> dict:
+        data = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+        mask, pos = read_varint(data, 0)
+        values = {}
+        for position, field in enumerate(self.fields):
+            if mask >> position & 1:
+                values[field.name], pos = field.unpack(data, pos)
+        return values
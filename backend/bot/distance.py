@@ -0,0 +1,119 @@
+"""
+Vectorized distance ranking for databases without PostGIS.
+
+Coordinates of the companies of each category are kept in memory as float64 NumPy arrays, so ranking a
+category by distance is one haversine evaluation over the arrays plus a partial sort of the requested page.
+"""
+import threading
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class CategoryCoordinates:
+
+    def __init__(self, ids, latitudes, longitudes):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+        self.longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+        self.cos_latitudes = np.cos(self.latitudes)
+
+    @classmethod
+    def concatenate(cls, items):
+        instance = cls.__new__(cls)
+        for name in ('ids', 'latitudes', 'longitudes', 'cos_latitudes'):
+            setattr(instance, name, np.concatenate([getattr(item, name) for item in items]))
+        return instance
+
+    def __len__(self):
+        return len(self.ids)
+
+    def distances(self, latitude, longitude):
+        """Haversine distance in kilometres from the point to every company."""
+        latitude, longitude = np.radians(latitude), np.radians(longitude)
+        a = np.sin((self.latitudes - latitude) / 2) ** 2 + \
+            np.cos(latitude) * self.cos_latitudes * np.sin((self.longitudes - longitude) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def nearest(distances, start, stop):
+    """Positions of the `start:stop` nearest items, partially sorting only the first `stop`."""
+    stop = min(stop, len(distances))
+    if start >= stop:
+        return np.empty(0, dtype=np.int64)
+    if stop < len(distances):
+        candidates = np.argpartition(distances, stop - 1)[:stop]
+    else:
+        candidates = np.arange(len(distances))
+    return candidates[np.argsort(distances[candidates], kind='stable')][start:stop]
+
+
+class CoordinateIndex:
+
+    def __init__(self):
+        self._categories = {}
+        self._lock = threading.Lock()
+
+    def _load(self, category_id):
+        from backend.models import Company
+        rows = Company.objects \
+            .filter(category_id=category_id, longitude__isnull=False, latitude__isnull=False) \
+            .values_list('id', 'latitude', 'longitude')
+        ids, latitudes, longitudes = zip(*rows) if rows else ((), (), ())
+        return CategoryCoordinates(ids, latitudes, longitudes)
+
+    def get(self, category_ids):
+        items = []
+        for category_id in category_ids:
+            coordinates = self._categories.get(category_id)
+            if coordinates is None:
+                coordinates = self._load(category_id)
+                with self._lock:
+                    self._categories[category_id] = coordinates
+            items.append(coordinates)
+        if not items:
+            return CategoryCoordinates((), (), ())
+        return items[0] if len(items) == 1 else CategoryCoordinates.concatenate(items)
+
+    def invalidate(self, category_id):
+        with self._lock:
+            self._categories.pop(category_id, None)
+
+
+coordinate_index = CoordinateIndex()
+
+
+class DistanceRankedCompanies:
+    """
+    Sequence of company rows ordered by distance, usable as `Paginator` data. Only the sliced page is
+    fetched from `companies`, each row gets a `distance` in kilometres.
+    """
+
+    def __init__(self, companies, coordinates: CategoryCoordinates, latitude, longitude):
+        self._companies = companies
+        candidates = np.fromiter(companies.values_list('id', flat=True), dtype=np.int64)
+        mask = np.isin(coordinates.ids, candidates)
+        self._ids = coordinates.ids[mask]
+        self._distances = coordinates.distances(latitude, longitude)[mask]
+
+    def limit(self, radius_km):
+        mask = self._distances <= radius_km
+        self._ids, self._distances = self._ids[mask], self._distances[mask]
+
+    def count(self):
+        return len(self._ids)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        positions = nearest(self._distances, item.start or 0, item.stop or len(self._ids))
+        page_ids = self._ids[positions].tolist()
+        rows = {row['id']: row for row in self._companies.filter(id__in=page_ids)}
+        return [
+            dict(rows[company_id], distance=round(float(distance), 2))
+            for company_id, distance in zip(page_ids, self._distances[positions]) if company_id in rows
+        ]
@@ -0,0 +1,91 @@
+"""
+Local stand-in for the Bot API, for benchmarking handlers without network access.
+
+Every method succeeds after `latency` seconds. Methods returning a message get a message in the chat of
+the request, `getMe` returns a bot, every other method returns `true`.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MESSAGE_METHODS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendLocation', 'forwardMessage'}
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # One write per response and no Nagle delay, otherwise every keep-alive response waits for a delayed ACK.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            data = json.loads(body.decode('utf-8')) if body else {}
+        except ValueError:
+            data = {}
+        method = self.path.rsplit('/', 1)[-1]
+        result = self.server.api.call(method, data, self.client_address)
+        payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeBotApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class FakeBotApi:
+
+    def __init__(self, latency: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.calls = {}
+        self.connections = set()
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._server = FakeBotApiServer((host, port), FakeBotApiHandler)
+        self._server.api = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/bot'
+
+    def call(self, method: str, data: dict, client=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.connections.add(client)
+            self._message_id += 1
+            message_id = self._message_id
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        if method in MESSAGE_METHODS:
+            chat_id = int(data.get('chat_id') or 0)
+            return {
+                'message_id': int(data.get('message_id') or message_id), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': data.get('text', ''),
+            }
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
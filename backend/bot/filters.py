@@ -1,9 +1,69 @@
 import re
+import threading
 
+from django.conf import settings
 from telegram.ext import BaseFilter
-from django.utils.translation import gettext as _
 
-from backend.models import TelegramUser
+from backend.bot.i18n import catalogs
+
+
+class MessageDispatchIndex:
+    """
+    Translated menu labels of every language mapped to the key of the `RegexFilter` handling them.
+
+    The built index is an immutable `(labels, pattern, group_keys)` tuple swapped under the lock, a filter
+    registered on another thread while a lookup runs only makes the next lookup rebuild it.
+    """
+
+    def __init__(self):
+        self._filters = []
+        self._index = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def register(self, regex_filter):
+        with self._lock:
+            self._filters.append(regex_filter)
+            self._generation += 1
+            self._index = None
+
+    def build(self, languages=None):
+        with self._lock:
+            regex_filters, generation = list(self._filters), self._generation
+
+        labels, groups = {}, []
+        for code, name in languages or settings.LANGUAGES:
+            catalog = catalogs.get(code)
+            for regex_filter in regex_filters:
+                label = catalog(regex_filter.key)
+                if regex_filter.pattern == '^':
+                    labels.setdefault(label, regex_filter.key)
+                groups.append((regex_filter.pattern, label, regex_filter.key))
+
+        group_keys = {}
+        alternatives = []
+        for index, (pattern, label, key) in enumerate(sorted(groups, key=lambda x: -len(x[1]))):
+            group_keys[f'g{index}'] = key
+            alternatives.append('(?P<g{}>{}{})'.format(index, pattern, re.escape(label)))
+
+        index = (labels, re.compile('|'.join(alternatives)) if alternatives else None, group_keys)
+        with self._lock:
+            if generation == self._generation:
+                self._index = index
+        return index
+
+    def resolve(self, text):
+        with self._lock:
+            index = self._index
+        labels, pattern, group_keys = index or self.build()
+        key = labels.get(text)
+        if key is not None or pattern is None:
+            return key
+        match = pattern.search(text)
+        return group_keys[match.lastgroup] if match else None
+
+
+dispatch_index = MessageDispatchIndex()
 
 
 class RegexFilter(BaseFilter):
@@ -12,12 +72,9 @@ class RegexFilter(BaseFilter):
         self.pattern = pattern
         self.key = key
         self.name = 'Filters.RegexFilter({}{})'.format(self.pattern, key)
+        dispatch_index.register(self)
 
     def filter(self, message):
-        user = TelegramUser.get_user(message.from_user)
         if message.text:
-            pattern = re.compile('{}{}'.format(self.pattern, _(self.key)))
-            match = pattern.search(message.text)
-            if match:
-                return {'matches': [match]}
-            return {}
+            return dispatch_index.resolve(message.text) == self.key
+        return False
@@ -1,28 +1,33 @@
+import datetime
 import logging
 
 from django.conf import settings
 from django.contrib.auth.models import Group
-from django.db import models
+from django.db import transaction
 from django.utils import timezone
-from django.utils.translation import gettext as _, activate
-from geopy.distance import geodesic
 from telegram import Update, Bot, InlineKeyboardButton as InlBtn, InlineKeyboardMarkup, ParseMode
 from telegram.ext import CallbackQueryHandler
 
-from backend.bot import keyboards
-from backend.models import TelegramUser, Category, Company, TimeWork, Service, User, Profile, Grade, Order, News, \
-    WatchCompanyTelegramUser
+from backend import booking
+from backend.bot import cards, categories, codec, keyboards, loaders, navigation, nearby, notifications
+from backend.models import TelegramUser, Company, TimeWork, Service, User, Profile, Grade, Order, News, \
+    WatchCompanyTelegramUser, OpenInterval, ServiceAvailability
 
 log = logging.getLogger(__name__)
 
+MAX_CALLBACK_DATA_SIZE = 64
+
 
 class BaseCallbackQueryHandler(CallbackQueryHandler):
     PATTERN = None
+    FIELDS = None
+    # Keeps the state server-side behind a token, for handlers carrying the breadcrumbs of a browsing path.
+    STATE_STORE = False
 
     def __init__(self, *args, **kwargs):
         if self.PATTERN is None:
             raise AttributeError('Key must be not None.')
-        pattern = '^{};+'.format(self.PATTERN)
+        pattern = '^{}[;:!]'.format(self.PATTERN)
         super(BaseCallbackQueryHandler, self).__init__(self.callback, *args, pattern=pattern, **kwargs)
 
     def collect_optional_args(self, dispatcher, update=None, check_result=None):
@@ -35,16 +40,43 @@ class BaseCallbackQueryHandler(CallbackQueryHandler):
             args['data'] = None
         return args
 
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        try:
+            return super(BaseCallbackQueryHandler, self).handle_update(update, dispatcher, check_result, context)
+        except navigation.StateExpired:
+            user = TelegramUser.get_user(update.callback_query.from_user)
+            update.callback_query.answer()
+            update.callback_query.edit_message_text(user.get_text('navigation_expired'))
+            return False
+
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
         raise NotImplementedError
 
     @classmethod
     def set_data(cls, **kwargs):
+        if not cls.STATE_STORE:
+            data = cls._encode_data(kwargs)
+            if len(data.encode('utf-8')) <= MAX_CALLBACK_DATA_SIZE:
+                return data
+        return f'{cls.PATTERN}!{navigation.store.put(kwargs)}'
+
+    @classmethod
+    def _encode_data(cls, kwargs):
+        if cls.FIELDS is not None:
+            try:
+                return f'{cls.PATTERN}:{cls.FIELDS.pack(kwargs)}'
+            except (ValueError, TypeError):
+                pass
         data = list('{}={}'.format(key, value) for key, value in kwargs.items())
         return f'{cls.PATTERN};{";".join(data)}'
 
-    @staticmethod
-    def get_data(data):
+    @classmethod
+    def get_data(cls, data):
+        separator, payload = data[len(cls.PATTERN)], data[len(cls.PATTERN) + 1:]
+        if separator == '!':
+            return navigation.store.get(payload)
+        if cls.FIELDS is not None and separator == ':':
+            return cls.FIELDS.unpack(payload)
         data = [item.split('=') for item in filter(bool, data.split(';')[1:])]
         return {key: int(value) if key.endswith(('id', 'page')) else value for key, value in data}
 
@@ -52,20 +84,28 @@ class BaseCallbackQueryHandler(CallbackQueryHandler):
 class LanguageCallback(BaseCallbackQueryHandler):
     LANGUAGES = dict(settings.LANGUAGES)
     PATTERN = 'lang'
+    FIELDS = codec.Schema(codec.Choice('lang', dict(settings.LANGUAGES)))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         user.lang = data.get('lang')
-        user.save()
-        activate(user.lang)
-        query.edit_message_text(_('your_lang').format(self.LANGUAGES.get(data.get('lang'))))
+        user.save_changes()
+        query.edit_message_text(_('your_lang').format(_(self.LANGUAGES.get(data.get('lang')))))
         update.effective_message.reply_text(_('select_you_interested'), reply_markup=keyboards.main_menu(user))
 
 
 class FilterCallback(BaseCallbackQueryHandler):
     PATTERN = 'filter'
+    FIELDS = codec.Schema(
+        codec.Choice('st', ['open', 'nearby']),
+        codec.Choice('order', ['mark', 'name', 'sorting']),
+        codec.Choice('filter', ['show_rejected', 'show_done']),
+        codec.Int('cid'), codec.Int('page'), codec.Int('ct_pg'),
+    )
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         if data.get('st'):
             status = data.pop('st')
@@ -96,7 +136,7 @@ class FilterCallback(BaseCallbackQueryHandler):
         if data.get('filter'):
             user.options['filters'][data.get('filter')] = not user.filters.get(data.get('filter'), False)
             update.effective_message.edit_reply_markup(reply_markup=keyboards.filter_markup(user))
-        user.save()
+        user.save_changes()
 
 
 class LocationCallback(BaseCallbackQueryHandler):
@@ -110,6 +150,7 @@ class ProfileCreateCallback(BaseCallbackQueryHandler):
     PATTERN = 'profile'
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         if not hasattr(user, 'profile'):
             username = user.username or '.'.join(user.full_name.lower().split(' '))
@@ -119,17 +160,19 @@ class ProfileCreateCallback(BaseCallbackQueryHandler):
             Profile.objects.create(user=user, account=account, name=user.full_name)
             query.edit_message_text(
                 _('user_created_info').format(username=username, password=password),
-                reply_markup=keyboards.site_btn(),
+                reply_markup=keyboards.site_btn(user),
                 parse_mode=ParseMode.HTML,
             )
         else:
-            query.edit_message_text(_('profile_exists'), reply_markup=keyboards.site_btn())
+            query.edit_message_text(_('profile_exists'), reply_markup=keyboards.site_btn(user))
 
 
 class CompanyLocationCallback(BaseCallbackQueryHandler):
     PATTERN = 'location'
+    FIELDS = codec.Schema(codec.Int('company_id'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         company = Company.objects.filter(id=data.get('company_id')).first()
         if not company:
@@ -144,16 +187,26 @@ class CompanyLocationCallback(BaseCallbackQueryHandler):
 
 class OrderStatusCallback(BaseCallbackQueryHandler):
     PATTERN = 'us-order'
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('status'), codec.Choice('st', ['outgoing', 'incoming']))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
-        order = Order.objects.filter(id=data.pop('id')).first()
+        with transaction.atomic():
+            order = Order.objects.select_for_update(of=('self',)) \
+                .select_related('customer', 'service__performer__profile__user') \
+                .filter(id=data.pop('id')).first()
+            if order:
+                # Taken out under the row lock, so a second tap never deletes the same messages again.
+                order.options = order.options or {}
+                user_messages = order.options.pop('user_messages', [])
+                performer_messages = order.options.pop('performer_messages', [])
+                order.status = int(data.pop('status'))
+                order.updated = timezone.now()
+                order.save(update_fields=['status', 'updated', 'options'])
         if not order:
             query.answer(_('no_info_available'))
             return True
-        order.status = int(data.pop('status'))
-        order.updated = timezone.now()
-        order.save()
         user_data, performer_data = {}, {}
         if data.get('st') == 'outgoing':
             user_data = {
@@ -166,27 +219,48 @@ class OrderStatusCallback(BaseCallbackQueryHandler):
                 'st': 'incoming'
             }
         if data.get('st'):
-            update.effective_message.delete()
+            notifications.delete_messages(bot, update.effective_chat.id, [update.effective_message.message_id])
+        query.answer()
+
+        futures = [
+            self.update_order_user(bot, order, user_messages, **user_data),
+            self.update_performer_order(bot, order, performer_messages, **performer_data),
+        ]
+        notifications.when_done(futures, lambda done: self.save_order_messages(order, *done))
 
-        self.update_order_user(bot, order, **user_data)
-        self.update_performer_order(bot, order, **performer_data)
+    @classmethod
+    def save_order_messages(cls, order: Order, user_message, performer_message):
+        messages = {}
+        for key, future in (('user_messages', user_message), ('performer_messages', performer_message)):
+            if future.exception() is None:
+                messages[key] = [future.result().message_id]
+            else:
+                log.error(f'Order {order.id} notification failed: {future.exception()}')
+        if messages:
+            order.append_messages(**messages)
 
     @classmethod
     def get_user_order_info(cls, order: Order, user: TelegramUser):
-        user.activate()
+        _ = user.catalog
         return _('created_order_user_info').format(
-            status=order.STATUS_DICT.get(order.status),
+            status=_(order.STATUS_DICT.get(order.status)),
             company=order.service.performer.name,
             service=order.service.name,
             created=order.created.strftime('%d-%m-%y %H:%M'),
             contact=order.service.performer.contact,
-        )
+        ) + cls.get_order_slot_info(order, user)
+
+    @classmethod
+    def get_order_slot_info(cls, order: Order, user: TelegramUser):
+        if not order.slot_start:
+            return ''
+        return '\n' + user.catalog('order_slot').format(slot=order.slot_start.strftime('%d-%m-%y %H:%M'))
 
     @classmethod
     def get_user_order_markup(cls, order: Order, user: TelegramUser, back_btn=None, **kwargs):
         if order.status == 3:
             return InlineKeyboardMarkup(keyboards.build_menu([], footer_buttons=back_btn))
-        user.activate()
+        _ = user.catalog
         keyboard = []
         if order.status != 2:
             keyboard.append(InlBtn(_('reject_order'), callback_data=cls.set_data(id=order.id, status=2, **kwargs)))
@@ -194,21 +268,21 @@ class OrderStatusCallback(BaseCallbackQueryHandler):
 
     @classmethod
     def get_order_performer_info(cls, order: Order, user: TelegramUser):
-        user.activate()
+        _ = user.catalog
         return _('create_order_performer_info').format(
-            status=order.STATUS_DICT.get(order.status),
+            status=_(order.STATUS_DICT.get(order.status)),
             service=order.service.name,
             created=order.created.strftime('%d-%m-%y %H:%M'),
             company=order.service.performer.name,
             user_name=order.customer.full_name,
             contact=order.customer.phone,
-        )
+        ) + cls.get_order_slot_info(order, user)
 
     @classmethod
     def get_order_performer_markup(cls, order: Order, user: TelegramUser, back_btn=None, **kwargs):
         if order.status in (2, 3):
             return InlineKeyboardMarkup(keyboards.build_menu([], footer_buttons=back_btn))
-        user.activate()
+        _ = user.catalog
         keyboard = []
         if order.status != 1:
             keyboard.append(InlBtn(_('accept_order'), callback_data=cls.set_data(id=order.id, status=1, **kwargs)))
@@ -218,38 +292,28 @@ class OrderStatusCallback(BaseCallbackQueryHandler):
         return InlineKeyboardMarkup(keyboards.build_menu(keyboard, footer_buttons=back_btn))
 
     @classmethod
-    def update_order_user(cls, bot: Bot, order: Order, back_btn=None, **kwargs):
-        customer, messages = order.get_customer_and_messages
-        for message_id in messages:
-            try:
-                bot.delete_message(customer.id, message_id)
-            except:
-                log.error(f'Message {message_id} for chat {customer.id} not found')
+    def update_order_user(cls, bot: Bot, order: Order, messages: list, back_btn=None, **kwargs):
+        customer = order.customer
+        notifications.delete_messages(bot, customer.id, messages)
         text = cls.get_user_order_info(order, customer)
         markup = cls.get_user_order_markup(order, customer, back_btn, **kwargs)
-        message = bot.send_message(chat_id=customer.id, text=text, reply_markup=markup)
-        order.options['user_messages'] = [message.message_id]
-        order.save()
+        return notifications.send_message(bot, customer.id, text, reply_markup=markup)
 
     @classmethod
-    def update_performer_order(cls, bot: Bot, order: Order, back_btn=None, **kwargs):
-        performer, messages = order.get_performer_and_messages
-        for message_id in messages:
-            try:
-                bot.delete_message(performer.id, message_id)
-            except:
-                log.error(f'Message {message_id} for chat {performer.id} not found')
+    def update_performer_order(cls, bot: Bot, order: Order, messages: list, back_btn=None, **kwargs):
+        performer = order.service.performer.profile.user
+        notifications.delete_messages(bot, performer.id, messages)
         text = cls.get_order_performer_info(order, performer)
         markup = cls.get_order_performer_markup(order, performer, back_btn, **kwargs)
-        message = bot.send_message(chat_id=performer.id, text=text, reply_markup=markup)
-        order.options['performer_messages'] = [message.message_id]
-        order.save()
+        return notifications.send_message(bot, performer.id, text, reply_markup=markup)
 
 
 class CreateOrderCallback(BaseCallbackQueryHandler):
     PATTERN = 'cr-order'
+    FIELDS = codec.Schema(codec.Int('id'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         if not user.phone:
             query.answer(_('must_set_user_phone'))
@@ -260,45 +324,147 @@ class CreateOrderCallback(BaseCallbackQueryHandler):
             query.answer(_('not_info_about_services_of_company'))
             return False
 
-        if Order.objects.filter(service=service, service__type=1).exclude(status__in=[2, 3]).exists():
+        if service.is_slot_booking:
+            BookingCalendarCallback.callback(self, bot, update, user, {'id': service.id})
+            return False
+
+        try:
+            order = booking.create_order(user, service)
+        except booking.ServiceBooked:
             query.answer(_('service_was_early_booking'))
             return False
         markup = update.effective_message.reply_markup
         markup.inline_keyboard = markup.inline_keyboard[1:]
         update.effective_message.edit_reply_markup(reply_markup=markup)
-        order = Order.objects.create(customer=user, service=service)
-        performer_user = service.performer.profile.user
 
         user_message = update.effective_message.reply_text(
             OrderStatusCallback.get_user_order_info(order, user),
             reply_markup=OrderStatusCallback.get_user_order_markup(order, user)
         )
+        CreateOrderCallback.notify_performer(bot, order, user_message)
 
+    @classmethod
+    def notify_performer(cls, bot: Bot, order: Order, user_message):
+        performer_user = order.service.performer.profile.user
         performer_message = bot.send_message(
             performer_user.id,
             OrderStatusCallback.get_order_performer_info(order, performer_user),
             reply_markup=OrderStatusCallback.get_order_performer_markup(order, performer_user)
         )
-        order.options.setdefault('user_messages', []).append(user_message.message_id)
-        order.options.setdefault('performer_messages', []).append(performer_message.message_id)
-        order.save()
+        order.append_messages(
+            user_messages=[user_message.message_id], performer_messages=[performer_message.message_id]
+        )
+
+
+class BookingCalendarCallback(BaseCallbackQueryHandler):
+    PATTERN = 'cal'
+    FIELDS = codec.Schema(
+        codec.Int('id'), codec.Choice('st', ['ignore', 'day', 'prev', 'next']), codec.Int('y'), codec.Int('m'),
+        codec.Int('d'),
+    )
+
+    def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
+        query = update.callback_query
+        if data.get('st') == 'ignore':
+            query.answer()
+            return False
+        service = Service.objects.filter(id=data.get('id')).first()
+        if not service or not service.is_slot_booking:
+            query.answer(_('not_info_about_services_of_company'))
+            return False
+        if data.get('st') == 'day':
+            BookingCalendarCallback.show_day(update, user, service, datetime.date(data['y'], data['m'], data['d']))
+            return
+
+        today = datetime.date.today()
+        year, month = data.get('y', today.year), data.get('m', today.month)
+        markup = keyboards.generate_calendar(
+            user, BookingCalendarCallback, year, month,
+            available_days=booking.month_availability(service, year, month), id=service.id,
+        )
+        markup.inline_keyboard.append([InlBtn(
+            _('back'), callback_data=ServiceCompanyCallback.set_data(id=service.id, cid=service.performer_id, s_pg=1)
+        )])
+        query.edit_message_text(_('choose_booking_day').format(name=service.name), reply_markup=markup)
+
+    @classmethod
+    def show_day(cls, update: Update, user: TelegramUser, service: Service, day: datetime.date):
+        _ = user.catalog
+        first, last = booking.booking_days()
+        slots = []
+        if first <= day <= last:
+            slots = booking.free_slots(service, day, ServiceAvailability.days(service, day, day)[day])
+        buttons = [
+            InlBtn(slot.strftime('%H:%M'), callback_data=BookingSlotCallback.set_data(
+                id=service.id, y=day.year, m=day.month, d=day.day, t=slot.hour * 60 + slot.minute
+            ))
+            for slot in slots
+        ]
+        back_btn = InlBtn(
+            _('back'), callback_data=BookingCalendarCallback.set_data(id=service.id, y=day.year, m=day.month)
+        )
+        text = _('choose_booking_slot') if slots else _('no_free_slots')
+        update.callback_query.edit_message_text(
+            text.format(name=service.name, day=day.strftime('%d-%m-%y')),
+            reply_markup=InlineKeyboardMarkup(keyboards.build_menu(buttons, cols=4, footer_buttons=back_btn))
+        )
+
+
+class BookingSlotCallback(BaseCallbackQueryHandler):
+    PATTERN = 'slot'
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('y'), codec.Int('m'), codec.Int('d'), codec.Int('t'))
+
+    def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
+        query = update.callback_query
+        if not user.phone:
+            query.answer(_('must_set_user_phone'))
+            update.effective_message.reply_text(_('must_set_user_phone'), reply_markup=keyboards.settings_markup(user))
+            return False
+        service = Service.objects.select_related('performer__profile__user').filter(id=data.get('id')).first()
+        if not service or not service.is_slot_booking:
+            query.answer(_('not_info_about_services_of_company'))
+            return False
+
+        day = datetime.date(data['y'], data['m'], data['d'])
+        slot_start = datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(minutes=data['t'])
+        free = booking.free_slots(service, day, ServiceAvailability.days(service, day, day)[day])
+        try:
+            if slot_start not in free:
+                raise booking.ServiceBooked(service.id)
+            order = booking.create_order(user, service, slot_start)
+        except booking.ServiceBooked:
+            query.answer(_('slot_was_booked'))
+            BookingCalendarCallback.show_day(update, user, service, day)
+            return False
+
+        user_message = query.edit_message_text(
+            OrderStatusCallback.get_user_order_info(order, user),
+            reply_markup=OrderStatusCallback.get_user_order_markup(order, user)
+        )
+        CreateOrderCallback.notify_performer(bot, order, user_message)
 
 
 class ServiceCompanyCallback(BaseCallbackQueryHandler):
     PATTERN = 'ssid'
+    STATE_STORE = True
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('cid'), codec.Int('s_pg'), codec.Int('ct_pg'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         service = Service.objects.filter(id=data.pop('id')).first()
         if not service:
             query.answer(_('not_info_about_services_of_company'))
             CompanyDetailCallback.callback(self, bot, update, user, {'id': service.performer.id})
             return False
-        if Order.objects.filter(service=service, service__type=1).exclude(status__in=[2, 3]).exists():
+        if not booking.is_available(service):
             query.answer(_('service_was_early_booking'))
             return False
+        create_callback = BookingCalendarCallback if service.is_slot_booking else CreateOrderCallback
         buttons = [
-            InlBtn(_('create_order'), callback_data=CreateOrderCallback.set_data(id=service.id)),
+            InlBtn(_('create_order'), callback_data=create_callback.set_data(id=service.id)),
             InlBtn(_('back'), callback_data=ServicesPaginatorCallback.set_data(page=data.pop('s_pg'), **data))
         ]
         query.edit_message_text(
@@ -309,15 +475,14 @@ class ServiceCompanyCallback(BaseCallbackQueryHandler):
 
 class ServicesPaginatorCallback(BaseCallbackQueryHandler):
     PATTERN = 'services'
+    STATE_STORE = True
+    FIELDS = codec.Schema(codec.Int('cid'), codec.Int('page'), codec.Int('ct_pg'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
-        user.activate()
+        _ = user.catalog
         query = update.callback_query
-        services = Service.objects.filter(performer_id=data['cid']).values('id', 'name').order_by('name')
-        excluding_services = Order.objects.filter(service__performer_id=data['cid'], service__type=1) \
-            .exclude(status__in=[2, 3]).values('service_id')
-        if excluding_services.exists():
-            services = services.exclude(id__in=excluding_services)
+        services = booking.available_services(Service.objects.filter(performer_id=data['cid'])) \
+            .values('id', 'name').order_by('name')
         if not services:
             query.answer(_('not_info_about_services_of_company'))
             CompanyDetailCallback.callback(self, bot, update, user, {'id': data.get('cid')})
@@ -340,8 +505,10 @@ class ServicesPaginatorCallback(BaseCallbackQueryHandler):
 
 class GradeCompanyCallback(BaseCallbackQueryHandler):
     PATTERN = 'gr-com'
+    FIELDS = codec.Schema(codec.Int('cid'), codec.Int('mark'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         company = Company.objects.filter(id=data.get('cid')).first()
 
@@ -364,8 +531,11 @@ class GradeCompanyCallback(BaseCallbackQueryHandler):
 
 class NewsDetailCallback(BaseCallbackQueryHandler):
     PATTERN = 'nid'
+    STATE_STORE = True
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('cid'), codec.Int('s_pg'), codec.Int('ct_pg'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         news = News.objects.filter(id=data.pop('id')).first()
         if not news:
@@ -384,14 +554,14 @@ class NewsDetailCallback(BaseCallbackQueryHandler):
 
 class NewsPaginatorCallback(BaseCallbackQueryHandler):
     PATTERN = 'news'
+    STATE_STORE = True
+    FIELDS = codec.Schema(codec.Int('cid'), codec.Int('page'), codec.Int('ct_pg'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
-        user.activate()
+        _ = user.catalog
         query = update.callback_query
-        date_from_filters = models.Q(date_from__lte=timezone.now()) | models.Q(date_from__isnull=True)
-        date_to_filters = models.Q(date_to__gte=timezone.now()) | models.Q(date_to__isnull=True)
         news = News.objects.filter(company_id=data['cid']) \
-            .filter(date_from_filters).filter(date_to_filters) \
+            .filter(loaders.active_news_filter()) \
             .values('id', 'title') \
             .order_by('-created')
 
@@ -418,20 +588,50 @@ class NewsPaginatorCallback(BaseCallbackQueryHandler):
 
 class CompanyDetailCallback(BaseCallbackQueryHandler):
     PATTERN = 'did'
+    STATE_STORE = True
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('page'), codec.Int('ct_pg'), codec.Int('cp_pg'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
-        user.activate()
+        _ = user.catalog
         query = update.callback_query
 
-        company = Company.objects.filter(id=data.get('id')).first()
-        if not company:
+        card = CompanyDetailCallback.get_card(data.get('id'), user, data.get('ct_pg', 1))
+        if card is None:
             query.edit_message_text(_('not_info_about_company'))
             return False
 
-        if not WatchCompanyTelegramUser.objects.filter(company=company, telegram_user=user).exists():
-            WatchCompanyTelegramUser.objects.create(company=company, telegram_user=user)
+        text, keyboard, category_id = card
+        back_btn = InlBtn(
+            _('back'), callback_data=CompaniesCallback.set_data(
+                cid=category_id, page=data.get('cp_pg', 1), ct_pg=data.get('ct_pg', 1)
+            )
+        )
+        markup = InlineKeyboardMarkup(keyboard + [[back_btn]])
+        query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.HTML)
 
-        keyboard, markup = [], None
+    @classmethod
+    def get_card(cls, company_id, user: TelegramUser, ct_pg=1):
+        version = cards.company_version(company_id)
+        is_graded = cards.viewer_cache.get((user.id, company_id))
+        if is_graded is not None:
+            card = cards.card_cache.get(cards.card_key(company_id, version, user.lang, is_graded, ct_pg))
+            if card is not None:
+                return card
+
+        company = loaders.load_company_detail(company_id, user)
+        if not company:
+            return None
+        if not company.is_watched:
+            WatchCompanyTelegramUser.objects.get_or_create(company=company, telegram_user=user)
+        cards.viewer_cache.set((user.id, company_id), company.is_graded)
+
+        key = cards.card_key(company_id, version, user.lang, company.is_graded, ct_pg)
+        return cards.card_cache.set(key, cls.render_card(company, user, ct_pg))
+
+    @classmethod
+    def render_card(cls, company: Company, user: TelegramUser, ct_pg=1):
+        _ = user.catalog
+        keyboard = []
 
         if company.site:
             keyboard.append(InlBtn(_('site_url'), url=company.site))
@@ -440,37 +640,23 @@ class CompanyDetailCallback(BaseCallbackQueryHandler):
             callback = CompanyLocationCallback.set_data(company_id=company.id)
             keyboard.append(InlBtn(_('location'), callback_data=callback))
 
-        if not company.grades.filter(reviewer_user=user).exists():
+        if not company.is_graded:
             grade_callback = GradeCompanyCallback.set_data(cid=company.id)
             keyboard.append(InlBtn(_('grade'), callback_data=grade_callback))
 
-        if company.services.exists():
-            callback = ServicesPaginatorCallback.set_data(cid=company.id, ct_pg=data.get('ct_pg', 1))
+        if company.has_services:
+            callback = ServicesPaginatorCallback.set_data(cid=company.id, ct_pg=ct_pg)
             keyboard.append(InlBtn(_('services'), callback_data=callback))
 
-        date_from_filters = models.Q(date_from__lte=timezone.now()) | models.Q(date_from__isnull=True)
-        date_to_filters = models.Q(date_to__gte=timezone.now()) | models.Q(date_to__isnull=True)
-
-        if company.news.filter(date_from_filters).filter(date_to_filters).exists():
-            callback = NewsPaginatorCallback.set_data(cid=company.id, ct_pg=data.get('ct_pg', 1))
+        if company.has_news:
+            callback = NewsPaginatorCallback.set_data(cid=company.id, ct_pg=ct_pg)
             keyboard.append(InlBtn(_('news'), callback_data=callback))
 
-        from backend.bot.keyboards import build_menu
-        back_btn = InlBtn(
-            _('back'), callback_data=CompaniesCallback.set_data(
-                cid=company.category_id, page=data.get('cp_pg', 1), ct_pg=data.get('ct_pg', 1)
-            )
-        )
-        markup = InlineKeyboardMarkup(build_menu(keyboard, footer_buttons=[back_btn], cols=2))
-
         text = _('about_company').format(name=company.name,
                                          description=company.description or _('no_info_available'))
 
-        if company.grades.filter(mark__isnull=False).exists():
-            grade_mark = company.grades.filter(mark__isnull=False) \
-                .aggregate(models.Avg('mark')) \
-                .get('mark__avg', 0)
-            text += f"\n⭐️: {round(grade_mark, 2)}/5.0"
+        if company.rating_count:
+            text += f"\n⭐️: {round(company.rating, 2)}/5.0"
         if company.address:
             text += f"\n🏢: {company.address}"
         if company.contact:
@@ -478,70 +664,45 @@ class CompanyDetailCallback(BaseCallbackQueryHandler):
         if company.email:
             text += f"\n📧: {company.email}"
         text_work_days = "\n{}".format(_('work_schedule'))
-        if company.time_works.exists():
-            work_week_days = company.time_works \
-                .exclude(is_lunch=True) \
-                .values('week_day', 'start_time', 'end_time') \
-                .order_by('week_day')
-
-            for week in work_week_days:
+        if company.work_days:
+            for week in company.work_days:
                 text_work_days += "\n{day} {start} - {end}".format(
-                    day=TimeWork.WEEK_DAYS_DICT.get(week['week_day']),
-                    start=week['start_time'].strftime("%H:%M"),
-                    end=week['end_time'].strftime("%H:%M"),
+                    day=_(TimeWork.WEEK_DAYS_DICT.get(week.week_day)),
+                    start=week.start_time.strftime("%H:%M"),
+                    end=week.end_time.strftime("%H:%M"),
                 )
         else:
             text_work_days += _('no_info_available')
         text += f"\n{text_work_days}"
 
-        query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.HTML)
+        return text, keyboards.build_menu(keyboard, cols=2), company.category_id
 
 
 class CompaniesCallback(BaseCallbackQueryHandler):
     PATTERN = 'iid'
+    STATE_STORE = True
+    FIELDS = codec.Schema(codec.Int('cid'), codec.Int('page'), codec.Int('ct_pg'))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         kwargs = {}
-        user.activate()
         query = update.callback_query
         from backend.bot import pagination
-        companies = Company.objects.filter(category_id=data.get('cid')).values('id', 'name')
+        category = categories.tree.get(data.get('cid'))
+        category_ids = category.subtree_ids if category else []
+        companies = Company.objects.filter(categories.tree.companies_filter(data.get('cid'))).values('id', 'name')
         if user.filters['open']:
-            time_now = timezone.now()
-            open_companies = TimeWork.objects.filter(
-                performer__category_id=data.get('cid'),
-                week_day=time_now.weekday(),
-                start_time__lte=time_now,
-                end_time__gte=time_now,
-            ).values('performer_id').distinct()
-            companies = companies.filter(id__in=open_companies)
+            companies = companies.filter(id__in=OpenInterval.open_companies(category_ids, timezone.now()))
 
         if user.location and user.filters['nearby']:
-            companies_dict = {}
-            companies_values = Company.objects \
-                .filter(longitude__isnull=False, latitude__isnull=False, category_id=data.get('cid')) \
-                .values('id', 'longitude', 'latitude')
-            companies = companies.filter(id__in=companies_values.values('id').distinct())
-            current_location = (user.location['longitude'], user.location['latitude'])
-            for company in list(companies_values):
-                company_location = (company['longitude'], company['latitude'])
-                distance = round(geodesic(current_location, company_location).kilometers * 0.8, 2)
-                company['distance'] = distance
-                companies_dict[company['id']] = distance
-            if companies_values:
-                companies_values = sorted(companies_values, reverse=False, key=lambda x: x['distance'])
-
-                sorted_checked = models.Case(
-                    *[models.When(pk=pk['id'], then=pos) for pos, pk in enumerate(companies_values)]
-                )
-                companies = companies.order_by(sorted_checked)
-            kwargs['title_pattern'] = lambda x: f"{companies_dict.get(x['id'], '-')} km {x['name']}"
+            companies, kwargs['title_pattern'] = nearby.order_by_distance(
+                companies, user.location['longitude'], user.location['latitude'], category_ids
+            )
 
         order = user.orders.get('by')
         if order and not user.filters['nearby']:
             if order == 'mark':
-                companies = companies.prefetch_related('grades') \
-                    .annotate(mark=models.Avg('grades__mark'))
+                order = 'rating'
             if user.orders.get('sorting'):
                 order = '-' + order
             companies = companies.order_by(order)
@@ -560,10 +721,16 @@ class CompaniesCallback(BaseCallbackQueryHandler):
             [
                 InlBtn(
                     _('back'),
-                    callback_data=CategoriesCallback.set_data(id=data.get('cid'), page=data.get('ct_pg', 1))
+                    callback_data=CategoriesCallback.set_data(
+                        page=data.get('ct_pg', 1), pid=category.parent_id if category else None
+                    )
                 ),
             ]
         ]
+        if category and not category.is_leaf:
+            option_keyboards.insert(
+                0, [InlBtn(_('subcategories'), callback_data=CategoriesCallback.set_data(pid=category.id))]
+            )
         if not companies:
             query.edit_message_text(
                 _('not_choose_performer_for_current_category'),
@@ -584,26 +751,43 @@ class CompaniesCallback(BaseCallbackQueryHandler):
 
 class CategoriesCallback(BaseCallbackQueryHandler):
     PATTERN = 'cid'
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('page'), codec.Int('pid'))
+
+    @staticmethod
+    def category_title(row):
+        return f"{row['name']} ({row['count']})"
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         from backend.bot import pagination
-        categories = Category.objects.annotate(cid=models.F('id')).values('cid', 'name')
-        if not categories:
-            query.edit_message_text(_('not_choose_categories'))
+        parent_id = data.get('pid')
+        rows = categories.tree.rows(parent_id, user.lang)
+        back_keyboard = [
+            [InlBtn(_('back'), callback_data=CompaniesCallback.set_data(cid=parent_id))]
+        ] if parent_id else []
+        if not rows:
+            query.edit_message_text(
+                _('not_choose_categories'), reply_markup=InlineKeyboardMarkup(back_keyboard) if back_keyboard else None
+            )
             return False
 
         paginator = pagination.CallbackPaginator(
-            categories, callback=CompaniesCallback, page_callback=self, page=data.get('page', 1),
-            callback_data_keys=['cid'], data_params={'ct_pg': data.get('page', 1)}
+            rows, callback=CompaniesCallback, page_callback=CategoriesCallback, page=data.get('page', 1),
+            title_pattern=self.category_title, callback_data_keys=['cid'],
+            page_params={'pid': parent_id}, data_params={'ct_pg': data.get('page', 1)}
         )
-        query.edit_message_text(_('choose_category'), reply_markup=paginator.inline_markup)
+        markup = paginator.inline_markup
+        markup.inline_keyboard.extend(back_keyboard)
+        query.edit_message_text(_('choose_category'), reply_markup=markup)
 
 
 class OutgoingOrderDetailCallback(BaseCallbackQueryHandler):
     PATTERN = 'doid'
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('page'), codec.Str('cur'), codec.Choice('dir', ['n', 'p']))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         order = Order.objects.filter(id=data['id']).first()
         if not order:
@@ -619,31 +803,36 @@ class OutgoingOrderDetailCallback(BaseCallbackQueryHandler):
 
 class OutgoingOrderCallback(BaseCallbackQueryHandler):
     PATTERN = 'ooid'
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('page'), codec.Str('cur'), codec.Choice('dir', ['n', 'p']))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         from backend.bot import pagination
         orders = Order.objects.filter(customer=user) \
             .exclude(status__in=user.order_filter_status) \
-            .values('id', 'status', 'service__name') \
-            .order_by('-updated')
+            .values('id', 'status', 'service__name', 'updated')
 
-        if not orders:
+        paginator = pagination.KeysetCallbackPaginator(
+            orders, callback=OutgoingOrderDetailCallback, page_callback=self, keys=('-updated', '-id'),
+            cursor=data.get('cur'), direction=data.get('dir', pagination.NEXT), page=data.get('page', 1),
+            callback_data_keys=['id'],
+            data_params={'page': data.get('page', 1), 'cur': data.get('cur'), 'dir': data.get('dir')},
+            title_pattern=lambda x: f"{Order.STATUS_EMOJI_DICT.get(x['status'])} {x['service__name']}",
+        )
+        if not paginator.data:
             query.edit_message_text(_('no_info_available'))
             return False
 
-        paginator = pagination.CallbackPaginator(
-            orders, callback=OutgoingOrderDetailCallback, page_callback=self, page=data.get('page', 1),
-            callback_data_keys=['id'], data_params={'page': data.get('page', 1)},
-            title_pattern=lambda x: f"{Order.STATUS_EMOJI_DICT.get(x['status'])} {x['service__name']}",
-        )
         query.edit_message_text(_('choose_order'), reply_markup=paginator.inline_markup)
 
 
 class IncomingOrderDetailCallback(BaseCallbackQueryHandler):
     PATTERN = 'dioid'
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('page'), codec.Str('cur'), codec.Choice('dir', ['n', 'p']))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         order = Order.objects.filter(id=data['id']).first()
         if not order:
@@ -659,18 +848,23 @@ class IncomingOrderDetailCallback(BaseCallbackQueryHandler):
 
 class IncomingOrderCallback(BaseCallbackQueryHandler):
     PATTERN = 'ioid'
+    FIELDS = codec.Schema(codec.Int('id'), codec.Int('page'), codec.Str('cur'), codec.Choice('dir', ['n', 'p']))
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         from backend.bot import pagination
-        orders = Order.objects.filter(service__performer__profile=user.profile) \
+        # Service ids instead of a join, so every service is a range of the (service, updated, id) index.
+        services = list(Service.objects.filter(performer__profile=user.profile).values_list('id', flat=True))
+        orders = Order.objects.filter(service_id__in=services) \
             .exclude(status__in=user.order_filter_status) \
-            .values('id', 'status', 'service__name') \
-            .order_by('-updated')
+            .values('id', 'status', 'service__name', 'updated')
 
-        paginator = pagination.CallbackPaginator(
-            orders, callback=IncomingOrderDetailCallback, page_callback=self, page=data.get('page', 1),
-            callback_data_keys=['id'], data_params={'page': data.get('page', 1)},
+        paginator = pagination.KeysetCallbackPaginator(
+            orders, callback=IncomingOrderDetailCallback, page_callback=self, keys=('-updated', '-id'),
+            cursor=data.get('cur'), direction=data.get('dir', pagination.NEXT), page=data.get('page', 1),
+            callback_data_keys=['id'],
+            data_params={'page': data.get('page', 1), 'cur': data.get('cur'), 'dir': data.get('dir')},
             title_pattern=lambda x: f"{Order.STATUS_EMOJI_DICT.get(x['status'])} {x['service__name']}",
         )
         markup = paginator.inline_markup
@@ -684,5 +878,6 @@ class MyProfileCallback(BaseCallbackQueryHandler):
     PATTERN = 'pfid'
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser, data: dict):
+        _ = user.catalog
         query = update.callback_query
         query.edit_message_text(_('my_profile_data'), reply_markup=keyboards.profile_markup(user))
@@ -1,6 +1,5 @@
 import logging
 
-from django.utils.translation import gettext as _
 from telegram import Bot, Update, InlineKeyboardButton as InlKeyBtn, InlineKeyboardMarkup as InlKeyMark
 from telegram.ext import CommandHandler
 
@@ -31,6 +30,7 @@ class HelpCommand(BaseCommandHandler):
     COMMAND = 'help'
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         update.effective_message.reply_text(_('help'))
 
 
@@ -38,6 +38,7 @@ class StartCommand(BaseCommandHandler):
     COMMAND = 'start'
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         update.effective_message.reply_text(_('start').format(user.full_name), reply_markup=keyboards.main_menu(user))
 
 
@@ -45,6 +46,7 @@ class SettingsCommand(BaseCommandHandler):
     COMMAND = 'settings'
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         update.effective_message.reply_text(_('settings'), reply_markup=keyboards.settings_markup(user))
 
 
@@ -52,19 +54,21 @@ class ProfileCommand(BaseCommandHandler):
     COMMAND = 'profile'
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         if not hasattr(user, 'profile'):
             markup = InlKeyMark(keyboards.build_menu([
                 InlKeyBtn(_('create_profile'), callback_data=callbacks.ProfileCreateCallback.set_data()),
             ]))
             update.effective_message.reply_text(_('profile_does_not_exists'), reply_markup=markup)
         else:
-            update.effective_message.reply_text(_('profile_exists'), reply_markup=keyboards.site_btn())
+            update.effective_message.reply_text(_('profile_exists'), reply_markup=keyboards.site_btn(user))
 
 
 class LanguageCommand(BaseCommandHandler):
     COMMAND = 'lang'
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         update.effective_message.reply_text(_('choose_lang'), reply_markup=keyboards.language(user))
 
 
@@ -72,4 +76,5 @@ class FilterCommand(BaseCommandHandler):
     COMMAND = 'filters'
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         update.effective_message.reply_text(_('data_filter'), reply_markup=keyboards.filter_markup(user))
@@ -1,16 +1,14 @@
 import logging
 
-from django.db import models
 from django.utils import timezone
-from django.utils.translation import gettext as _
 from django_telegrambot.apps import DjangoTelegramBot
 from telegram import Bot, Update
 from telegram.ext import MessageHandler, Filters
 
 from backend.admin import CompanyAdmin
-from backend.bot import filters as bot_filters, keyboards
+from backend.bot import categories, filters as bot_filters, keyboards
 from backend.bot.handlers import callbacks
-from backend.models import TelegramUser, Category, Order, News
+from backend.models import TelegramUser, Order, News
 
 logger = logging.getLogger(__name__)
 
@@ -36,16 +34,17 @@ class CategoriesMessages(BaseMessageHandler):
     FILTERS = bot_filters.RegexFilter('^', 'categories')
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         from backend.bot import pagination
 
-        categories = Category.objects.annotate(cid=models.F('id')).values('cid', 'name')
-        if not categories:
+        rows = categories.tree.rows(lang=user.lang)
+        if not rows:
             update.effective_message.reply_text(_('not_choose_categories'), reply_markup=keyboards.main_menu(user))
             return False
 
         paginator = pagination.CallbackPaginator(
-            categories, callback=callbacks.CompaniesCallback,
-            page_callback=callbacks.CategoriesCallback, callback_data_keys=['cid']
+            rows, callback=callbacks.CompaniesCallback, page_callback=callbacks.CategoriesCallback,
+            title_pattern=callbacks.CategoriesCallback.category_title, callback_data_keys=['cid']
         )
         update.effective_message.reply_text(_('choose_category'), reply_markup=paginator.inline_markup)
 
@@ -54,6 +53,7 @@ class MyProfileMessages(BaseMessageHandler):
     FILTERS = bot_filters.RegexFilter('^', 'my_profile')
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         update.effective_message.reply_text(_('my_profile_data'), reply_markup=keyboards.profile_markup(user))
 
 
@@ -61,21 +61,22 @@ class OutgoingOrdersMessage(BaseMessageHandler):
     FILTERS = bot_filters.RegexFilter('^', 'outgoing_orders')
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         from backend.bot import pagination
         orders = Order.objects.filter(customer=user) \
             .exclude(status__in=user.order_filter_status) \
-            .values('id', 'status', 'service__name') \
-            .order_by('-updated')
+            .values('id', 'status', 'service__name', 'updated')
 
-        if not orders:
-            update.effective_message.reply_text(_('not_info_about_available_orders'))
-            return False
-
-        paginator = pagination.CallbackPaginator(
+        paginator = pagination.KeysetCallbackPaginator(
             orders, callback=callbacks.OutgoingOrderDetailCallback, page_callback=callbacks.OutgoingOrderCallback,
+            keys=('-updated', '-id'),
             title_pattern=lambda x: f"{Order.STATUS_EMOJI_DICT.get(x['status'])} {x['service__name']}",
-            callback_data_keys=['id'],
+            callback_data_keys=['id'], data_params={'page': 1},
         )
+        if not paginator.data:
+            update.effective_message.reply_text(_('not_info_about_available_orders'))
+            return False
+
         update.effective_message.reply_text(_('choose_order'), reply_markup=paginator.inline_markup)
 
 
@@ -83,13 +84,14 @@ class LocationMessages(BaseMessageHandler):
     FILTERS = Filters.location
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         location = update.effective_message.location
         user.options['location'] = {
             'longitude': location.longitude,
             'latitude': location.latitude,
             'last_update': timezone.now().strftime('%d-%m-%y %H:%M'),
         }
-        user.save()
+        user.save_changes()
         update.effective_message.reply_text(_('update_user_location'), reply_markup=keyboards.main_menu(user))
         update.effective_message.delete()
 
@@ -98,11 +100,12 @@ class ContactMessage(BaseMessageHandler):
     FILTERS = Filters.contact
 
     def callback(self, bot: Bot, update: Update, user: TelegramUser):
+        _ = user.catalog
         if update.effective_message.contact.user_id != update.effective_message.from_user.id:
             update.effective_message.reply_text(_('dont_send_someone_phone_number'))
             return False
         user.phone = update.effective_message.contact.phone_number
-        user.save()
+        user.save_changes()
         update.effective_message.reply_text(
             _('saved_user_phone').format(phone=user.phone),
             reply_markup=keyboards.main_menu(user)
@@ -112,6 +115,7 @@ class ContactMessage(BaseMessageHandler):
 
 def unknown(bot, update):
     user = TelegramUser.get_user(update.effective_message.from_user)
+    _ = user.catalog
     update.message.reply_text(_('unknown_message'), reply_markup=keyboards.main_menu(user))
     return 'unknown'
 
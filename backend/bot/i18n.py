@@ -0,0 +1,91 @@
+import gettext as gettext_module
+import os
+import sys
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import translation
+from django.utils.functional import Promise
+from django.utils.translation import to_locale
+
+
+def locale_paths():
+    """Locale directories from the highest priority down, the same order Django merges them in."""
+    paths = list(settings.LOCALE_PATHS)
+    paths += [os.path.join(app_config.path, 'locale') for app_config in apps.get_app_configs()]
+    paths.append(os.path.join(os.path.dirname(sys.modules[settings.__module__].__file__), 'locale'))
+    return paths
+
+
+class MessageCatalog:
+    """
+    Messages of one language, looked up without activating the language.
+
+    Handlers render for any user through `user.catalog`, so rendering for the other party of an order or
+    for a broadcast recipient never touches the active language of the thread, and two threads rendering
+    different languages at the same time never see each other's language.
+    """
+
+    def __init__(self, lang: str, fallback: 'MessageCatalog' = None):
+        self.lang = lang
+        self._translation = gettext_module.NullTranslations()
+        for path in reversed(locale_paths()):
+            found = gettext_module.translation('django', path, [to_locale(lang)], fallback=True)
+            if type(found) is not gettext_module.NullTranslations:
+                found.add_fallback(self._translation)
+                self._translation = found
+        if fallback is not None:
+            self._translation.add_fallback(fallback._translation)
+        self._messages = {}
+
+    def __call__(self, message):
+        return self.gettext(message)
+
+    def gettext(self, message):
+        if isinstance(message, Promise):
+            message = self.unlazy(message)
+        try:
+            return self._messages[message]
+        except KeyError:
+            pass
+        if not message:
+            return message
+        text = self._messages[message] = self._translation.gettext(message.replace('\r\n', '\n').replace('\r', '\n'))
+        return text
+
+    @staticmethod
+    def unlazy(message: Promise) -> str:
+        """Message id of a `gettext_lazy` string, other lazy objects can not be rendered for another language."""
+        func, args = message.__reduce__()[1][:2]
+        if func is not translation.gettext or len(args) != 1:
+            raise TypeError('Only gettext_lazy messages can be translated by a catalog, got {!r}'.format(func))
+        return args[0]
+
+
+class Catalogs:
+
+    def __init__(self):
+        self._catalogs = {}
+        self._lock = threading.RLock()
+
+    def get(self, lang: str) -> MessageCatalog:
+        catalog = self._catalogs.get(lang)
+        if catalog is None:
+            with self._lock:
+                catalog = self._catalogs.get(lang)
+                if catalog is None:
+                    fallback = self.get(settings.LANGUAGE_CODE) if lang != settings.LANGUAGE_CODE else None
+                    catalog = self._catalogs[lang] = MessageCatalog(lang, fallback)
+        return catalog
+
+    def preload(self, languages=None):
+        for code, name in languages or settings.LANGUAGES:
+            self.get(code)
+
+    def clear(self):
+        with self._lock:
+            self._catalogs = {}
+
+
+catalogs = Catalogs()
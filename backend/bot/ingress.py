@@ -0,0 +1,201 @@
+"""
+ASGI webhook endpoint acknowledging Telegram before the update is handled.
+
+Up to `QUEUE_SIZE` accepted updates wait for the per-chat lanes of `backend.bot.scheduler`, which handle
+the updates of a chat in order. When no slot frees up within `ENQUEUE_TIMEOUT` seconds the update is
+refused with `429`, which makes Telegram deliver it again later. The WSGI webhook view applies the same
+limit through `WebhookIngress.submit`.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import telegram
+from django.conf import settings
+from django_telegrambot.apps import DjangoTelegramBot
+
+from backend.bot import jobs
+from backend.bot.scheduler import ChatLaneScheduler, scheduler as update_scheduler, update_chat_id
+
+log = logging.getLogger(__name__)
+
+WEBHOOK_INGRESS = getattr(settings, 'WEBHOOK_INGRESS', {})
+JOB_QUEUE_SHUTDOWN_TIMEOUT = getattr(settings, 'JOB_QUEUE', {}).get('SHUTDOWN_TIMEOUT', 10)
+
+
+def webhook_prefix():
+    prefix = settings.DJANGO_TELEGRAMBOT.get('WEBHOOK_PREFIX', '/').strip('/')
+    return f'/{prefix}/' if prefix else '/'
+
+
+class IngressMetrics:
+
+    def __init__(self):
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.handle_total = 0.0
+        self.handle_max = 0.0
+        self._lock = threading.Lock()
+
+    def accepted(self):
+        with self._lock:
+            self.received += 1
+
+    def refused(self):
+        with self._lock:
+            self.dropped += 1
+
+    def handled(self, wait: float, duration: float, failed: bool):
+        with self._lock:
+            self.processed += 1
+            self.failed += failed
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.handle_total += duration
+            self.handle_max = max(self.handle_max, duration)
+
+    def snapshot(self):
+        with self._lock:
+            processed = self.processed or 1
+            return {
+                'received': self.received, 'processed': self.processed, 'failed': self.failed,
+                'dropped': self.dropped,
+                'wait_avg': self.wait_total / processed, 'wait_max': self.wait_max,
+                'handle_avg': self.handle_total / processed, 'handle_max': self.handle_max,
+            }
+
+
+class WebhookIngress:
+
+    def __init__(self, scheduler: ChatLaneScheduler = None, queue_size: int = None, enqueue_timeout: float = None,
+                 retry_after: int = None):
+        self.scheduler = scheduler or update_scheduler
+        self.queue_size = queue_size or WEBHOOK_INGRESS.get('QUEUE_SIZE', 1000)
+        self.enqueue_timeout = enqueue_timeout or WEBHOOK_INGRESS.get('ENQUEUE_TIMEOUT', 2)
+        self.retry_after = retry_after or WEBHOOK_INGRESS.get('RETRY_AFTER', 5)
+        self.prefix = webhook_prefix()
+        self.metrics = IngressMetrics()
+        self._capacity = None
+        self._loop = None
+        self._slots = threading.Semaphore(self.queue_size)
+
+    @property
+    def depth(self):
+        return self.scheduler.depth
+
+    @property
+    def stats(self):
+        return dict(self.metrics.snapshot(), depth=self.depth, capacity=self.queue_size, lanes=self.scheduler.lanes)
+
+    def matches(self, scope):
+        return scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'].startswith(self.prefix)
+
+    def start(self):
+        if self._capacity is not None:
+            return
+        self._loop = asyncio.get_event_loop()
+        self._capacity = asyncio.Semaphore(self.queue_size)
+        self.scheduler.start()
+
+    async def stop(self):
+        if self._loop is not None:
+            await self._loop.run_in_executor(None, self.scheduler.join)
+
+    async def enqueue(self, dispatcher, data: dict) -> bool:
+        self.start()
+        try:
+            await asyncio.wait_for(self._capacity.acquire(), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.metrics.refused()
+            return False
+        self.metrics.accepted()
+        self.scheduler.submit(
+            update_chat_id(data), self._handle, dispatcher, data, time.monotonic(),
+            callback=lambda failed: self._loop.call_soon_threadsafe(self._capacity.release),
+        )
+        return True
+
+    def submit(self, dispatcher, data: dict) -> bool:
+        """`enqueue` for the WSGI view, the request thread waits up to `enqueue_timeout` for a free slot."""
+        if not self._slots.acquire(timeout=self.enqueue_timeout):
+            self.metrics.refused()
+            return False
+        self.metrics.accepted()
+        self.scheduler.submit(
+            update_chat_id(data), self._handle, dispatcher, data, time.monotonic(),
+            callback=lambda failed: self._slots.release(),
+        )
+        return True
+
+    def _handle(self, dispatcher, data: dict, enqueued: float):
+        started = time.monotonic()
+        failed = False
+        try:
+            dispatcher.process_update(telegram.Update.de_json(data, dispatcher.bot))
+        except Exception:
+            failed = True
+            log.exception('Update %s failed', data.get('update_id'))
+        self.metrics.handled(started - enqueued, time.monotonic() - started, failed)
+
+    async def __call__(self, scope, receive, send):
+        token = scope['path'][len(self.prefix):].strip('/')
+        body, more = b'', True
+        while more:
+            message = await receive()
+            body += message.get('body', b'')
+            more = message.get('more_body', False)
+
+        status, headers = 200, []
+        dispatcher = DjangoTelegramBot.getDispatcher(token, safe=False)
+        if dispatcher is None:
+            log.warning('Request for not found token : %s', token)
+        else:
+            try:
+                data = json.loads(body.decode('utf-8'))
+            except ValueError:
+                log.warning('Telegram bot <%s> receive invalid request', dispatcher.bot.username)
+            else:
+                if not await self.enqueue(dispatcher, data):
+                    status, headers = 429, [(b'retry-after', str(self.retry_after).encode('ascii'))]
+
+        await send({
+            'type': 'http.response.start', 'status': status,
+            'headers': [(b'content-type', b'application/json')] + headers,
+        })
+        await send({'type': 'http.response.body', 'body': b'{}'})
+
+
+ingress = WebhookIngress()
+
+
+def webhook_application(django_application):
+    """
+    Wraps the Django ASGI application, serving the webhook through `ingress` and handling lifespan events.
+    The job poller runs only in this serving process, management commands never claim jobs.
+    """
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    ingress.start()
+                    if DjangoTelegramBot.dispatchers:
+                        jobs.start_poller(DjangoTelegramBot.dispatchers[0].bot)
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await ingress.stop()
+                    await asyncio.get_event_loop().run_in_executor(None, jobs.stop_poller, JOB_QUEUE_SHUTDOWN_TIMEOUT)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if ingress.matches(scope):
+            return await ingress(scope, receive, send)
+        return await django_application(scope, receive, send)
+
+    return application
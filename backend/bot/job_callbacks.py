@@ -1,33 +1,21 @@
-from django.utils import timezone
-from telegram.ext import Job
+import logging
 
-from django.utils.translation import gettext as _
-from telegram import Bot, InlineKeyboardButton as InlBtn, InlineKeyboardMarkup, ParseMode
+from telegram import Bot
 
+from backend.bot import broadcast, jobs
+from backend.models import Broadcast, News
 
-def notification_user_news(bot: Bot, job: Job):
-    from backend.bot.handlers.callbacks import CompanyDetailCallback
+log = logging.getLogger(__name__)
 
-    news = job.context
-    print('Start Notification news {}!!'.format(news.title))
 
-    if not news.notification_users:
-        job.schedule_removal()
+@jobs.register('notification_user_news')
+def notification_user_news(bot: Bot, news_id: int):
+    news = News.objects.select_related('company').filter(id=news_id).first()
+    if news is None or not news.notification_users:
         return
 
-    company = news.company
-    for watch in company.watches.all():
-        watch.telegram_user.activate()
-        reply_markup = InlineKeyboardMarkup([[
-            InlBtn(_('company'), callback_data=CompanyDetailCallback.set_data(id=news.company.id))
-        ]])
-        text = _('notification_news').format(
-            company=company.name,
-            title=news.title,
-            description=news.description,
-            time_news=timezone.now().strftime('%d-%m-%y %H:%M')
-        )
-        bot.send_message(
-            chat_id=watch.telegram_user.id, text=text, reply_markup=reply_markup, parse_mode=ParseMode.HTML
-        )
-    job.schedule_removal()
+    log.info('Start notification of news %s %s', news.id, news.title)
+    instance = Broadcast.objects.filter(news=news).exclude(status=Broadcast.DONE).first() \
+        or Broadcast.objects.create(news=news)
+    instance.news = news
+    broadcast.NewsBroadcaster(bot).run(instance)
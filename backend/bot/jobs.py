@@ -0,0 +1,189 @@
+import logging
+import os
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, models, transaction
+from django.utils import timezone
+from telegram import Bot
+
+from backend.models import ScheduledJob
+
+log = logging.getLogger(__name__)
+
+JOB_QUEUE = getattr(settings, 'JOB_QUEUE', {})
+
+registry = {}
+
+
+def register(name: str):
+    """Registers a job function called as `function(bot, **kwargs)` under `name`."""
+
+    def decorator(function):
+        registry[name] = function
+        return function
+
+    return decorator
+
+
+def schedule(name: str, delay: float = 0, run_at=None, dedup_key: str = None, **kwargs) -> ScheduledJob:
+    """
+    Stores a job to be run by a `JobPoller`. Keyword arguments must be JSON serializable, so pass ids
+    rather than model instances. While a job with the same `dedup_key` is pending or running it is
+    returned instead of scheduling another one.
+    """
+    assert name in registry, f'Job {name} is not registered'
+    job = ScheduledJob(
+        name=name, kwargs=kwargs, dedup_key=dedup_key,
+        run_at=run_at or timezone.now() + timezone.timedelta(seconds=delay),
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if dedup_key is None:
+            raise
+        job = ScheduledJob.objects.filter(
+            dedup_key=dedup_key, status__in=[ScheduledJob.PENDING, ScheduledJob.RUNNING]
+        ).first() or job
+    return job
+
+
+def backlog() -> dict:
+    due = ScheduledJob.objects.filter(status=ScheduledJob.PENDING, run_at__lte=timezone.now())
+    return due.aggregate(count=models.Count('id'), oldest=models.Min('run_at'))
+
+
+class JobPoller(threading.Thread):
+    """
+    Runs due `ScheduledJob` rows. Any number of pollers may share the table: jobs are claimed with
+    `SELECT ... FOR UPDATE SKIP LOCKED`, and running jobs are kept leased by a heartbeat so the jobs of a
+    crashed process are claimed again once their lease expires.
+    """
+
+    def __init__(self, bot: Bot, interval: float = None, batch_size: int = None, workers: int = None,
+                 lease: float = None, max_attempts: int = None, retry_delay: float = None):
+        super(JobPoller, self).__init__(name='job-poller', daemon=True)
+        self.bot = bot
+        self.interval = interval or JOB_QUEUE.get('POLL_INTERVAL', 1)
+        self.batch_size = batch_size or JOB_QUEUE.get('BATCH_SIZE', 10)
+        self.workers = workers or JOB_QUEUE.get('WORKERS', 4)
+        self.lease = lease or JOB_QUEUE.get('LEASE', 300)
+        self.max_attempts = max_attempts or JOB_QUEUE.get('MAX_ATTEMPTS', 5)
+        self.retry_delay = retry_delay or JOB_QUEUE.get('RETRY_DELAY', 30)
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+        self.metrics = {'claimed': 0, 'done': 0, 'failed': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+
+    def stop(self):
+        self._stop_event.set()
+
+    def claim(self, limit: int):
+        now = timezone.now()
+        expired = now - timezone.timedelta(seconds=self.lease)
+        with transaction.atomic():
+            jobs = list(
+                ScheduledJob.objects.select_for_update(skip_locked=True)
+                .filter(
+                    models.Q(status=ScheduledJob.PENDING, run_at__lte=now) |
+                    models.Q(status=ScheduledJob.RUNNING, locked_at__lt=expired)
+                )
+                .order_by('run_at')[:limit]
+            )
+            if jobs:
+                ScheduledJob.objects.filter(id__in=[job.id for job in jobs]).update(
+                    status=ScheduledJob.RUNNING, locked_by=self.worker_id, locked_at=now, started=now,
+                    attempts=models.F('attempts') + 1,
+                )
+        for job in jobs:
+            job.attempts += 1
+            latency = (now - job.run_at).total_seconds()
+            with self._lock:
+                self.metrics['claimed'] += 1
+                self.metrics['latency_total'] += latency
+                self.metrics['latency_max'] = max(self.metrics['latency_max'], latency)
+        return jobs
+
+    def heartbeat(self):
+        with self._lock:
+            running = list(self._running)
+        if running:
+            ScheduledJob.objects.filter(id__in=running, locked_by=self.worker_id).update(locked_at=timezone.now())
+
+    def execute(self, job: ScheduledJob):
+        close_old_connections()
+        try:
+            registry[job.name](self.bot, **job.kwargs)
+        except Exception:
+            log.exception('Job %s %s failed', job.id, job.name)
+            retry = job.attempts < self.max_attempts and job.name in registry
+            ScheduledJob.objects.filter(id=job.id).update(
+                status=ScheduledJob.PENDING if retry else ScheduledJob.FAILED,
+                run_at=timezone.now() + timezone.timedelta(seconds=self.retry_delay * 2 ** (job.attempts - 1)),
+                error=traceback.format_exc(), locked_by='', locked_at=None,
+            )
+            self._finish(job, 'failed')
+        else:
+            ScheduledJob.objects.filter(id=job.id).update(
+                status=ScheduledJob.DONE, finished=timezone.now(), locked_by='', locked_at=None,
+            )
+            self._finish(job, 'done')
+        finally:
+            close_old_connections()
+
+    def _finish(self, job: ScheduledJob, metric: str):
+        with self._lock:
+            self._running.discard(job.id)
+            self.metrics[metric] += 1
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics, running=len(self._running))
+        stats['latency_avg'] = stats['latency_total'] / stats['claimed'] if stats['claimed'] else 0.0
+        return stats
+
+    def run(self):
+        log.info('Job poller %s started', self.worker_id)
+        while not self._stop_event.is_set():
+            try:
+                self.heartbeat()
+                with self._lock:
+                    free = self.workers - len(self._running)
+                for job in self.claim(min(free, self.batch_size)) if free > 0 else []:
+                    with self._lock:
+                        self._running.add(job.id)
+                    self._executor.submit(self.execute, job)
+            except Exception:
+                log.exception('Job poller %s failed to claim jobs', self.worker_id)
+            finally:
+                close_old_connections()
+            self._stop_event.wait(self.interval)
+        self._executor.shutdown(wait=True)
+
+
+poller = None
+
+
+def start_poller(bot: Bot) -> JobPoller:
+    """Starts the poller of the serving process, never at import time: a poller claims and runs real jobs."""
+    global poller
+    if poller is None:
+        poller = JobPoller(bot)
+        poller.start()
+    return poller
+
+
+def stop_poller(timeout: float = None):
+    global poller
+    if poller is not None:
+        poller.stop()
+        poller.join(timeout)
+        poller = None
@@ -1,11 +1,14 @@
 import calendar
 import datetime
+import itertools
+import threading
 
 from django.conf import settings
-from django.utils.translation import gettext as _
+from django.utils.dates import MONTHS
 from telegram import InlineKeyboardButton as InlBtn, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 
 from backend.bot.handlers.callbacks import LanguageCallback, GradeCompanyCallback, FilterCallback, IncomingOrderCallback
+from backend.bot.i18n import catalogs
 from backend.models import TelegramUser, Company
 
 MAX_INLINE_BUTTON = 60
@@ -21,59 +24,143 @@ def build_menu(buttons, cols=2, header_buttons=None, footer_buttons=None):
     return menu
 
 
-def main_menu(user):
+class KeyboardRegistry:
+    """
+    Static menus serialized once per language and flag set.
+
+    A builder is called as `builder(catalog, *flags)` for every combination of its flag values, and the
+    JSON of the markup it returns is sent as is, ptb passes a `reply_markup` string through unchanged.
+    """
+
+    def __init__(self):
+        self._builders = {}
+        self._markups = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, *flags):
+        def decorator(builder):
+            self._builders[name] = (builder, flags)
+            return builder
+
+        return decorator
+
+    def build(self, languages=None):
+        markups = {}
+        for code, lang in languages or settings.LANGUAGES:
+            catalog = catalogs.get(code)
+            for name, (builder, flags) in self._builders.items():
+                for values in itertools.product(*flags):
+                    markups[(name, code) + values] = builder(catalog, *values).to_json()
+        with self._lock:
+            self._markups = markups
+
+    def get(self, name: str, lang: str, *values) -> str:
+        key = (name, lang) + values
+        markup = self._markups.get(key)
+        if markup is None:
+            builder, flags = self._builders[name]
+            markup = builder(catalogs.get(lang), *values).to_json()
+            with self._lock:
+                self._markups[key] = markup
+        return markup
+
+
+registry = KeyboardRegistry()
+
+
+@registry.register('main_menu', (False, True))
+def build_main_menu(catalog, has_profile):
     keyboards = [
-        KeyboardButton(_('categories')),
-        KeyboardButton(_('get_location'), request_location=True),
-        KeyboardButton(_('outgoing_orders')),
+        KeyboardButton(catalog('categories')),
+        KeyboardButton(catalog('get_location'), request_location=True),
+        KeyboardButton(catalog('outgoing_orders')),
     ]
-    if hasattr(user, 'profile'):
-        keyboards.insert(1, KeyboardButton(_('my_profile')))
+    if has_profile:
+        keyboards.insert(1, KeyboardButton(catalog('my_profile')))
     return ReplyKeyboardMarkup(build_menu(keyboards, cols=2), resize_keyboard=True)
 
 
-def language(user: TelegramUser):
+@registry.register('language', [key for key, lang in settings.LANGUAGES])
+def build_language(catalog, current):
     buttons = []
     for key, lang in settings.LANGUAGES:
-        buttons.append(
-            InlBtn(f"{lang} {'✔️' if key == user.lang else ''}", callback_data=LanguageCallback.set_data(lang=f'{key}'))
-        )
+        buttons.append(InlBtn(
+            f"{catalog(lang)} {'✔️' if key == current else ''}", callback_data=LanguageCallback.set_data(lang=f'{key}')
+        ))
     return InlineKeyboardMarkup(build_menu(buttons))
 
 
-def site_btn():
+@registry.register('site_btn')
+def build_site_btn(catalog):
     return InlineKeyboardMarkup(build_menu([
-        InlBtn(_('site_url'), url=settings.SITE_HOST)
+        InlBtn(catalog('site_url'), url=settings.SITE_HOST)
     ]))
 
 
-def generate_calendar(user, callback, year=None, month=None, date_from=None, date_to=None):
+@registry.register('settings', (False, True))
+def build_settings(catalog, has_phone):
+    keyboards = [
+        KeyboardButton(catalog('get_location'), request_location=True),
+    ]
+    if not has_phone:
+        keyboards.append(KeyboardButton(catalog('get_phone'), request_contact=True))
+    return ReplyKeyboardMarkup(build_menu(keyboards, cols=1))
+
+
+@registry.register('profile')
+def build_profile(catalog):
+    keyboards = [
+        InlBtn(catalog('incoming orders'), callback_data=IncomingOrderCallback.set_data())
+    ]
+    return InlineKeyboardMarkup(build_menu(keyboards, cols=1))
+
+
+def main_menu(user):
+    return registry.get('main_menu', user.lang, hasattr(user, 'profile'))
+
+
+def language(user: TelegramUser):
+    return registry.get('language', user.lang, user.lang)
+
+
+def site_btn(user: TelegramUser):
+    return registry.get('site_btn', user.lang)
+
+
+def generate_calendar(user, callback, year=None, month=None, date_from=None, date_to=None, available_days=None,
+                      **params):
     now = datetime.datetime.now()
     if not year:
         year = now.year
     if not month:
         month = now.month
-    data_ignore = callback.set_callback_data(st='ignore', year=year, month=month)
+    data_ignore = callback.set_data(st='ignore', **params)
     keyboard = [[
-        InlBtn(calendar.month_name[month] + " " + str(year), callback_data=data_ignore)
+        InlBtn(user.catalog(MONTHS[month]) + " " + str(year), callback_data=data_ignore)
     ]]
+    marked = {
+        value.date() if isinstance(value, datetime.datetime) else value for value in (date_from, date_to) if value
+    }
     my_calendar = calendar.monthcalendar(year, month)
     for week in my_calendar:
         row = []
         for day in week:
             if not day:
                 row.append(InlBtn(" ", callback_data=data_ignore))
-            else:
-                date = datetime.date(year, month, day)
-                text = '*%s' % day if date == date_from.date() or date == date_to.date() else str(day)
-                row.append(
-                    InlBtn(text, callback_data=callback.set_callback_data(st="day", date=date.strftime('%Y-%m-%d')))
-                )
+                continue
+            date = datetime.date(year, month, day)
+            if available_days is not None and date not in available_days:
+                row.append(InlBtn("·", callback_data=data_ignore))
+                continue
+            text = '*%s' % day if date in marked else str(day)
+            row.append(InlBtn(text, callback_data=callback.set_data(st='day', y=year, m=month, d=day, **params)))
         keyboard.append(row)
+    prev_year, prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
+    next_year, next_month = (year, month + 1) if month < 12 else (year + 1, 1)
     row = []
-    row.append(InlBtn("<", callback_data=callback.set_callback_data(st='prev', year=year, month=month - 1)))
+    row.append(InlBtn("<", callback_data=callback.set_data(st='prev', y=prev_year, m=prev_month, **params)))
     row.append(InlBtn(" ", callback_data=data_ignore))
-    row.append(InlBtn(">", callback_data=callback.set_callback_data(st='next', year=year, month=month + 1)))
+    row.append(InlBtn(">", callback_data=callback.set_data(st='next', y=next_year, m=next_month, **params)))
     keyboard.append(row)
 
     return InlineKeyboardMarkup(keyboard)
@@ -88,6 +175,7 @@ def grade_buttons(company: Company):
 
 
 def filter_markup(user: TelegramUser):
+    _ = user.catalog
     keyboard = [
         InlBtn(
             _('by_rating') + (' ✅' if user.orders.get('by') == 'mark' else ''),
@@ -114,16 +202,8 @@ def filter_markup(user: TelegramUser):
 
 
 def settings_markup(user: TelegramUser):
-    keyboards = [
-        KeyboardButton(_('get_location'), request_location=True),
-    ]
-    if not user.phone:
-        keyboards.append(KeyboardButton(_('get_phone'), request_contact=True))
-    return ReplyKeyboardMarkup(build_menu(keyboards, cols=1))
+    return registry.get('settings', user.lang, bool(user.phone))
 
 
 def profile_markup(user: TelegramUser):
-    keyboards = [
-        InlBtn(_('incoming orders'), callback_data=IncomingOrderCallback.set_data())
-    ]
-    return InlineKeyboardMarkup(build_menu(keyboards, cols=1))
+    return registry.get('profile', user.lang)
@@ -0,0 +1,25 @@
+from django.db import models
+from django.utils import timezone
+
+from backend.models import Company, Grade, News, Service, TelegramUser, TimeWork, WatchCompanyTelegramUser
+
+
+def active_news_filter():
+    now = timezone.now()
+    return (models.Q(date_from__lte=now) | models.Q(date_from__isnull=True)) & \
+        (models.Q(date_to__gte=now) | models.Q(date_to__isnull=True))
+
+
+def load_company_detail(company_id, user: TelegramUser):
+    """
+    Company card data in two queries: the company annotated with the viewer's watch and grade flags and the
+    existence of services and active news, plus the prefetched work days (`company.work_days`).
+    """
+    company = models.OuterRef('pk')
+    work_days = TimeWork.objects.exclude(is_lunch=True).order_by('week_day')
+    return Company.objects.filter(id=company_id).annotate(
+        is_watched=models.Exists(WatchCompanyTelegramUser.objects.filter(company=company, telegram_user=user)),
+        is_graded=models.Exists(Grade.objects.filter(company=company, reviewer_user=user)),
+        has_services=models.Exists(Service.objects.filter(performer=company)),
+        has_news=models.Exists(News.objects.filter(active_news_filter(), company=company)),
+    ).prefetch_related(models.Prefetch('time_works', queryset=work_days, to_attr='work_days')).first()
@@ -0,0 +1,91 @@
+import base64
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from backend.cache import LRUCache
+
+NAVIGATION_STATE = getattr(settings, 'BOT_NAVIGATION_STATE', {})
+
+
+class StateExpired(Exception):
+    """The token of a button is unknown, its state was purged or never stored."""
+
+
+class BaseStateBackend:
+
+    def load(self, token: str):
+        raise NotImplementedError
+
+    def save(self, token: str, state: dict):
+        raise NotImplementedError
+
+    def purge(self, older_than):
+        raise NotImplementedError
+
+
+class DatabaseStateBackend(BaseStateBackend):
+
+    def load(self, token: str):
+        from backend.models import NavigationState
+        return NavigationState.objects.filter(token=token).values_list('state', flat=True).first()
+
+    def save(self, token: str, state: dict):
+        from backend.models import NavigationState
+        NavigationState.objects.bulk_create([NavigationState(token=token, state=state)], ignore_conflicts=True)
+
+    def purge(self, older_than):
+        from backend.models import NavigationState
+        return NavigationState.objects.filter(created__lt=older_than).delete()[0]
+
+
+class NavigationStore:
+    """
+    Keeps navigation state server-side so inline buttons only carry a short token.
+
+    Tokens are derived from the state itself, so re-rendering the same keyboard reuses the stored row.
+    """
+    TOKEN_SIZE = 9
+
+    def __init__(self, backend: BaseStateBackend, cache_size: int = 4096):
+        self.backend = backend
+        self._cache = LRUCache(cache_size)
+
+    @classmethod
+    def make_token(cls, state: dict) -> str:
+        digest = hashlib.blake2b(
+            json.dumps(state, sort_keys=True, default=str).encode('utf-8'), digest_size=cls.TOKEN_SIZE
+        ).digest()
+        return base64.urlsafe_b64encode(digest).decode('ascii')
+
+    def put(self, state: dict) -> str:
+        token = self.make_token(state)
+        if self._cache.get(token, count=False) is None:
+            self.backend.save(token, state)
+            self._cache.set(token, state)
+        return token
+
+    def get(self, token: str) -> dict:
+        state = self._cache.get(token)
+        if state is None:
+            state = self.backend.load(token)
+            if state is None:
+                raise StateExpired(token)
+            self._cache.set(token, state)
+        return dict(state)
+
+    def purge(self, days: int):
+        return self.backend.purge(timezone.now() - timezone.timedelta(days=days))
+
+    @property
+    def stats(self):
+        return self._cache.stats
+
+
+store = NavigationStore(
+    import_string(NAVIGATION_STATE.get('BACKEND', 'backend.bot.navigation.DatabaseStateBackend'))(),
+    cache_size=NAVIGATION_STATE.get('CACHE_SIZE', 4096),
+)
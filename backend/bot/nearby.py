@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.db import connection, models
+
+from backend.bot import distance
+
+NEARBY_RADIUS_KM = getattr(settings, 'NEARBY_RADIUS_KM', None)
+
+
+class KNNDistance(models.Func):
+    """PostGIS `<->` operator, lets ORDER BY walk the GiST index of the geometry nearest first."""
+    arg_joiner = ' <-> '
+    template = '%(expressions)s'
+    output_field = models.FloatField()
+
+
+def uses_postgis():
+    return getattr(connection.ops, 'postgis', False)
+
+
+def order_by_distance(companies, longitude, latitude, category_ids):
+    """
+    Limit a `values()` queryset of companies of `category_ids` to those with coordinates, nearest to the given
+    location first. Returns the paginator data and a title pattern prefixing the company name with its distance.
+    """
+    if uses_postgis():
+        return _order_by_point(companies, Point(longitude, latitude, srid=4326))
+    return _order_by_coordinates(companies, longitude, latitude, category_ids)
+
+
+def _order_by_point(companies, location):
+    companies = companies.filter(point__isnull=False)
+    if NEARBY_RADIUS_KM:
+        companies = companies.filter(point__distance_lte=(location, D(km=NEARBY_RADIUS_KM)))
+    companies = companies.annotate(distance=Distance('point', location)) \
+        .order_by(KNNDistance('point', models.Value(location, output_field=GeometryField(srid=4326))))
+    return companies, lambda x: f"{round(x['distance'].km, 2)} km {x['name']}"
+
+
+def _order_by_coordinates(companies, longitude, latitude, category_ids):
+    companies = distance.DistanceRankedCompanies(
+        companies, distance.coordinate_index.get(category_ids), latitude, longitude
+    )
+    if NEARBY_RADIUS_KM:
+        companies.limit(NEARBY_RADIUS_KM)
+    return companies, lambda x: f"{x['distance']} km {x['name']}"
@@ -0,0 +1,68 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from telegram import Bot
+from telegram.error import InvalidToken, TelegramError
+
+log = logging.getLogger(__name__)
+
+ORDER_NOTIFICATIONS = getattr(settings, 'ORDER_NOTIFICATIONS', {})
+
+executor = ThreadPoolExecutor(
+    max_workers=ORDER_NOTIFICATIONS.get('WORKERS', 8), thread_name_prefix='notifications'
+)
+
+# Set once the Bot API rejected `deleteMessages`, older servers only know `deleteMessage`.
+_batch_delete_unsupported = threading.Event()
+
+
+def _delete_message(bot: Bot, chat_id: int, message_id: int):
+    try:
+        bot.delete_message(chat_id, message_id)
+    except TelegramError:
+        log.error(f'Message {message_id} for chat {chat_id} not found')
+
+
+def _delete_batch(bot: Bot, chat_id: int, message_ids: list):
+    try:
+        bot.request.post('{}/deleteMessages'.format(bot.base_url), {'chat_id': chat_id, 'message_ids': message_ids})
+    except TelegramError as e:
+        if isinstance(e, InvalidToken):
+            _batch_delete_unsupported.set()
+        for message_id in message_ids:
+            _delete_message(bot, chat_id, message_id)
+
+
+def delete_messages(bot: Bot, chat_id: int, message_ids: list):
+    """Deletes the messages in the background, in one request when the Bot API supports `deleteMessages`."""
+    if len(message_ids) > 1 and not _batch_delete_unsupported.is_set():
+        return [executor.submit(_delete_batch, bot, chat_id, list(message_ids))]
+    return [executor.submit(_delete_message, bot, chat_id, message_id) for message_id in message_ids]
+
+
+def send_message(bot: Bot, chat_id: int, text: str, **kwargs):
+    return executor.submit(bot.send_message, chat_id=chat_id, text=text, **kwargs)
+
+
+def when_done(futures: list, callback):
+    """Calls `callback(futures)` in the thread finishing the last of `futures`, without blocking the caller."""
+    pending = [len(futures)]
+    lock = threading.Lock()
+
+    def done(future):
+        with lock:
+            pending[0] -= 1
+            if pending[0]:
+                return
+        try:
+            callback(futures)
+        except Exception:
+            log.exception('Notification callback failed')
+        finally:
+            close_old_connections()
+
+    for future in futures:
+        future.add_done_callback(done)
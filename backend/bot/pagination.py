@@ -1,13 +1,31 @@
+import datetime
+import json
+import math
+import re
 from typing import List
 
+from django.conf import settings
 from django.core.paginator import Paginator
+from django.db import models
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 
 from backend.bot.keyboards import build_menu
+from backend.cache import LRUCache, TTLCache
 
 PAGE_SIZE = 7
 MAX_PAGE_SIZE = 50
 
+NEXT, PREVIOUS = 'n', 'p'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Totals of keyset lists: a COUNT cached for COUNT_TTL seconds, or the row estimate of the query plan.
+EXACT_COUNT, ESTIMATED_COUNT = 'exact', 'estimate'
+
+KEYSET_PAGINATION = getattr(settings, 'KEYSET_PAGINATION', {})
+
+layout_cache = LRUCache(max_size=4096)
+count_cache = TTLCache(max_size=1024, ttl=KEYSET_PAGINATION.get('COUNT_TTL', 600))
+
 
 class BasePaginator:
     _keyboard = None
@@ -38,7 +56,155 @@ class BasePaginator:
         return self._paginator.num_pages
 
 
+class KeysetPaginator:
+    """
+    Pages an ordered `values()` queryset by the last seen `keys` instead of OFFSET, so every page turn is one
+    range scan on an index over `keys` whatever the depth. The cursor is the key values of the boundary row.
+
+    The total is off by default, counting would scan the history the keyset avoids. `count` turns it on
+    as an `EXACT_COUNT` cached for a while or an `ESTIMATED_COUNT` read from the query plan.
+    """
+
+    def __init__(self, data, keys=('-updated', '-id'), cursor: str = None, direction: str = NEXT,
+                 page: int = 1, page_size: int = PAGE_SIZE, count: str = None):
+        assert page > 0, 'Page must more than 0'
+        if page_size is not None:
+            assert page_size <= MAX_PAGE_SIZE, f'Page size must less MAX_PAGE_SIZE = {MAX_PAGE_SIZE}'
+        self._queryset = data
+        self._keys = [(key.lstrip('-'), key.startswith('-')) for key in keys]
+        self._cursor = cursor
+        self._direction = direction
+        self._page = page
+        self._page_size = page_size or PAGE_SIZE
+        self._count = count
+        self._rows = None
+        self._has_next = self._has_previous = False
+
+    def _key_fields(self):
+        return [self._queryset.model._meta.get_field(name) for name, descending in self._keys]
+
+    def _after(self, values, reverse=False):
+        condition = models.Q()
+        for index, (name, descending) in enumerate(self._keys):
+            lookup = 'lt' if descending != reverse else 'gt'
+            branch = models.Q(**{f'{name}__{lookup}': values[index]})
+            for previous_index in range(index):
+                branch &= models.Q(**{self._keys[previous_index][0]: values[previous_index]})
+            condition |= branch
+        return condition
+
+    def _ordering(self, reverse=False):
+        return ['-' + name if descending != reverse else name for name, descending in self._keys]
+
+    def _fetch(self):
+        queryset = self._queryset.order_by(*self._ordering())
+        if self._cursor and self._direction == PREVIOUS:
+            values = self.decode_cursor(self._cursor)
+            rows = list(
+                self._queryset.filter(self._after(values, reverse=True))
+                .order_by(*self._ordering(reverse=True))[:self._page_size + 1]
+            )
+            if len(rows) > self._page_size:
+                self._has_previous = True
+                self._has_next = True
+                return rows[:self._page_size][::-1]
+            # reached the beginning, show a full first page
+            self._page = 1
+            self._cursor = None
+        elif self._cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(self._cursor)))
+            self._has_previous = True
+        rows = list(queryset[:self._page_size + 1])
+        self._has_next = len(rows) > self._page_size
+        return rows[:self._page_size]
+
+    def encode_cursor(self, row):
+        values = []
+        for name, descending in self._keys:
+            value = row[name]
+            if isinstance(value, datetime.datetime):
+                value = (value.replace(tzinfo=None) - EPOCH) // datetime.timedelta(microseconds=1)
+            elif isinstance(value, datetime.date):
+                value = value.toordinal()
+            values.append(value)
+        return json.dumps(values, separators=(',', ':'), ensure_ascii=False)
+
+    def decode_cursor(self, cursor: str):
+        values = []
+        for field, value in zip(self._key_fields(), json.loads(cursor)):
+            if isinstance(field, models.DateTimeField):
+                value = EPOCH + datetime.timedelta(microseconds=value)
+            elif isinstance(field, models.DateField):
+                value = datetime.date.fromordinal(value)
+            values.append(value)
+        return values
+
+    def _load(self):
+        if self._rows is None:
+            self._rows = self._fetch()
+
+    @property
+    def data(self):
+        self._load()
+        return self._rows
+
+    @property
+    def page(self):
+        self._load()
+        return self._page
+
+    @property
+    def cursor(self):
+        self._load()
+        return self._cursor
+
+    @property
+    def direction(self):
+        return self._direction
+
+    @property
+    def has_next(self):
+        self._load()
+        return self._has_next
+
+    @property
+    def has_previous(self):
+        self._load()
+        return self._has_previous
+
+    @property
+    def first_cursor(self):
+        return self.encode_cursor(self.data[0]) if self.data else None
+
+    @property
+    def last_cursor(self):
+        return self.encode_cursor(self.data[-1]) if self.data else None
+
+    @property
+    def is_estimated(self):
+        return self._count == ESTIMATED_COUNT
+
+    @property
+    def page_count(self):
+        if self._count is None:
+            return None
+        query = self._queryset.order_by()
+        key = (self._count, str(query.query))
+        if self.is_estimated:
+            rows = count_cache.get_or_set(key, lambda: self.estimate_rows(query))
+        else:
+            rows = count_cache.get_or_set(key, query.count)
+        return max(math.ceil(rows / self._page_size), 1)
+
+    @staticmethod
+    def estimate_rows(queryset) -> int:
+        """Rows the planner expects `queryset` to return, without running it."""
+        match = re.search(r'rows=(\d+)', queryset.explain())
+        return int(match.group(1)) if match else 0
+
+
 class CallbackPaginator(BasePaginator):
+    cache_layouts = True
 
     def __init__(
             self, data, callback, page_callback,
@@ -55,20 +221,8 @@ class CallbackPaginator(BasePaginator):
         self._callback = callback
 
     def _build(self):
-        keyboard_page = list()
-        if self.page_count == 1:
-            self._keyboard_page = list()
-        elif self.page_count <= 5:
-            for page in self._paginator.page_range:
-                keyboard_page.append(
-                    InlineKeyboardButton(
-                        self.current_page_label.format(page) if self._page == page else str(page),
-                        callback_data=self._page_callback.set_data(page=page, **self._page_params))
-                )
-        else:
-            keyboard_page = self._build_multi_pages()
         keyboard_data = self._build_data()
-        self._keyboard = build_menu(keyboard_data, footer_buttons=keyboard_page, cols=1)
+        self._keyboard = build_menu(keyboard_data, footer_buttons=self._build_pages(), cols=1)
 
     def _build_data(self):
         keyboard = []
@@ -84,77 +238,102 @@ class CallbackPaginator(BasePaginator):
             )
         return keyboard
 
-    def _build_multi_pages(self):
-        if self._page <= 3:
-            return self._build_start_keyboard()
-        elif self._page > self.page_count - 3:
-            return self._build_finish_keyboard()
-        else:
-            return self._build_middle_keyboard()
+    def _page_layout(self):
+        page, page_count = self._page, self.page_count
 
-    def _build_start_keyboard(self):
-        keyboard_list = []
-        count = 4
-        for page in range(1, count):
-            keyboard_list.append(
-                InlineKeyboardButton(
-                    self.current_page_label.format(page) if self._page == page else str(page),
-                    callback_data=self._page_callback.set_data(page=page, **self._page_params)
-                )
-            )
-        keyboard_list.extend([
-            InlineKeyboardButton(
-                self.next_page_label.format(count),
-                callback_data=self._page_callback.set_data(page=count, **self._page_params)),
-            InlineKeyboardButton(
-                str(self.page_count),
-                callback_data=self._page_callback.set_data(page=self.page_count, **self._page_params))
-        ])
-        return keyboard_list
-
-    def _build_finish_keyboard(self):
-        keyboard_list = []
-        keyboard_list.extend([
-            InlineKeyboardButton(self.first_page_label.format(1), callback_data=self._page_callback.set_data(page=1)),
-            InlineKeyboardButton(
-                self.previous_page_label.format(self.page_count - 3),
-                callback_data=self._page_callback.set_data(page=self.page_count - 3, **self._page_params)
-            )
-        ])
-        for page in range(self.page_count - 2, self.page_count + 1):
-            keyboard_list.append(
-                InlineKeyboardButton(
-                    self.current_page_label.format(page) if self._page == page else str(page),
-                    callback_data=self._page_callback.set_data(page=page, **self._page_params)
-                )
-            )
-        return keyboard_list
+        def numbered(pages):
+            return [(self.current_page_label.format(i) if page == i else str(i), i) for i in pages]
 
-    def _build_middle_keyboard(self):
+        if page_count <= 5:
+            return numbered(range(1, page_count + 1))
+        if page <= 3:
+            return numbered(range(1, 4)) + [(self.next_page_label.format(4), 4), (str(page_count), page_count)]
+        if page > page_count - 3:
+            return [
+                (self.first_page_label.format(1), 1),
+                (self.previous_page_label.format(page_count - 3), page_count - 3),
+            ] + numbered(range(page_count - 2, page_count + 1))
         return [
-            InlineKeyboardButton(
-                self.first_page_label.format(1),
-                callback_data=self._page_callback.set_data(page=1, **self._page_params)
-            ),
-            InlineKeyboardButton(
-                self.previous_page_label.format(self._page - 1),
-                callback_data=self._page_callback.set_data(page=self._page - 1, **self._page_params)
-            ),
-            InlineKeyboardButton(
-                self.current_page_label.format(self._page),
-                callback_data=self._page_callback.set_data(page=self._page, **self._page_params)),
-            InlineKeyboardButton(
-                self.next_page_label.format(self._page + 1),
-                callback_data=self._page_callback.set_data(page=self._page + 1, **self._page_params)
-            ),
-            InlineKeyboardButton(
-                self.last_page_label.format(self.page_count),
-                callback_data=self._page_callback.set_data(page=self.page_count, **self._page_params)
-            )
+            (self.first_page_label.format(1), 1),
+            (self.previous_page_label.format(page - 1), page - 1),
+            (self.current_page_label.format(page), page),
+            (self.next_page_label.format(page + 1), page + 1),
+            (self.last_page_label.format(page_count), page_count),
         ]
 
+    def _build_pages(self):
+        def build():
+            return tuple(
+                InlineKeyboardButton(label, callback_data=self._page_callback.set_data(page=page, **self._page_params))
+                for label, page in self._page_layout()
+            )
+
+        if self.page_count == 1:
+            return []
+        if not self.cache_layouts:
+            return list(build())
+        key = (
+            self.page_count, self._page, self._page_callback.PATTERN,
+            tuple(sorted(self._page_params.items())),
+        )
+        return list(layout_cache.get_or_set(key, build))
+
     @property
     def inline_markup(self):
         if self._keyboard is None:
             self._build()
         return InlineKeyboardMarkup(self._keyboard)
+
+
+class KeysetCallbackPaginator(CallbackPaginator):
+    """
+    `CallbackPaginator` over a `KeysetPaginator`. Page buttons carry the page cursor as `cur` and the
+    direction as `dir` in addition to `page`, so `page_callback` must accept them.
+    """
+
+    def __init__(
+            self, data, callback, page_callback, keys=('-updated', '-id'),
+            cursor: str = None, direction: str = NEXT, page: int = 1, page_size: int = PAGE_SIZE,
+            title_pattern=lambda x: x['name'], callback_data_keys: List[str] = None,
+            page_params: dict = None, data_params: dict = None, count: str = None,
+    ):
+        super(KeysetCallbackPaginator, self).__init__(
+            data, callback, page_callback, page, page_size, title_pattern, callback_data_keys, page_params, data_params
+        )
+        self._keyset = KeysetPaginator(data, keys, cursor, direction, page, page_size, count)
+
+    @property
+    def data(self):
+        return self._keyset.data
+
+    @property
+    def page_count(self):
+        return self._keyset.page_count
+
+    def _page_button(self, label, page, cursor=None, direction=None):
+        params = dict(self._page_params, page=page)
+        if cursor:
+            params.update(cur=cursor, dir=direction)
+        return InlineKeyboardButton(label, callback_data=self._page_callback.set_data(**params))
+
+    def _build(self):
+        keyset, keyboard_page = self._keyset, []
+        page = keyset.page
+        if keyset.has_previous or keyset.has_next:
+            if page > 2:
+                keyboard_page.append(self._page_button(self.first_page_label.format(1), 1))
+            if keyset.has_previous:
+                keyboard_page.append(self._page_button(
+                    self.previous_page_label.format(page - 1), page - 1, keyset.first_cursor, PREVIOUS
+                ))
+            label = str(page)
+            if self.page_count is not None:
+                label = f"{page}/{'~' if keyset.is_estimated else ''}{self.page_count}"
+            keyboard_page.append(self._page_button(
+                self.current_page_label.format(label), page, keyset.cursor, keyset.direction
+            ))
+            if keyset.has_next:
+                keyboard_page.append(self._page_button(
+                    self.next_page_label.format(page + 1), page + 1, keyset.last_cursor, NEXT
+                ))
+        self._keyboard = build_menu(self._build_data(), footer_buttons=keyboard_page, cols=1)
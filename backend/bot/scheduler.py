@@ -0,0 +1,141 @@
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from telegram import Update
+
+log = logging.getLogger(__name__)
+
+UPDATE_SCHEDULER = getattr(settings, 'UPDATE_SCHEDULER', {})
+
+_STOP = object()
+
+
+def update_chat_id(data: dict):
+    """Chat of a raw update, the sender for updates without a chat, `None` for updates with neither."""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        sender = value.get('from') or value.get('user')
+        if sender:
+            return sender['id']
+    return None
+
+
+def chat_key(update: Update):
+    if update.effective_chat:
+        return update.effective_chat.id
+    return update.effective_user.id if update.effective_user else None
+
+
+class ChatLaneScheduler:
+    """
+    Runs the tasks of a chat one after another in submission order, tasks of different chats in parallel.
+
+    Every chat id is hashed to one of `lanes` worker threads, so two rapid clicks of a user never race on
+    its `TelegramUser.options`, while a slow chat only delays the chats sharing its lane.
+    """
+
+    def __init__(self, lanes: int = 8, name: str = 'lane'):
+        self.name = name
+        self._queues = [queue.Queue() for _ in range(lanes)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def lanes(self):
+        return len(self._queues)
+
+    @property
+    def depth(self):
+        return sum(lane.qsize() for lane in self._queues)
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'lanes': self.lanes, 'depth': self.depth,
+                'submitted': self.submitted, 'completed': self.completed, 'failed': self.failed,
+            }
+
+    def lane_of(self, chat_id) -> int:
+        return hash(chat_id) % len(self._queues)
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [
+                threading.Thread(target=self._work, args=(lane,), name=f'{self.name}-{index}', daemon=True)
+                for index, lane in enumerate(self._queues)
+            ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, chat_id, function, *args, callback=None):
+        """Queues `function(*args)` on the lane of `chat_id`, `callback(failed)` is called after it ran."""
+        self.start()
+        with self._lock:
+            self.submitted += 1
+        self._queues[self.lane_of(chat_id)].put((function, args, callback))
+
+    def join(self):
+        for lane in self._queues:
+            lane.join()
+
+    def stop(self):
+        for lane in self._queues:
+            lane.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self, lane: queue.Queue):
+        while True:
+            task = lane.get()
+            if task is _STOP:
+                lane.task_done()
+                return
+            function, args, callback = task
+            failed = False
+            try:
+                function(*args)
+            except Exception:
+                failed = True
+                log.exception('Task of %s failed', threading.current_thread().name)
+            finally:
+                close_old_connections()
+            with self._lock:
+                self.completed += 1
+                self.failed += failed
+            try:
+                if callback is not None:
+                    callback(failed)
+            finally:
+                lane.task_done()
+
+
+scheduler = ChatLaneScheduler(UPDATE_SCHEDULER.get('LANES', 8), name='updates')
+
+
+def schedule_updates(dispatcher, lane_scheduler: ChatLaneScheduler = None):
+    """Makes `dispatcher` hand its updates to the chat lanes instead of handling them on its own thread."""
+    lane_scheduler = lane_scheduler or scheduler
+    process_update = dispatcher.process_update
+
+    def scheduled_process_update(update):
+        if isinstance(update, Update):
+            lane_scheduler.submit(chat_key(update), process_update, update)
+        else:
+            process_update(update)
+
+    dispatcher.process_update = scheduled_process_update
+    return dispatcher
@@ -0,0 +1,120 @@
+"""
+Bot API transport: a keep-alive connection pool sized to the threads calling the Bot API, with latency
+histograms per API method.
+
+urllib3 sends one request per connection at a time, there is no HTTP/1.1 pipelining, so concurrency
+comes from the pool size: every lane, notification, broadcast and job thread can hold a connection.
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from telegram import Bot
+from telegram.utils.request import Request
+
+BOT_API = getattr(settings, 'BOT_API', {})
+
+# Upper bounds of the histogram buckets in milliseconds, the last bucket is unbounded.
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def default_pool_size():
+    """One connection for every thread that may call the Bot API at the same time."""
+    threads = [
+        getattr(settings, 'UPDATE_SCHEDULER', {}).get('LANES', 8),
+        getattr(settings, 'ORDER_NOTIFICATIONS', {}).get('WORKERS', 8),
+        getattr(settings, 'NEWS_BROADCAST', {}).get('WORKERS', 8),
+        getattr(settings, 'JOB_QUEUE', {}).get('WORKERS', 4),
+    ]
+    return sum(threads) + 4
+
+
+class LatencyHistogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float, failed: bool = False):
+        milliseconds = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets, milliseconds)] += 1
+        self.count += 1
+        self.errors += failed
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def percentile(self, fraction: float):
+        """Upper bound of the bucket holding the `fraction` quantile, `max` for the unbounded bucket."""
+        rank, seen = fraction * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return 0.0
+
+    def snapshot(self):
+        return {
+            'count': self.count, 'errors': self.errors,
+            'avg_ms': self.total / self.count if self.count else 0.0, 'max_ms': self.max,
+            'p50_ms': self.percentile(0.5), 'p95_ms': self.percentile(0.95), 'p99_ms': self.percentile(0.99),
+            'buckets': dict(zip([str(bound) for bound in self.buckets] + ['inf'], self.counts)),
+        }
+
+
+class InstrumentedRequest(Request):
+    """`Request` recording the latency and errors of every Bot API call by method name."""
+
+    def __init__(self, con_pool_size: int = None, connect_timeout: float = None, read_timeout: float = None,
+                 **kwargs):
+        super(InstrumentedRequest, self).__init__(
+            con_pool_size=con_pool_size or BOT_API.get('CON_POOL_SIZE') or default_pool_size(),
+            connect_timeout=connect_timeout or BOT_API.get('CONNECT_TIMEOUT', 5),
+            read_timeout=read_timeout or BOT_API.get('READ_TIMEOUT', 5),
+            **kwargs
+        )
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        with self._lock:
+            methods = {method: histogram.snapshot() for method, histogram in sorted(self.histograms.items())}
+        return {'pool_size': self.con_pool_size, 'methods': methods}
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def _request_wrapper(self, *args, **kwargs):
+        method = args[1].rsplit('/', 1)[-1]
+        started = time.monotonic()
+        failed = True
+        try:
+            result = super(InstrumentedRequest, self)._request_wrapper(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                histogram = self.histograms.get(method)
+                if histogram is None:
+                    histogram = self.histograms[method] = LatencyHistogram()
+                histogram.observe(elapsed, failed)
+
+
+def configure(bot: Bot, request: InstrumentedRequest = None) -> InstrumentedRequest:
+    """Replaces the single connection `Request` the bot was created with."""
+    previous = bot._request
+    bot._request = request or InstrumentedRequest()
+    if previous is not None and previous is not bot._request:
+        previous.stop()
+    return bot._request
+
+
+def stats(bot: Bot):
+    return bot.request.stats if isinstance(bot.request, InstrumentedRequest) else {}
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe bounded mapping evicting the least recently used key."""
+
+    def __init__(self, max_size: int = 1024):
+        assert max_size > 0, 'Cache size must more than 0'
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def _load(self, key):
+        return self._data[key]
+
+    def _store(self, key, value):
+        return value
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            try:
+                value = self._load(key)
+            except KeyError:
+                if count:
+                    self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = self._store(key, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return value
+
+    def get_or_set(self, key, factory):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.set(key, factory())
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def stats(self):
+        return {'size': len(self._data), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries additionally expire `ttl` seconds after they were stored."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        super(TTLCache, self).__init__(max_size)
+        self.ttl = ttl
+
+    def _load(self, key):
+        expires, value = self._data[key]
+        if expires < time.monotonic():
+            del self._data[key]
+            raise KeyError(key)
+        return value
+
+    def _store(self, key, value):
+        return time.monotonic() + self.ttl, value
+
+    @property
+    def stats(self):
+        return dict(super(TTLCache, self).stats, ttl=self.ttl)
@@ -0,0 +1,59 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from telegram import Bot
+
+from backend.bot.fake_api import FakeBotApi
+from backend.bot.scheduler import ChatLaneScheduler
+from backend.bot.transport import InstrumentedRequest
+
+
+class Command(BaseCommand):
+    help = 'Measure handler throughput against a local fake Bot API for several connection pool sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+        parser.add_argument('--lanes', type=int, default=16)
+        parser.add_argument('--chats', type=int, default=200)
+        parser.add_argument('--updates', type=int, default=1000)
+        parser.add_argument('--latency', type=float, default=20, help='Bot API latency in milliseconds')
+
+    @staticmethod
+    def handle_update(bot: Bot, chat_id: int, number: int):
+        """Bot API calls of a typical callback handler: answer, edit the message, send a reply."""
+        bot.answer_callback_query(str(number))
+        bot.edit_message_text(f'update {number}', chat_id=chat_id, message_id=number)
+        bot.send_message(chat_id, f'reply {number}')
+
+    def run(self, api: FakeBotApi, pool_size: int, lanes: int, updates: list):
+        request = InstrumentedRequest(con_pool_size=pool_size)
+        bot = Bot('123456:fake', base_url=api.base_url, request=request)
+        scheduler = ChatLaneScheduler(lanes, name='bench')
+        api.connections.clear()
+        started = time.perf_counter()
+        for number, chat_id in enumerate(updates):
+            scheduler.submit(chat_id, self.handle_update, bot, chat_id, number)
+        scheduler.join()
+        elapsed = time.perf_counter() - started
+        scheduler.stop()
+        request.stop()
+        return elapsed, request.stats, scheduler.stats['failed'], len(api.connections)
+
+    def handle(self, *args, **options):
+        updates = random.Random(0).choices(range(1, options['chats'] + 1), k=options['updates'])
+        api = FakeBotApi(latency=options['latency'] / 1000).start()
+        self.stdout.write(
+            f"{'pool':>5} {'seconds':>8} {'updates/s':>10} {'conns':>6} {'failed':>7} "
+            f"{'p50 ms':>7} {'p95 ms':>7} {'max ms':>8}"
+        )
+        try:
+            for pool_size in options['pool_sizes']:
+                elapsed, stats, failed, connections = self.run(api, pool_size, options['lanes'], updates)
+                send = stats['methods'].get('sendMessage', {})
+                self.stdout.write(
+                    f'{pool_size:>5} {elapsed:>8.2f} {len(updates) / elapsed:>10.0f} {connections:>6} {failed:>7} '
+                    f"{send.get('p50_ms', 0):>7} {send.get('p95_ms', 0):>7} {send.get('max_ms', 0):>8.1f}"
+                )
+        finally:
+            api.stop()
@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+
+from backend.bot import distance
+from backend.bot.pagination import PAGE_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Compare ranking companies by distance with the geopy loop and the vectorized NumPy engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--page', type=int, default=3)
+
+    @staticmethod
+    def geopy_rank(ids, latitudes, longitudes, location, start, stop):
+        distances = [
+            (geodesic(location, (latitude, longitude)).kilometers, company_id)
+            for company_id, latitude, longitude in zip(ids, latitudes, longitudes)
+        ]
+        return sorted(distances)[start:stop]
+
+    @staticmethod
+    def numpy_rank(coordinates, location, start, stop):
+        distances = coordinates.distances(*location)
+        positions = distance.nearest(distances, start, stop)
+        return coordinates.ids[positions], distances[positions]
+
+    def handle(self, *args, **options):
+        random = np.random.default_rng(0)
+        location = (50.45, 30.52)
+        start = (options['page'] - 1) * PAGE_SIZE
+        stop = start + PAGE_SIZE
+        self.stdout.write(f"{'companies':>10} {'geopy, ms':>11} {'numpy, ms':>10} {'speedup':>9}")
+        for size in options['sizes']:
+            ids = np.arange(size)
+            latitudes = location[0] + random.uniform(-0.5, 0.5, size)
+            longitudes = location[1] + random.uniform(-0.5, 0.5, size)
+            coordinates = distance.CategoryCoordinates(ids, latitudes, longitudes)
+
+            started = time.perf_counter()
+            self.geopy_rank(ids.tolist(), latitudes.tolist(), longitudes.tolist(), location, start, stop)
+            geopy_time = time.perf_counter() - started
+
+            repeat = 20
+            started = time.perf_counter()
+            for _ in range(repeat):
+                self.numpy_rank(coordinates, location, start, stop)
+            numpy_time = (time.perf_counter() - started) / repeat
+
+            self.stdout.write(
+                f'{size:>10} {geopy_time * 1e3:>11.1f} {numpy_time * 1e3:>10.2f} {geopy_time / numpy_time:>8.0f}x'
+            )
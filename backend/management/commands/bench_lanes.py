@@ -0,0 +1,48 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.bot.scheduler import ChatLaneScheduler
+
+
+class Command(BaseCommand):
+    help = 'Measure update throughput of the per-chat lane scheduler with simulated Bot API latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lanes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+        parser.add_argument('--chats', type=int, default=200)
+        parser.add_argument('--updates', type=int, default=2000)
+        parser.add_argument('--latency', type=float, default=5, help='Handler time in milliseconds')
+
+    def run(self, lanes, updates, latency):
+        scheduler = ChatLaneScheduler(lanes, name='bench')
+        handled = {}
+        lock = threading.Lock()
+
+        def handle(chat_id, number):
+            time.sleep(latency)
+            with lock:
+                handled.setdefault(chat_id, []).append(number)
+
+        started = time.perf_counter()
+        for number, chat_id in enumerate(updates):
+            scheduler.submit(chat_id, handle, chat_id, number)
+        scheduler.join()
+        elapsed = time.perf_counter() - started
+        scheduler.stop()
+        ordered = all(numbers == sorted(numbers) for numbers in handled.values())
+        return elapsed, ordered
+
+    def handle(self, *args, **options):
+        chats = random.Random(0).choices(range(options['chats']), k=options['updates'])
+        latency = options['latency'] / 1000
+        self.stdout.write(f"{'lanes':>6} {'seconds':>9} {'updates/s':>10} {'speedup':>8} {'in order':>9}")
+        baseline = None
+        for lanes in options['lanes']:
+            elapsed, ordered = self.run(lanes, chats, latency)
+            baseline = baseline or elapsed
+            self.stdout.write(
+                f'{lanes:>6} {elapsed:>9.2f} {len(chats) / elapsed:>10.0f} {baseline / elapsed:>7.1f}x {str(ordered):>9}'
+            )
@@ -0,0 +1,43 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from backend.bot import pagination
+from backend.bot.handlers.callbacks import CategoriesCallback
+
+
+class Command(BaseCommand):
+    help = 'Compare building page-number keyboards with and without the layout cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=2000)
+        parser.add_argument('--page-counts', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+
+    def build(self, page_count, cached):
+        data = range(page_count * pagination.PAGE_SIZE)
+        pages = sorted({1, 2, 4, page_count // 2 or 1, page_count - 1 or 1, page_count})
+
+        def run():
+            for page in pages:
+                paginator = pagination.CallbackPaginator(
+                    data, callback=CategoriesCallback, page_callback=CategoriesCallback, page=page,
+                    page_params={'pid': 1},
+                )
+                paginator.cache_layouts = cached
+                paginator._build_pages()
+
+        return run, len(pages)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        self.stdout.write(f"{'pages':>8} {'uncached, us':>14} {'cached, us':>12} {'speedup':>8}")
+        for page_count in options['page_counts']:
+            pagination.layout_cache.clear()
+            timings = []
+            for cached in (False, True):
+                run, builds = self.build(page_count, cached)
+                run()
+                timings.append(timeit.timeit(run, number=repeat) / (repeat * builds) * 1e6)
+            self.stdout.write(
+                f'{page_count:>8} {timings[0]:>14.2f} {timings[1]:>12.2f} {timings[0] / timings[1]:>7.1f}x'
+            )
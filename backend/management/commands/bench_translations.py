@@ -0,0 +1,103 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import translation
+
+from backend.bot.i18n import MessageCatalog
+
+INFO = 'created_order_user_info'
+BUTTONS = ('accept_order', 'done_order', 'reject_order')
+REPLY = 'select_you_interested'
+FIELDS = {'status': 'waiting', 'company': 'Company', 'service': 'Service', 'created': '01-01-20 10:00',
+          'contact': '+380000000000', 'user_name': 'User'}
+
+
+def render_activate(lang):
+    translation.activate(lang)
+    return [translation.gettext(INFO).format(**FIELDS)] + [translation.gettext(button) for button in BUTTONS]
+
+
+def render_catalog(catalog):
+    return [catalog(INFO).format(**FIELDS)] + [catalog(button) for button in BUTTONS]
+
+
+class Command(BaseCommand):
+    help = 'Measure order render cost with activate()/gettext and with message catalogs, ' \
+           'and check concurrent renders for language bleed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=20000)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--tasks', type=int, default=5000, help='Simulated updates per thread')
+
+    def bench(self, renders, languages, catalogs):
+        langs = random.Random(0).choices(languages, k=renders)
+        started = time.perf_counter()
+        for lang in langs:
+            render_activate(lang)
+        activate_time = time.perf_counter() - started
+        translation.deactivate()
+
+        started = time.perf_counter()
+        for lang in langs:
+            render_catalog(catalogs[lang])
+        catalog_time = time.perf_counter() - started
+        return activate_time, catalog_time
+
+    def check_bleed(self, threads, tasks, languages, catalogs, expected):
+        """
+        Every thread handles updates like a handler does: the order is rendered for the other party, then
+        the reply to the requesting user is rendered, with activate() or with the catalogs of both users.
+        """
+        bleed = {'activate': 0, 'catalog': 0}
+        lock = threading.Lock()
+
+        def work(seed):
+            rnd = random.Random(seed)
+            counts = {'activate': 0, 'catalog': 0}
+            for _ in range(tasks):
+                user, party = rnd.choice(languages), rnd.choice(languages)
+
+                translation.activate(user)
+                render_activate(party)
+                counts['activate'] += translation.gettext(REPLY) != expected[user]
+
+                render_catalog(catalogs[party])
+                counts['catalog'] += catalogs[user](REPLY) != expected[user] or \
+                    render_catalog(catalogs[user])[0] != catalogs[user](INFO).format(**FIELDS)
+            translation.deactivate()
+            with lock:
+                for key, value in counts.items():
+                    bleed[key] += value
+
+        workers = [threading.Thread(target=work, args=(seed,)) for seed in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return bleed
+
+    def handle(self, *args, **options):
+        languages = [code for code, name in settings.LANGUAGES]
+        catalogs = {lang: MessageCatalog(lang) for lang in languages}
+        expected = {lang: catalogs[lang](REPLY) for lang in languages}
+        if len(set(expected.values())) < len(languages):
+            self.stderr.write('Languages share translations, compile the messages for a meaningful bleed check')
+
+        activate_time, catalog_time = self.bench(options['renders'], languages, catalogs)
+        renders = options['renders']
+        self.stdout.write(f"{'path':>9} {'seconds':>9} {'us/render':>10}")
+        self.stdout.write(f"{'activate':>9} {activate_time:>9.3f} {activate_time / renders * 1e6:>10.2f}")
+        self.stdout.write(f"{'catalog':>9} {catalog_time:>9.3f} {catalog_time / renders * 1e6:>10.2f}")
+        self.stdout.write(f'speedup {activate_time / catalog_time:.1f}x')
+
+        bleed = self.check_bleed(options['threads'], options['tasks'], languages, catalogs, expected)
+        total = options['threads'] * options['tasks']
+        self.stdout.write(
+            f"language bleed in {total} updates: activate {bleed['activate']}, catalog {bleed['catalog']}"
+        )
+        if bleed['catalog']:
+            raise CommandError(f"{bleed['catalog']} renders through message catalogs used a wrong language")
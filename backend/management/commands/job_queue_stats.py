@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import models
+from django.utils import timezone
+
+from backend.bot import jobs
+from backend.models import ScheduledJob
+
+
+class Command(BaseCommand):
+    help = 'Show the backlog and start latency of scheduled jobs, optionally purging old finished jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Latency window')
+        parser.add_argument('--purge-days', type=int, help='Delete done jobs finished more than N days ago')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        statuses = dict(ScheduledJob.STATUS)
+        counts = ScheduledJob.objects.order_by().values_list('status').annotate(count=models.Count('id'))
+        for status, count in sorted(counts):
+            self.stdout.write(f'{statuses[status]:<8} {count}')
+
+        backlog = jobs.backlog()
+        lag = (now - backlog['oldest']).total_seconds() if backlog['oldest'] else 0
+        self.stdout.write(f'backlog  {backlog["count"]} due, oldest waiting {lag:.1f}s')
+
+        latency = ScheduledJob.objects \
+            .filter(started__gte=now - timezone.timedelta(hours=options['hours'])) \
+            .annotate(latency=models.ExpressionWrapper(
+                models.F('started') - models.F('run_at'), output_field=models.DurationField()
+            )) \
+            .aggregate(avg=models.Avg('latency'), max=models.Max('latency'), count=models.Count('id'))
+        if latency['count']:
+            self.stdout.write(
+                f'latency  avg {latency["avg"].total_seconds():.2f}s, max {latency["max"].total_seconds():.2f}s '
+                f'over {latency["count"]} jobs'
+            )
+
+        if options['purge_days'] is not None:
+            deleted = ScheduledJob.objects.filter(
+                status=ScheduledJob.DONE, finished__lt=now - timezone.timedelta(days=options['purge_days'])
+            ).delete()[0]
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} finished jobs'))
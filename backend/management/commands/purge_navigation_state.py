@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from backend.bot import navigation
+
+
+class Command(BaseCommand):
+    help = 'Delete stored inline keyboard navigation state older than the given number of days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+
+    def handle(self, *args, **options):
+        deleted = navigation.store.purge(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} navigation states'))
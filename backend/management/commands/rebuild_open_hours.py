@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import OpenInterval
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the weekly open hours index of every company from its work schedule'
+
+    def handle(self, *args, **options):
+        created = OpenInterval.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Created {created} open intervals'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from backend.models import Company
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the denormalized rating count, sum and average of every company from its grades'
+
+    def handle(self, *args, **options):
+        updated = Company.rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt ratings of {updated} companies'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django_telegrambot.apps import DjangoTelegramBot
+
+from backend.bot import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run scheduled jobs in the foreground, for deployments without the ASGI server (e.g. polling mode)'
+
+    def handle(self, *args, **options):
+        if not DjangoTelegramBot.dispatchers:
+            raise CommandError('No telegram bot configured')
+        poller = jobs.start_poller(DjangoTelegramBot.dispatchers[0].bot)
+        self.stdout.write(f'Job poller {poller.worker_id} started, registered jobs: {", ".join(sorted(jobs.registry))}')
+        try:
+            while poller.is_alive():
+                poller.join(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping, waiting for running jobs')
+            jobs.stop_poller()
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.14 on 2026-10-18 04:07
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_news_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NavigationState',
+            fields=[
+                ('token', models.CharField(max_length=16, primary_key=True, serialize=False)),
+                ('state', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
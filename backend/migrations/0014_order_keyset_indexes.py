@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_navigationstate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'updated', 'id'], name='backend_ord_custome_4696e2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['service', 'updated', 'id'], name='backend_ord_service_1c31ac_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.0.14 on 2026-10-18 04:10
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def rebuild_ratings(apps, schema_editor):
+    Company = apps.get_model('backend', 'Company')
+    Grade = apps.get_model('backend', 'Grade')
+    grades = Grade.objects.filter(company=models.OuterRef('pk')).order_by().values('company')
+    Company.objects.update(
+        rating_count=Coalesce(models.Subquery(grades.annotate(c=models.Count('id')).values('c')), 0),
+        rating_sum=Coalesce(models.Subquery(grades.annotate(s=models.Sum('mark')).values('s')), 0),
+        rating=Coalesce(models.Subquery(grades.annotate(a=models.Avg('mark')).values('a')), 0.0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_order_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='rating',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['category', 'rating'], name='backend_com_categor_06acbb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['category', 'name'], name='backend_com_categor_e52aaa_idx'),
+        ),
+        migrations.RunPython(rebuild_ratings, migrations.RunPython.noop),
+    ]
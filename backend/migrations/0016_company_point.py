@@ -0,0 +1,21 @@
+from django.contrib.gis.geos import Point
+from django.db import migrations
+
+
+def fill_points(apps, schema_editor):
+    Company = apps.get_model('backend', 'Company')
+    companies = Company.objects.filter(longitude__isnull=False, latitude__isnull=False)
+    for company in companies.only('id', 'longitude', 'latitude'):
+        company.point = Point(company.longitude, company.latitude, srid=4326)
+        company.save(update_fields=['point'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_company_rating'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_points, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 3.0.14 on 2026-10-18 04:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Frozen copy of backend.schedule.week_intervals as of this migration, later changes must not alter it.
+MINUTES_IN_DAY = 24 * 60
+MINUTES_IN_WEEK = 7 * MINUTES_IN_DAY
+
+
+def day_interval(week_day, start_time, end_time):
+    start = week_day * MINUTES_IN_DAY + start_time.hour * 60 + start_time.minute
+    end = week_day * MINUTES_IN_DAY + end_time.hour * 60 + end_time.minute
+    if end <= start:
+        end += MINUTES_IN_DAY
+    return start, end
+
+
+def normalize(intervals):
+    wrapped = []
+    for start, end in intervals:
+        if end > MINUTES_IN_WEEK:
+            wrapped.append((start, MINUTES_IN_WEEK))
+            wrapped.append((0, end - MINUTES_IN_WEEK))
+        else:
+            wrapped.append((start, end))
+
+    merged = []
+    for start, end in sorted(wrapped):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract(intervals, removed):
+    result = []
+    for start, end in intervals:
+        for removed_start, removed_end in removed:
+            if removed_end <= start or removed_start >= end:
+                continue
+            if removed_start > start:
+                result.append((start, removed_start))
+            start = max(start, removed_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def week_intervals(time_works):
+    work, lunch = [], []
+    for time_work in time_works:
+        interval = day_interval(time_work.week_day, time_work.start_time, time_work.end_time)
+        (lunch if time_work.is_lunch else work).append(interval)
+    return subtract(normalize(work), normalize(lunch))
+
+
+def build_open_intervals(apps, schema_editor):
+    Company = apps.get_model('backend', 'Company')
+    TimeWork = apps.get_model('backend', 'TimeWork')
+    OpenInterval = apps.get_model('backend', 'OpenInterval')
+    time_works = {}
+    for time_work in TimeWork.objects.all():
+        time_works.setdefault(time_work.performer_id, []).append(time_work)
+    OpenInterval.objects.bulk_create([
+        OpenInterval(company_id=company_id, category_id=category_id, start=start, end=end)
+        for company_id, category_id in Company.objects.values_list('id', 'category_id')
+        for start, end in week_intervals(time_works.get(company_id, []))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_company_point'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenInterval',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.PositiveSmallIntegerField()),
+                ('end', models.PositiveSmallIntegerField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='backend.Category')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_intervals', to='backend.Company')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='openinterval',
+            index=models.Index(fields=['category', 'start', 'end'], name='backend_ope_categor_579363_idx'),
+        ),
+        migrations.RunPython(build_open_intervals, migrations.RunPython.noop),
+    ]
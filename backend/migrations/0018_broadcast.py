@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 04:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_openinterval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.SmallIntegerField(choices=[(0, 'pending'), (1, 'running'), (2, 'done')], db_index=True, default=0)),
+                ('last_watch_id', models.IntegerField(default=0)),
+                ('sent', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('blocked', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('news', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcasts', to='backend.News')),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.0.14 on 2026-10-18 04:18
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0018_broadcast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kwargs', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('dedup_key', models.CharField(blank=True, max_length=200, null=True)),
+                ('status', models.SmallIntegerField(choices=[(0, 'pending'), (1, 'running'), (2, 'done'), (3, 'failed')], default=0)),
+                ('run_at', models.DateTimeField()),
+                ('attempts', models.SmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='scheduledjob',
+            index=models.Index(fields=['status', 'run_at'], name='backend_sch_status_6fb7e7_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='scheduledjob',
+            constraint=models.UniqueConstraint(condition=models.Q(status__in=[0, 1]), fields=('dedup_key',), name='scheduled_job_active_dedup_key'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.14 on 2026-10-18 04:20
+
+from django.db import migrations, models
+
+
+def mark_active_bookings(apps, schema_editor):
+    """
+    Marks the active orders of booking services as holding them. A service with several active orders can
+    not be held by all of them, the migration stops instead of choosing one: reject or finish the extra
+    orders of the listed services, then migrate again.
+    """
+    Order = apps.get_model('backend', 'Order')
+    active = Order.objects.filter(service__type=1, status__in=[0, 1])
+    duplicates = active.order_by().values('service_id').annotate(orders=models.Count('id')).filter(orders__gt=1)
+    if duplicates:
+        raise RuntimeError('Booking services with several active orders: {}'.format(', '.join(
+            'service {} ({} orders)'.format(row['service_id'], row['orders']) for row in duplicates
+        )))
+    active.update(booking=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0019_scheduledjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='booking',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_active_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(booking=True), fields=('service',), name='order_active_booking'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.0.14 on 2026-10-18 04:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0020_order_booking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceAvailability',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('slots', models.BinaryField()),
+            ],
+        ),
+        migrations.RemoveConstraint(
+            model_name='order',
+            name='order_active_booking',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='slot_start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='slot_length',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('booking', True), ('slot_start__isnull', True)), fields=('service',), name='order_active_booking'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('booking', True), ('slot_start__isnull', False)), fields=('service', 'slot_start'), name='order_active_slot'),
+        ),
+        migrations.AddField(
+            model_name='serviceavailability',
+            name='service',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='backend.Service'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='serviceavailability',
+            unique_together={('service', 'day')},
+        ),
+    ]
@@ -1,15 +1,90 @@
+import copy
+import datetime
+import json
+
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.contrib.gis.db.models import PointField
-from django.contrib.postgres.fields import JSONField
-from django.db import models
-from django.utils.translation import activate, gettext
+from django.contrib.gis.geos import Point
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.utils.translation import gettext_lazy as _
 from mptt.models import MPTTModel, TreeForeignKey
 
+from backend import schedule
+from backend.cache import TTLCache
 
 NAME_LENGTH = 200
 
+TELEGRAM_USER_CACHE = getattr(settings, 'TELEGRAM_USER_CACHE', {})
+telegram_user_cache = TTLCache(
+    max_size=TELEGRAM_USER_CACHE.get('MAX_SIZE', 1024), ttl=TELEGRAM_USER_CACHE.get('TTL', 30)
+)
+
+
+_REMOVED = object()
+
+
+class JSONBSet(models.Func):
+    function = 'jsonb_set'
+
+    def __init__(self, expression, path, value, **extra):
+        super(JSONBSet, self).__init__(
+            expression,
+            Cast(models.Value(list(path)), ArrayField(models.TextField())),
+            Cast(models.Value(json.dumps(value, cls=DjangoJSONEncoder)), JSONField()),
+            output_field=JSONField(), **extra
+        )
+
+
+class JSONBRemove(models.Func):
+    template = '(%(expressions)s)'
+    arg_joiner = ' #- '
+
+    def __init__(self, expression, path, **extra):
+        super(JSONBRemove, self).__init__(
+            expression, Cast(models.Value(list(path)), ArrayField(models.TextField())),
+            output_field=JSONField(), **extra
+        )
+
+
+class JSONBAppend(models.Func):
+    """
+    `expression` with `values` appended to the array under its top level `key`. The key may be missing and
+    the expression NULL, which is taken as an empty object.
+    """
+    output_field = JSONField()
+
+    def __init__(self, expression, key, values, **extra):
+        super(JSONBAppend, self).__init__(
+            expression, models.Value(key), Cast(models.Value(json.dumps(values)), JSONField()), **extra
+        )
+
+    def as_sql(self, compiler, connection, **extra_context):
+        (field, field_params), (key, key_params), (value, value_params) = [
+            compiler.compile(expression) for expression in self.get_source_expressions()
+        ]
+        field = f"COALESCE({field}, '{{}}'::jsonb)"
+        sql = f"jsonb_set({field}, ARRAY[{key}]::text[], COALESCE({field} -> {key}, '[]'::jsonb) || {value})"
+        return sql, [*field_params, *key_params, *field_params, *key_params, *value_params]
+
+
+def json_changes(old, new, path=()):
+    """Paths of the values changed from `old` to `new`, descending into the objects present on both sides."""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return [] if old == new else [(path, new)]
+    changes = []
+    for key in sorted(old.keys() - new.keys()):
+        changes.append((path + (key,), _REMOVED))
+    for key in sorted(new.keys()):
+        if key not in old:
+            changes.append((path + (key,), new[key]))
+        else:
+            changes.extend(json_changes(old[key], new[key], path + (key,)))
+    return changes
+
 
 class User(AbstractUser):
 
@@ -30,25 +105,102 @@ class TelegramUser(models.Model):
     def __str__(self):
         return f'{self.full_name} - {self.id}'
 
+    TRACKED_FIELDS = ('full_name', 'username', 'state', 'blocked', 'lang', 'phone')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(TelegramUser, cls).from_db(db, field_names, values)
+        instance.take_snapshot()
+        return instance
+
+    def take_snapshot(self):
+        self._snapshot = (
+            {field: self.__dict__.get(field) for field in self.TRACKED_FIELDS},
+            copy.deepcopy(self.options),
+        )
+
+    def save(self, *args, **kwargs):
+        super(TelegramUser, self).save(*args, **kwargs)
+        telegram_user_cache.delete(self.id)
+        self.take_snapshot()
+
+    def save_changes(self):
+        """
+        Writes only the columns and `options` keys changed since the user was loaded, the keys with nested
+        `jsonb_set` so concurrent handlers changing other keys don't overwrite each other. Returns whether
+        anything was written.
+        """
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is None or self._state.adding:
+            self.save()
+            return True
+        fields, options = snapshot
+        values = {field: getattr(self, field) for field in self.TRACKED_FIELDS if getattr(self, field) != fields[field]}
+        changes = json_changes(options, self.options)
+        if not values and not changes:
+            return False
+
+        if changes and not changes[0][0]:
+            values['options'] = self.options
+        elif changes:
+            expression = models.F('options')
+            for path, value in changes:
+                if value is _REMOVED:
+                    expression = JSONBRemove(expression, path)
+                else:
+                    expression = JSONBSet(expression, path, value)
+            values['options'] = expression
+        TelegramUser.objects.filter(pk=self.pk).update(**values)
+        telegram_user_cache.delete(self.id)
+        self.take_snapshot()
+        return True
+
+    def delete(self, *args, **kwargs):
+        telegram_user_cache.delete(self.id)
+        return super(TelegramUser, self).delete(*args, **kwargs)
+
+    def cache(self):
+        """
+        Caches the column values, not the instance: every update builds its own instance from them, so
+        handlers running at the same time never share the `options` of one object.
+        """
+        fields = self._meta.concrete_fields
+        telegram_user_cache.set(self.id, copy.deepcopy(tuple(getattr(self, field.attname) for field in fields)))
+
+    @classmethod
+    def from_cache(cls, user_id):
+        values = telegram_user_cache.get(user_id)
+        if values is None:
+            return None
+        field_names = [field.attname for field in cls._meta.concrete_fields]
+        return cls.from_db(cls.objects.db, field_names, copy.deepcopy(values))
+
     @staticmethod
     def get_user(user):
-        defaults = {
-            'id': user.id,
-            'username': user.username or '',
-            'full_name': '{} {}'.format(user.first_name or '', user.last_name or ''),
-            'lang': user.language_code if user.language_code in dict(settings.LANGUAGES).keys()
-            else settings.LANGUAGE_CODE,
-        }
-        user, created = TelegramUser.objects.get_or_create(id=user.id, defaults=defaults)
-        activate(user.lang)
-        return user
+        telegram_user = TelegramUser.from_cache(user.id)
+        if telegram_user is None:
+            defaults = {
+                'id': user.id,
+                'username': user.username or '',
+                'full_name': '{} {}'.format(user.first_name or '', user.last_name or ''),
+                'lang': user.language_code if user.language_code in dict(settings.LANGUAGES).keys()
+                else settings.LANGUAGE_CODE,
+            }
+            telegram_user, created = TelegramUser.objects.get_or_create(id=user.id, defaults=defaults)
+            telegram_user.cache()
+        if telegram_user.blocked:
+            # Blocked by a failed broadcast, an update from the user means the bot was unblocked.
+            telegram_user.blocked = False
+            telegram_user.save_changes()
+        return telegram_user
 
-    def get_text(self, text):
-        activate(self.lang)
-        return gettext(text)
+    @property
+    def catalog(self):
+        from backend.bot.i18n import catalogs
+        return catalogs.get(self.lang)
 
-    def activate(self):
-        activate(self.lang)
+    def get_text(self, text):
+        return self.catalog.gettext(text)
 
     @property
     def filters(self):
@@ -125,12 +277,62 @@ class Company(models.Model):
     longitude = models.FloatField(null=True, blank=True, default=None)
     latitude = models.FloatField(null=True, blank=True, default=None)
 
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating = models.FloatField(default=0, editable=False)
+
+    RATING_FIELDS = ('rating_count', 'rating_sum', 'rating')
+
     def __str__(self):
         return f'{self.name} - {self.id}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Company, cls).from_db(db, field_names, values)
+        # The category the row had when loaded, caches of both categories are invalidated on a move.
+        instance.loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        if self.longitude is not None and self.latitude is not None:
+            self.point = Point(self.longitude, self.latitude, srid=4326)
+        else:
+            self.point = None
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            # The ratings are kept by grade signals with F() updates, a stale instance must not overwrite them.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.RATING_FIELDS
+            ]
+        super(Company, self).save(*args, **kwargs)
+        self.loaded_category_id = self.category_id
+
+    @staticmethod
+    def rebuild_ratings(companies=None):
+        grades = Grade.objects.filter(company=models.OuterRef('pk')).order_by().values('company')
+        companies = Company.objects.all() if companies is None else companies
+        return companies.update(
+            rating_count=Coalesce(models.Subquery(grades.annotate(c=models.Count('id')).values('c')), 0),
+            rating_sum=Coalesce(models.Subquery(grades.annotate(s=models.Sum('mark')).values('s')), 0),
+            rating=Coalesce(models.Subquery(grades.annotate(a=models.Avg('mark')).values('a')), 0.0),
+        )
+
+    @staticmethod
+    def add_rating(company_id, mark, count=1):
+        rating_sum, rating_count = models.F('rating_sum') + mark * count, models.F('rating_count') + count
+        return Company.objects.filter(pk=company_id).update(
+            rating_count=rating_count,
+            rating_sum=rating_sum,
+            rating=Coalesce(Cast(rating_sum, models.FloatField()) / NullIf(rating_count, 0), 0.0),
+        )
+
     class Meta:
         verbose_name = _('_company')
         verbose_name_plural = _('_companies')
+        indexes = [
+            models.Index(fields=['category', 'rating']),
+            models.Index(fields=['category', 'name']),
+        ]
 
 
 class TimeWork(models.Model):
@@ -159,6 +361,43 @@ class TimeWork(models.Model):
         unique_together = ('performer', 'week_day', 'is_lunch')
 
 
+class OpenInterval(models.Model):
+    """Denormalized working hours of a company as minutes since Monday 00:00, see `backend.schedule`."""
+    company = models.ForeignKey(Company, related_name='open_intervals', on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, related_name='+', on_delete=models.CASCADE)
+    start = models.PositiveSmallIntegerField()
+    end = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'start', 'end']),
+        ]
+
+    @staticmethod
+    def rebuild(companies=None):
+        companies = Company.objects.all() if companies is None else companies
+        time_works = {}
+        for time_work in TimeWork.objects.filter(performer__in=companies):
+            time_works.setdefault(time_work.performer_id, []).append(time_work)
+
+        intervals = [
+            OpenInterval(company_id=company_id, category_id=category_id, start=start, end=end)
+            for company_id, category_id in companies.values_list('id', 'category_id')
+            for start, end in schedule.week_intervals(time_works.get(company_id, []))
+        ]
+        with transaction.atomic():
+            OpenInterval.objects.filter(company__in=companies).delete()
+            OpenInterval.objects.bulk_create(intervals, batch_size=1000)
+        return len(intervals)
+
+    @staticmethod
+    def open_companies(category_ids, moment):
+        minute = schedule.minute_of_week(moment)
+        return OpenInterval.objects \
+            .filter(category_id__in=category_ids, start__lte=minute, end__gt=minute) \
+            .values('company_id')
+
+
 class WatchCompanyTelegramUser(models.Model):
     telegram_user = models.ForeignKey(TelegramUser, related_name='watches', on_delete=models.CASCADE)
     company = models.ForeignKey(Company, related_name='watches', on_delete=models.CASCADE)
@@ -173,15 +412,22 @@ class Service(models.Model):
         (0, _('simple_text')),
         (1, _('booking'))
     ]
+    SIMPLE_TEXT, BOOKING = 0, 1
     performer = models.ForeignKey(Company, related_name='services', on_delete=models.CASCADE)
     type = models.SmallIntegerField(choices=SERVICE_TYPE)
 
     name = models.CharField(max_length=NAME_LENGTH)
     description = models.TextField(blank=True, null=True)
+    # Booking services with a slot length in minutes are booked per time slot instead of as a whole.
+    slot_length = models.PositiveSmallIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f'{self.name}'
 
+    @property
+    def is_slot_booking(self):
+        return self.type == self.BOOKING and bool(self.slot_length)
+
     class Meta:
         verbose_name = _('_service')
         verbose_name_plural = _('_services')
@@ -203,6 +449,28 @@ class News(models.Model):
         verbose_name_plural = _('_more_news')
 
 
+class Broadcast(models.Model):
+    STATUS = [
+        (0, 'pending'),
+        (1, 'running'),
+        (2, 'done'),
+    ]
+    PENDING, RUNNING, DONE = 0, 1, 2
+    news = models.ForeignKey(News, related_name='broadcasts', on_delete=models.CASCADE)
+    status = models.SmallIntegerField(choices=STATUS, default=PENDING, db_index=True)
+    last_watch_id = models.IntegerField(default=0)
+
+    sent = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    blocked = models.IntegerField(default=0)
+
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.news_id} - {self.get_status_display()}'
+
+
 class Order(models.Model):
     STATUS = [
         (0, _('waiting')),
@@ -211,6 +479,7 @@ class Order(models.Model):
         (3, _('done')),
     ]
     STATUS_DICT = dict(STATUS)
+    ACTIVE_STATUS = (0, 1)
     STATUS_EMOJI_DICT = {
         0: '🟡',  # waiting
         1: '🟢',  # accepted
@@ -224,21 +493,96 @@ class Order(models.Model):
     options = JSONField(default=dict, null=True)
 
     price = models.DecimalField(max_digits=10, decimal_places=3, default=0, blank=True)
+    # Set while the order holds its booking service or, with `slot_start`, a time slot of it.
+    booking = models.BooleanField(default=False, editable=False)
+    slot_start = models.DateTimeField(null=True, blank=True)
 
     created = models.DateTimeField(auto_now_add=True, blank=True)
     updated = models.DateTimeField(auto_now_add=True, blank=True)
 
-    @property
-    def get_customer_and_messages(self):
-        return self.customer, self.options.setdefault('user_messages', [])
-
-    @property
-    def get_performer_and_messages(self):
-        return self.service.performer.profile.user, self.options.setdefault('performer_messages', [])
+    def save(self, *args, **kwargs):
+        if self.booking and self.status not in self.ACTIVE_STATUS:
+            self.booking = False
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'booking'}
+        super(Order, self).save(*args, **kwargs)
+
+    def append_messages(self, **messages):
+        """Appends message ids to the lists of `options` in one atomic update, e.g. `user_messages=[id]`."""
+        expression = models.F('options')
+        self.options = self.options or {}
+        for key, message_ids in messages.items():
+            expression = JSONBAppend(expression, key, message_ids)
+            self.options.setdefault(key, []).extend(message_ids)
+        Order.objects.filter(pk=self.pk).update(options=expression)
 
     class Meta:
         verbose_name = _('_order')
         verbose_name_plural = _('_orders')
+        indexes = [
+            models.Index(fields=['customer', 'updated', 'id']),
+            models.Index(fields=['service', 'updated', 'id']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['service'], condition=models.Q(booking=True, slot_start__isnull=True),
+                name='order_active_booking'
+            ),
+            models.UniqueConstraint(
+                fields=['service', 'slot_start'], condition=models.Q(booking=True, slot_start__isnull=False),
+                name='order_active_slot'
+            ),
+        ]
+
+
+class ServiceAvailability(models.Model):
+    """
+    Free slots of a slot booking service on a day: bit `i` of `slots` stands for the slot starting
+    `i * slot_length` minutes after midnight, set when it lies within working hours and is not booked.
+    """
+    service = models.ForeignKey(Service, related_name='availability', on_delete=models.CASCADE)
+    day = models.DateField()
+    slots = models.BinaryField()
+
+    class Meta:
+        unique_together = ('service', 'day')
+
+    @staticmethod
+    def build(service: Service, days):
+        intervals = list(OpenInterval.objects.filter(company_id=service.performer_id).values_list('start', 'end'))
+        booked = {}
+        for slot_start in Order.objects.filter(service=service, booking=True, slot_start__date__in=days) \
+                .values_list('slot_start', flat=True):
+            booked.setdefault(slot_start.date(), []).append(slot_start.hour * 60 + slot_start.minute)
+        return [
+            ServiceAvailability(
+                service=service, day=day,
+                slots=schedule.slot_bitmap(intervals, day.weekday(), service.slot_length, booked.get(day, ())),
+            )
+            for day in days
+        ]
+
+    @staticmethod
+    def refresh(service: Service, days):
+        with transaction.atomic():
+            ServiceAvailability.objects.filter(service=service, day__in=days).delete()
+            ServiceAvailability.objects.bulk_create(ServiceAvailability.build(service, days), ignore_conflicts=True)
+
+    @staticmethod
+    def days(service: Service, first, last):
+        """Bitmaps of the days from `first` to `last`, computing and storing the missing ones."""
+        availability = dict(
+            ServiceAvailability.objects.filter(service=service, day__range=(first, last)).values_list('day', 'slots')
+        )
+        missing = [
+            first + datetime.timedelta(days=offset) for offset in range((last - first).days + 1)
+            if first + datetime.timedelta(days=offset) not in availability
+        ]
+        if missing:
+            built = ServiceAvailability.build(service, missing)
+            ServiceAvailability.objects.bulk_create(built, ignore_conflicts=True)
+            availability.update((item.day, item.slots) for item in built)
+        return {day: bytes(slots) for day, slots in availability.items()}
 
 
 class Grade(models.Model):
@@ -267,3 +611,47 @@ class Comment(models.Model):
     class Meta:
         verbose_name = _('_order')
         verbose_name_plural = _('_orders')
+
+
+class NavigationState(models.Model):
+    token = models.CharField(max_length=16, primary_key=True)
+    state = JSONField(default=dict)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class ScheduledJob(models.Model):
+    STATUS = [
+        (0, 'pending'),
+        (1, 'running'),
+        (2, 'done'),
+        (3, 'failed'),
+    ]
+    PENDING, RUNNING, DONE, FAILED = 0, 1, 2, 3
+    name = models.CharField(max_length=100)
+    kwargs = JSONField(default=dict, blank=True)
+    dedup_key = models.CharField(max_length=200, null=True, blank=True)
+
+    status = models.SmallIntegerField(choices=STATUS, default=PENDING)
+    run_at = models.DateTimeField()
+    attempts = models.SmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.name} - {self.get_status_display()}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedup_key'], condition=models.Q(status__in=[0, 1]), name='scheduled_job_active_dedup_key'
+            ),
+        ]
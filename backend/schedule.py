@@ -0,0 +1,90 @@
+"""Weekly schedules as sorted, non-overlapping half-open intervals of minutes since Monday 00:00."""
+import datetime
+
+MINUTES_IN_DAY = 24 * 60
+MINUTES_IN_WEEK = 7 * MINUTES_IN_DAY
+
+
+def minute_of_week(moment: datetime.datetime) -> int:
+    return moment.weekday() * MINUTES_IN_DAY + moment.hour * 60 + moment.minute
+
+
+def day_interval(week_day: int, start_time: datetime.time, end_time: datetime.time):
+    """Interval of one schedule row, an end not after the start continues into the next day."""
+    start = week_day * MINUTES_IN_DAY + start_time.hour * 60 + start_time.minute
+    end = week_day * MINUTES_IN_DAY + end_time.hour * 60 + end_time.minute
+    if end <= start:
+        end += MINUTES_IN_DAY
+    return start, end
+
+
+def normalize(intervals):
+    """Wrap intervals crossing Sunday midnight to the start of the week, then sort and merge them."""
+    wrapped = []
+    for start, end in intervals:
+        if end > MINUTES_IN_WEEK:
+            wrapped.append((start, MINUTES_IN_WEEK))
+            wrapped.append((0, end - MINUTES_IN_WEEK))
+        else:
+            wrapped.append((start, end))
+
+    merged = []
+    for start, end in sorted(wrapped):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract(intervals, removed):
+    result = []
+    for start, end in intervals:
+        for removed_start, removed_end in removed:
+            if removed_end <= start or removed_start >= end:
+                continue
+            if removed_start > start:
+                result.append((start, removed_start))
+            start = max(start, removed_end)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def week_intervals(time_works):
+    """Open intervals of a company from its `TimeWork` rows, with lunch breaks cut out."""
+    work, lunch = [], []
+    for time_work in time_works:
+        interval = day_interval(time_work.week_day, time_work.start_time, time_work.end_time)
+        (lunch if time_work.is_lunch else work).append(interval)
+    return subtract(normalize(work), normalize(lunch))
+
+
+def slot_bitmap(intervals, week_day: int, slot_length: int, booked=()) -> bytes:
+    """
+    Bitmap of the slots of a day fully inside the week `intervals`, bit `i` being the slot starting
+    `i * slot_length` minutes after midnight. `booked` holds the start minutes of taken slots.
+    """
+    day_start = week_day * MINUTES_IN_DAY
+    count = MINUTES_IN_DAY // slot_length
+    bitmap = bytearray((count + 7) // 8)
+    for start, end in intervals:
+        first = max(0, -(-(start - day_start) // slot_length))
+        last = min(count, (end - day_start) // slot_length)
+        for index in range(first, last):
+            bitmap[index >> 3] |= 1 << (index & 7)
+    for minute in booked:
+        index = minute // slot_length
+        if index < count:
+            bitmap[index >> 3] &= ~(1 << (index & 7))
+    return bytes(bitmap)
+
+
+def bitmap_slots(bitmap: bytes, after: int = -1, slot_length: int = 1):
+    """Indexes of the free slots in `bitmap` starting after the minute of the day `after`."""
+    return [
+        index for index in range(len(bitmap) * 8)
+        if bitmap[index >> 3] >> (index & 7) & 1 and index * slot_length > after
+    ]
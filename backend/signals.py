@@ -0,0 +1,82 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from mptt.signals import node_moved
+
+from backend.bot import cards, categories, distance
+from backend.models import Category, Company, Grade, News, OpenInterval, Order, Service, ServiceAvailability, \
+    TimeWork
+
+
+@receiver(post_save, sender=Grade)
+def grade_saved(sender, instance: Grade, created, **kwargs):
+    if created:
+        Company.add_rating(instance.company_id, instance.mark)
+    else:
+        Company.rebuild_ratings(Company.objects.filter(pk=instance.company_id))
+
+
+@receiver(post_delete, sender=Grade)
+def grade_deleted(sender, instance: Grade, **kwargs):
+    Company.add_rating(instance.company_id, instance.mark, count=-1)
+
+
+@receiver([post_save, post_delete], sender=Grade)
+def invalidate_grade_card(sender, instance: Grade, **kwargs):
+    cards.invalidate_company(instance.company_id)
+    cards.invalidate_viewer(instance.reviewer_user_id, instance.company_id)
+
+
+@receiver([post_save, post_delete], sender=Company)
+def company_changed(sender, instance: Company, **kwargs):
+    cards.invalidate_company(instance.id)
+    distance.coordinate_index.invalidate(instance.category_id)
+    previous_category_id = getattr(instance, 'loaded_category_id', None)
+    if previous_category_id is not None and previous_category_id != instance.category_id:
+        distance.coordinate_index.invalidate(previous_category_id)
+
+
+@receiver(post_save, sender=Company)
+def company_category_changed(sender, instance: Company, created, **kwargs):
+    if not created:
+        OpenInterval.objects.filter(company=instance).exclude(category_id=instance.category_id) \
+            .update(category_id=instance.category_id)
+
+
+@receiver([post_save, post_delete], sender=TimeWork)
+def time_work_changed(sender, instance: TimeWork, **kwargs):
+    OpenInterval.rebuild(Company.objects.filter(pk=instance.performer_id))
+
+
+@receiver([post_save, post_delete], sender=TimeWork)
+@receiver([post_save, post_delete], sender=Service)
+def invalidate_performer_card(sender, instance, **kwargs):
+    cards.invalidate_company(instance.performer_id)
+
+
+@receiver([post_save, post_delete], sender=News)
+def invalidate_news_card(sender, instance: News, **kwargs):
+    cards.invalidate_company(instance.company_id)
+
+
+@receiver([post_save, post_delete, node_moved], sender=Category)
+@receiver([post_save, post_delete], sender=Company)
+def invalidate_category_tree(sender, **kwargs):
+    categories.tree.invalidate()
+
+
+@receiver([post_save, post_delete], sender=TimeWork)
+def invalidate_performer_availability(sender, instance: TimeWork, **kwargs):
+    ServiceAvailability.objects.filter(service__performer_id=instance.performer_id).delete()
+
+
+@receiver([post_save, post_delete], sender=Service)
+def invalidate_service_availability(sender, instance: Service, **kwargs):
+    ServiceAvailability.objects.filter(service_id=instance.id).delete()
+
+
+@receiver([post_save, post_delete], sender=Order)
+def order_slot_changed(sender, instance: Order, update_fields=None, **kwargs):
+    if update_fields is not None and not {'booking', 'slot_start'} & set(update_fields):
+        return
+    if instance.slot_start and instance.service.is_slot_booking:
+        ServiceAvailability.refresh(instance.service, [instance.slot_start.date()])
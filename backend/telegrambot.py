@@ -1,8 +1,10 @@
 import logging
 
+from django.conf import settings
 from django_telegrambot.apps import DjangoTelegramBot
 from telegram.ext import JobQueue
 
+from backend.bot import filters as bot_filters, i18n, job_callbacks, jobs, keyboards, scheduler, transport  # noqa: F401 job_callbacks registers the jobs
 from backend.bot.handlers import all_commands, all_messages, all_callback_queries, errors as error_handlers
 from backend.bot.handlers.messages import unknown_message
 
@@ -22,6 +24,13 @@ def main():
         job_queue = JobQueue()
         job_queue.set_dispatcher(dp)
         dp.job_queue = job_queue
+    if settings.DJANGO_TELEGRAMBOT.get('MODE', 'WEBHOOK') == 'POLLING':
+        scheduler.schedule_updates(dp)
+    i18n.catalogs.preload()
     init_handler(dp, all_commands, all_messages, all_callback_queries)
+    bot_filters.dispatch_index.build()
+    keyboards.registry.build()
     dp.add_handler(unknown_message)
     dp.add_error_handler(error_handlers.error)
+    transport.configure(dp.bot)
+    logger.info('Registered jobs: %s', ', '.join(sorted(jobs.registry)))
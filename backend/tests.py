@@ -1,3 +1,666 @@
-from django.test import TestCase
+import datetime
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from django.utils import translation
+from django.utils.dates import MONTHS
+from telegram import User as BotUser
+
+from backend import booking, models, schedule, signals
+from backend.bot import cards, codec, distance, loaders, navigation, notifications, pagination
+from backend.bot.chat_actions import ChatActionIndicator
+from backend.bot.filters import MessageDispatchIndex
+from backend.bot.ingress import IngressMetrics, WebhookIngress
+from backend.bot.scheduler import ChatLaneScheduler
+from backend.bot.i18n import MessageCatalog
+from backend.bot.handlers.callbacks import CompaniesCallback, CompanyDetailCallback, LanguageCallback, \
+    OrderStatusCallback, OutgoingOrderCallback, OutgoingOrderDetailCallback
+from backend.models import Category, Company, Grade, News, Order, Profile, Service, TelegramUser, TimeWork, \
+    User, WatchCompanyTelegramUser, telegram_user_cache
+
+
+class CompanyDetailQueriesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = TelegramUser.objects.create(id=1, full_name='Owner')
+        account = User.objects.create_user('owner', password='owner')
+        profile = Profile.objects.create(user=owner, account=account, name='Owner')
+        category = Category.objects.create(name='food')
+        cls.company = Company.objects.create(
+            profile=profile, category=category, name='Cafe', address='Street 1', contact='+380000000000',
+            site='https://example.com', longitude=30.5, latitude=50.4,
+        )
+        for week_day in range(5):
+            TimeWork.objects.create(
+                performer=cls.company, week_day=week_day,
+                start_time=datetime.time(9), end_time=datetime.time(18),
+            )
+        TimeWork.objects.create(
+            performer=cls.company, week_day=0, start_time=datetime.time(13), end_time=datetime.time(14), is_lunch=True
+        )
+        Service.objects.create(performer=cls.company, type=Service.SIMPLE_TEXT, name='Coffee')
+        News.objects.create(company=cls.company, title='Opening', description='We are open')
+
+        cls.viewer = TelegramUser.objects.create(id=2, full_name='Viewer')
+        WatchCompanyTelegramUser.objects.create(company=cls.company, telegram_user=cls.viewer)
+        Grade.objects.create(company=cls.company, reviewer_user=cls.viewer, mark=4)
+
+    def setUp(self):
+        cards.card_cache.clear()
+        cards.viewer_cache.clear()
+
+    def test_card_render_queries(self):
+        with self.assertNumQueries(2):
+            company = loaders.load_company_detail(self.company.id, self.viewer)
+            text, keyboard, category_id = CompanyDetailCallback.render_card(company, self.viewer)
+
+        self.assertTrue(company.is_watched)
+        self.assertTrue(company.is_graded)
+        self.assertTrue(company.has_services)
+        self.assertTrue(company.has_news)
+        self.assertEqual(len(company.work_days), 5)
+        self.assertEqual(company.rating_count, 1)
+        self.assertEqual(category_id, self.company.category_id)
+
+    def test_cached_card_queries(self):
+        with self.assertNumQueries(2):
+            card = CompanyDetailCallback.get_card(self.company.id, self.viewer)
+        with self.assertNumQueries(0):
+            self.assertEqual(CompanyDetailCallback.get_card(self.company.id, self.viewer), card)
+
+
+class CompanyRatingTest(TestCase):
+
+    def setUp(self):
+        owner = TelegramUser.objects.create(id=1, full_name='Owner')
+        account = User.objects.create_user('owner', password='owner')
+        profile = Profile.objects.create(user=owner, account=account, name='Owner')
+        self.company = Company.objects.create(
+            profile=profile, category=Category.objects.create(name='food'), name='Cafe', address='Street 1',
+            contact='+380000000000',
+        )
+        self.reviewer = TelegramUser.objects.create(id=2, full_name='Reviewer')
+
+    def test_save_keeps_ratings(self):
+        stale = Company.objects.get(pk=self.company.pk)
+        Grade.objects.create(company=self.company, reviewer_user=self.reviewer, mark=5)
+
+        stale.name = 'Coffee house'
+        stale.save()
+
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertEqual(company.name, 'Coffee house')
+        self.assertEqual((company.rating_count, company.rating_sum, company.rating), (1, 5, 5.0))
+
+
+class OrderMessagesTest(TestCase):
+
+    def setUp(self):
+        owner = TelegramUser.objects.create(id=1, full_name='Owner')
+        account = User.objects.create_user('owner', password='owner')
+        profile = Profile.objects.create(user=owner, account=account, name='Owner')
+        company = Company.objects.create(
+            profile=profile, category=Category.objects.create(name='food'), name='Cafe', address='Street 1',
+            contact='+380000000000',
+        )
+        service = Service.objects.create(performer=company, type=Service.SIMPLE_TEXT, name='Coffee')
+        self.order = Order.objects.create(customer=TelegramUser.objects.create(id=2), service=service)
+
+    def test_append_messages(self):
+        self.order.append_messages(user_messages=[1])
+        self.order.append_messages(user_messages=[2], performer_messages=[3])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.options, {'user_messages': [1, 2], 'performer_messages': [3]})
+
+    def test_append_messages_to_null_options(self):
+        Order.objects.filter(pk=self.order.pk).update(options=None)
+        self.order.options = None
+        self.order.append_messages(user_messages=[1])
+        self.assertEqual(self.order.options, {'user_messages': [1]})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.options, {'user_messages': [1]})
+
+
+class CompanyCategoryMoveTest(SimpleTestCase):
+
+    @mock.patch.object(cards, 'invalidate_company')
+    @mock.patch.object(distance.coordinate_index, 'invalidate')
+    def test_both_categories_invalidated(self, invalidate, invalidate_company):
+        company = Company.from_db('default', ['id', 'category_id'], [1, 10])
+        company.category_id = 20
+        signals.company_changed(Company, company)
+        self.assertEqual(sorted(call.args[0] for call in invalidate.call_args_list), [10, 20])
+
+    @mock.patch.object(cards, 'invalidate_company')
+    @mock.patch.object(distance.coordinate_index, 'invalidate')
+    def test_same_category_invalidated_once(self, invalidate, invalidate_company):
+        company = Company.from_db('default', ['id', 'category_id'], [1, 10])
+        signals.company_changed(Company, company)
+        invalidate.assert_called_once_with(10)
+
+
+class TelegramUserCacheTest(TestCase):
+
+    def setUp(self):
+        telegram_user_cache.clear()
+
+    def test_cached_user_is_not_shared(self):
+        bot_user = BotUser(id=3, first_name='Cached', is_bot=False, language_code='en')
+        first = TelegramUser.get_user(bot_user)
+        with self.assertNumQueries(0):
+            second = TelegramUser.get_user(bot_user)
+
+        self.assertIsNot(first, second)
+        first.options['location'] = {'longitude': 30.5, 'latitude': 50.4}
+        first.state = 'changed'
+        self.assertEqual(second.options, {})
+        self.assertEqual(second.state, '')
+        self.assertEqual(TelegramUser.get_user(bot_user).options, {})
+
+
+class MessageCatalogThreadsTest(SimpleTestCase):
+    MESSAGES = ('select_you_interested', 'accept_order', MONTHS[3], TimeWork.WEEK_DAYS_DICT[0])
+
+    def expected(self, lang):
+        with translation.override(lang):
+            return [str(translation.gettext(message)) for message in self.MESSAGES]
+
+    def test_concurrent_languages(self):
+        languages = ('uk', 'en')
+        active = translation.get_language()
+        expected = {lang: self.expected(lang) for lang in languages}
+        self.assertNotEqual(expected['uk'], expected['en'])
+
+        catalogs = {lang: MessageCatalog(lang) for lang in languages}
+        barrier = threading.Barrier(len(languages))
+        rendered = {}
+        language_kept = {}
+
+        def render(lang, party):
+            thread_language = translation.get_language()
+            barrier.wait()
+            results = []
+            for _ in range(500):
+                # The other party of an order is rendered in between, as an order handler does.
+                catalogs[party](self.MESSAGES[0])
+                results.append([catalogs[lang](message) for message in self.MESSAGES])
+            rendered[lang] = results
+            language_kept[lang] = translation.get_language() == thread_language
+
+        threads = [
+            threading.Thread(target=render, args=(lang, party))
+            for lang, party in zip(languages, reversed(languages))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for lang in languages:
+            self.assertEqual(len(rendered[lang]), 500)
+            for results in rendered[lang]:
+                self.assertEqual(results, expected[lang])
+            self.assertTrue(language_kept[lang])
+        self.assertEqual(translation.get_language(), active)
+
+
+class ChatActionIndicatorTest(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(notifications.executor, 'submit')
+        self.submit = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bot = object()
+
+    def wait_fired(self, indicator, count):
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            stats = indicator.stats
+            if stats['sent'] + stats['deduplicated'] + stats['shed'] >= count and not stats['pending']:
+                return stats
+            time.sleep(0.01)
+        self.fail('Chat actions were not fired in time')
+
+    def test_action_sent_after_delay(self):
+        indicator = ChatActionIndicator(delay=0.01, load_shedding=False)
+        indicator.schedule(self.bot, 1, 'typing')
+        stats = self.wait_fired(indicator, 1)
+        self.assertEqual(stats['sent'], 1)
+        self.submit.assert_called_once_with(indicator._send, self.bot, 1, 'typing')
+
+    def test_cancelled_action_not_sent(self):
+        indicator = ChatActionIndicator(delay=0.05, load_shedding=False)
+        indicator.cancel(indicator.schedule(self.bot, 1, 'typing'))
+        time.sleep(0.15)
+        self.assertEqual(indicator.stats['sent'], 0)
+        self.assertEqual(indicator.stats['pending'], 0)
+        self.submit.assert_not_called()
+
+    def test_repeated_action_deduplicated(self):
+        indicator = ChatActionIndicator(delay=0.01, interval=60, load_shedding=False)
+        indicator.schedule(self.bot, 1, 'typing')
+        indicator.schedule(self.bot, 1, 'typing')
+        indicator.schedule(self.bot, 2, 'typing')
+        stats = self.wait_fired(indicator, 3)
+        self.assertEqual((stats['sent'], stats['deduplicated']), (2, 1))
+        self.assertEqual(self.submit.call_count, 2)
+
+    def test_action_not_sent_while_shedding(self):
+        indicator = ChatActionIndicator(delay=0.01, load_shedding=True)
+        indicator.schedule(self.bot, 1, 'typing')
+        time.sleep(0.05)
+        self.assertEqual(indicator.stats['shed'], 1)
+        self.submit.assert_not_called()
+
+    @mock.patch.dict('backend.bot.chat_actions.CHAT_ACTIONS', {'LOAD_SHEDDING': True, 'DELAY': 0.01})
+    def test_load_shedding_setting(self):
+        indicator = ChatActionIndicator()
+        self.assertTrue(indicator.shedding)
+        indicator.schedule(self.bot, 1, 'typing')
+        time.sleep(0.05)
+        self.assertEqual(indicator.stats['shed'], 1)
+        self.submit.assert_not_called()
+
+    def test_action_dropped_when_shedding_starts_before_delay(self):
+        indicator = ChatActionIndicator(delay=0.05, load_shedding=False)
+        indicator.schedule(self.bot, 1, 'typing')
+        indicator.load_shedding.set()
+        stats = self.wait_fired(indicator, 1)
+        self.assertEqual((stats['sent'], stats['shed']), (0, 1))
+        self.submit.assert_not_called()
+
+    @mock.patch('backend.bot.chat_actions.scheduler')
+    def test_action_not_sent_over_queue_depth(self, scheduler):
+        scheduler.depth = 11
+        indicator = ChatActionIndicator(delay=0.01, shed_depth=10, load_shedding=False)
+        indicator.schedule(self.bot, 1, 'typing')
+        time.sleep(0.05)
+        self.assertEqual(indicator.stats['shed'], 1)
+        self.submit.assert_not_called()
+
+
+class KeysetCountTest(SimpleTestCase):
+
+    def paginator(self, page_count=None, is_estimated=False):
+        paginator = pagination.KeysetCallbackPaginator(
+            Order.objects.none(), callback=OutgoingOrderDetailCallback, page_callback=OutgoingOrderCallback,
+        )
+        paginator._keyset = mock.Mock(
+            data=[], page=2, cursor='[3]', direction=pagination.NEXT, has_previous=True, has_next=True,
+            first_cursor='[2]', last_cursor='[1]', page_count=page_count, is_estimated=is_estimated,
+        )
+        return paginator
+
+    def current_label(self, paginator):
+        return paginator.inline_markup.inline_keyboard[-1][-2].text
+
+    def test_total_off_by_default(self):
+        self.assertIsNone(pagination.KeysetPaginator(Order.objects.none()).page_count)
+        self.assertEqual(self.current_label(self.paginator()), '·2·')
+
+    def test_total_in_label(self):
+        self.assertEqual(self.current_label(self.paginator(page_count=5)), '·2/5·')
+        self.assertEqual(self.current_label(self.paginator(page_count=5, is_estimated=True)), '·2/~5·')
+
+    def test_estimate_rows(self):
+        queryset = mock.Mock()
+        queryset.explain.return_value = 'Index Scan on backend_order  (cost=0.29..8.31 rows=42 width=4)'
+        self.assertEqual(pagination.KeysetPaginator.estimate_rows(queryset), 42)
+
+
+class MemoryStateBackend(navigation.BaseStateBackend):
+
+    def __init__(self):
+        self.states = {}
+
+    def load(self, token):
+        return self.states.get(token)
+
+    def save(self, token, state):
+        self.states.setdefault(token, state)
+
+
+class NavigationStoreTest(SimpleTestCase):
+
+    def setUp(self):
+        self.backend = MemoryStateBackend()
+        patcher = mock.patch.object(navigation, 'store', navigation.NavigationStore(self.backend))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_round_trip(self):
+        state = {'id': 12, 'page': 3, 'ct_pg': 2, 'cp_pg': 5}
+        data = CompanyDetailCallback.set_data(**state)
+        self.assertTrue(data.startswith('did!'))
+        self.assertEqual(CompanyDetailCallback.set_data(**state), data)
+        self.assertEqual(len(self.backend.states), 1)
+        self.assertEqual(CompanyDetailCallback.get_data(data), state)
+
+        navigation.store._cache.clear()
+        self.assertEqual(CompanyDetailCallback.get_data(data), state)
+
+    def test_inline_data_without_state_store(self):
+        data = LanguageCallback.set_data(lang='en')
+        self.assertFalse(data.startswith(LanguageCallback.PATTERN + '!'))
+        self.assertEqual(LanguageCallback.get_data(data), {'lang': 'en'})
+        self.assertEqual(self.backend.states, {})
+
+    def test_unknown_token(self):
+        with self.assertRaises(navigation.StateExpired):
+            CompaniesCallback.get_data('iid!unknown-token')
+
+    @mock.patch('backend.bot.handlers.callbacks.TelegramUser.get_user')
+    def test_expired_navigation_reply(self, get_user):
+        get_user.return_value = TelegramUser(id=1, lang='en')
+        update = mock.Mock()
+        update.callback_query.data = 'iid!unknown-token'
+        handler = CompaniesCallback()
+
+        self.assertIs(handler.handle_update(update, mock.Mock(), None), False)
+        update.callback_query.edit_message_text.assert_called_once_with(
+            MessageCatalog('en')('navigation_expired')
+        )
+
+
+class WebhookIngressTest(SimpleTestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.dispatcher = mock.Mock()
+        self.dispatcher.process_update.side_effect = lambda update: self.release.wait(2)
+        self.scheduler = ChatLaneScheduler(1, name='test')
+        self.addCleanup(self.scheduler.stop)
+        self.addCleanup(self.release.set)
+
+    @mock.patch('backend.bot.ingress.telegram.Update.de_json')
+    def test_submit_refused_when_full(self, de_json):
+        ingress = WebhookIngress(self.scheduler, queue_size=1, enqueue_timeout=0.05)
+        update = {'update_id': 1, 'message': {'chat': {'id': 1}}}
+
+        self.assertTrue(ingress.submit(self.dispatcher, update))
+        self.assertFalse(ingress.submit(self.dispatcher, update))
+
+        self.release.set()
+        self.scheduler.join()
+        self.assertTrue(ingress.submit(self.dispatcher, update))
+        self.scheduler.join()
+        stats = ingress.metrics.snapshot()
+        self.assertEqual((stats['received'], stats['dropped'], stats['processed']), (2, 1, 2))
+
+    def test_concurrent_metrics(self):
+        metrics = IngressMetrics()
+
+        def count():
+            for _ in range(10000):
+                metrics.accepted()
+                metrics.refused()
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((metrics.received, metrics.dropped), (40000, 40000))
+
+
+class MessageDispatchIndexTest(SimpleTestCase):
+    LANGUAGES = (('en', 'English'), ('uk', 'Ukrainian'))
+
+    def test_resolve_every_language(self):
+        index = MessageDispatchIndex()
+        index.register(SimpleNamespace(pattern='^', key='outgoing_orders'))
+        index.build(self.LANGUAGES)
+        for code, name in self.LANGUAGES:
+            self.assertEqual(index.resolve(MessageCatalog(code)('outgoing_orders')), 'outgoing_orders')
+        self.assertIsNone(index.resolve('no such label'))
+
+    def test_register_while_resolving(self):
+        index = MessageDispatchIndex()
+        index.register(SimpleNamespace(pattern='^', key='outgoing_orders'))
+        label = MessageCatalog('en')('outgoing_orders')
+        errors, results = [], []
+        barrier = threading.Barrier(3)
+
+        def resolve():
+            barrier.wait()
+            try:
+                for _ in range(200):
+                    results.append(index.resolve(label))
+            except Exception as e:
+                errors.append(e)
+
+        def register():
+            barrier.wait()
+            for number in range(200):
+                index.register(SimpleNamespace(pattern='^', key=f'key_{number}'))
+
+        threads = [threading.Thread(target=target) for target in (resolve, resolve, register)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(set(results), {'outgoing_orders'})
+
+
+class CallbackCodecTest(SimpleTestCase):
+    SCHEMA = codec.Schema(codec.Int('id'), codec.Str('name'), codec.Choice('st', ['outgoing', 'incoming']))
+
+    def test_round_trip(self):
+        samples = ({'id': 0}, {'id': -300, 'st': 'incoming'}, {'id': 2 ** 40, 'name': 'Кава', 'st': 'outgoing'})
+        for values in samples:
+            self.assertEqual(self.SCHEMA.unpack(self.SCHEMA.pack(values)), values)
+
+    def test_missing_fields(self):
+        self.assertEqual(self.SCHEMA.unpack(self.SCHEMA.pack({'id': None, 'st': 'outgoing'})), {'st': 'outgoing'})
+        self.assertEqual(self.SCHEMA.unpack(self.SCHEMA.pack({})), {})
+
+    def test_out_of_schema_values(self):
+        with self.assertRaises(ValueError):
+            self.SCHEMA.pack({'page': 1})
+        with self.assertRaises(ValueError):
+            self.SCHEMA.pack({'st': 'unknown'})
+
+    def test_callback_data(self):
+        data = OrderStatusCallback.set_data(id=123456, status=2, st='incoming')
+        self.assertTrue(data.startswith('us-order:'))
+        self.assertLess(len(data), len('us-order;id=123456;status=2;st=incoming'))
+        self.assertEqual(OrderStatusCallback.get_data(data), {'id': 123456, 'status': 2, 'st': 'incoming'})
+
+    def test_fallback_to_legacy_format(self):
+        data = OrderStatusCallback.set_data(id=1, st='archived')
+        self.assertEqual(data, 'us-order;id=1;st=archived')
+        self.assertEqual(OrderStatusCallback.get_data(data), {'id': 1, 'st': 'archived'})
+
+    def test_legacy_data(self):
+        self.assertEqual(OrderStatusCallback.get_data('us-order;id=5;status=1;st=outgoing'),
+                         {'id': 5, 'status': '1', 'st': 'outgoing'})
+
+
+class ScheduleIntervalsTest(SimpleTestCase):
+    DAY = schedule.MINUTES_IN_DAY
+
+    def time_work(self, week_day, start, end, is_lunch=False):
+        return SimpleNamespace(week_day=week_day, start_time=datetime.time(*start), end_time=datetime.time(*end),
+                               is_lunch=is_lunch)
+
+    def test_minute_of_week(self):
+        self.assertEqual(schedule.minute_of_week(datetime.datetime(2020, 6, 1, 0, 0)), 0)
+        self.assertEqual(schedule.minute_of_week(datetime.datetime(2020, 6, 3, 9, 30)), 2 * self.DAY + 570)
+        self.assertEqual(schedule.minute_of_week(datetime.datetime(2020, 6, 7, 23, 59)),
+                         schedule.MINUTES_IN_WEEK - 1)
+
+    def test_day_interval(self):
+        self.assertEqual(schedule.day_interval(1, datetime.time(9), datetime.time(18)),
+                         (self.DAY + 540, self.DAY + 1080))
+        self.assertEqual(schedule.day_interval(1, datetime.time(22), datetime.time(2)),
+                         (self.DAY + 1320, 2 * self.DAY + 120))
+        self.assertEqual(schedule.day_interval(0, datetime.time(0), datetime.time(0)), (0, self.DAY))
+
+    def test_normalize(self):
+        self.assertEqual(schedule.normalize([(600, 700), (100, 200), (150, 300), (300, 400)]), [(100, 400), (600, 700)])
+        self.assertEqual(
+            schedule.normalize([schedule.day_interval(6, datetime.time(22), datetime.time(2))]),
+            [(0, 120), (6 * self.DAY + 1320, schedule.MINUTES_IN_WEEK)],
+        )
+
+    def test_subtract(self):
+        self.assertEqual(schedule.subtract([(0, 100)], [(40, 60)]), [(0, 40), (60, 100)])
+        self.assertEqual(schedule.subtract([(0, 100), (200, 300)], [(50, 250)]), [(0, 50), (250, 300)])
+        self.assertEqual(schedule.subtract([(0, 100)], [(0, 100)]), [])
+        self.assertEqual(schedule.subtract([(0, 100)], [(100, 200)]), [(0, 100)])
+
+    def test_week_intervals(self):
+        intervals = schedule.week_intervals([
+            self.time_work(0, (9,), (18,)),
+            self.time_work(0, (13,), (14,), is_lunch=True),
+            self.time_work(6, (20,), (3,)),
+        ])
+        self.assertEqual(
+            intervals, [(0, 180), (540, 780), (840, 1080), (6 * self.DAY + 1200, schedule.MINUTES_IN_WEEK)],
+        )
+
+
+class BookingTest(TestCase):
+
+    def setUp(self):
+        owner = TelegramUser.objects.create(id=1, full_name='Owner')
+        account = User.objects.create_user('owner', password='owner')
+        profile = Profile.objects.create(user=owner, account=account, name='Owner')
+        company = Company.objects.create(
+            profile=profile, category=Category.objects.create(name='food'), name='Cafe', address='Street 1',
+            contact='+380000000000',
+        )
+        self.service = Service.objects.create(performer=company, type=Service.BOOKING, name='Table')
+        self.other = Service.objects.create(performer=company, type=Service.BOOKING, name='Terrace')
+        self.text = Service.objects.create(performer=company, type=Service.SIMPLE_TEXT, name='Coffee')
+        self.customer = TelegramUser.objects.create(id=2)
+
+    def test_second_booking_rejected(self):
+        order = booking.create_order(self.customer, self.service)
+        self.assertTrue(order.booking)
+        with self.assertRaises(booking.ServiceBooked):
+            booking.create_order(TelegramUser.objects.create(id=3), self.service)
+        self.assertEqual(Order.objects.filter(service=self.service).count(), 1)
+        self.assertFalse(booking.is_available(self.service))
+        self.assertTrue(booking.is_available(self.other))
+
+    def test_released_by_status(self):
+        order = booking.create_order(self.customer, self.service)
+        order.status = 2
+        order.save(update_fields=['status'])
+        order.refresh_from_db()
+        self.assertFalse(order.booking)
+        self.assertTrue(booking.is_available(self.service))
+        booking.create_order(self.customer, self.service)
+
+    def test_simple_services_not_held(self):
+        booking.create_order(self.customer, self.text)
+        booking.create_order(self.customer, self.text)
+        self.assertEqual(Order.objects.filter(service=self.text, booking=True).count(), 0)
+
+    def test_second_slot_booking_rejected(self):
+        self.service.slot_length = 30
+        self.service.save()
+        slot_start = datetime.datetime(2020, 6, 1, 10, 0)
+        booking.create_order(self.customer, self.service, slot_start)
+        with self.assertRaises(booking.ServiceBooked):
+            booking.create_order(TelegramUser.objects.create(id=3), self.service, slot_start)
+        booking.create_order(self.customer, self.service, slot_start + datetime.timedelta(minutes=30))
+        self.assertTrue(booking.is_available(self.service))
+
+    def test_available_services(self):
+        booking.create_order(self.customer, self.service)
+        self.assertEqual(set(booking.available_services(Service.objects.all())), {self.other, self.text})
+
+
+class SlotBitmapTest(SimpleTestCase):
+    DAY = schedule.MINUTES_IN_DAY
+
+    def test_slot_bitmap(self):
+        bitmap = schedule.slot_bitmap([(self.DAY + 540, self.DAY + 720)], 1, 60)
+        self.assertEqual(len(bitmap), 3)
+        self.assertEqual(schedule.bitmap_slots(bitmap), [9, 10, 11])
+
+    def test_partial_slots_excluded(self):
+        bitmap = schedule.slot_bitmap([(self.DAY + 550, self.DAY + 710)], 1, 60)
+        self.assertEqual(schedule.bitmap_slots(bitmap), [10])
+
+    def test_other_days_ignored(self):
+        intervals = [(0, 600), (self.DAY - 60, self.DAY + 120), (2 * self.DAY, 3 * self.DAY)]
+        self.assertEqual(schedule.bitmap_slots(schedule.slot_bitmap(intervals, 1, 60)), [0, 1])
+        self.assertEqual(schedule.bitmap_slots(schedule.slot_bitmap(intervals, 0, 60)), list(range(10)) + [23])
+
+    def test_booked_slots(self):
+        bitmap = schedule.slot_bitmap([(540, 720)], 0, 30, booked=[570, 660, 1440])
+        self.assertEqual(schedule.bitmap_slots(bitmap), [18, 20, 21, 23])
+
+    def test_after(self):
+        bitmap = schedule.slot_bitmap([(540, 720)], 0, 30)
+        self.assertEqual(schedule.bitmap_slots(bitmap, after=600, slot_length=30), [21, 22, 23])
+        self.assertEqual(schedule.bitmap_slots(bitmap, after=599, slot_length=30), [20, 21, 22, 23])
+
+    def test_free_slots(self):
+        service = SimpleNamespace(slot_length=60)
+        bitmap = schedule.slot_bitmap([(540, 720)], 0, 60)
+        day = datetime.date(2020, 6, 1)
+        self.assertEqual(
+            booking.free_slots(service, day, bitmap, now=datetime.datetime(2020, 6, 1, 9, 30)),
+            [datetime.datetime(2020, 6, 1, 10), datetime.datetime(2020, 6, 1, 11)],
+        )
+        self.assertEqual(len(booking.free_slots(service, day, bitmap, now=datetime.datetime(2020, 5, 31))), 3)
+        self.assertEqual(booking.free_slots(service, day, bitmap, now=datetime.datetime(2020, 6, 2)), [])
+
+
+class JSONChangesTest(SimpleTestCase):
+
+    def test_no_changes(self):
+        self.assertEqual(models.json_changes({}, {}), [])
+        self.assertEqual(models.json_changes({'a': {'b': [1, 2]}}, {'a': {'b': [1, 2]}}), [])
+
+    def test_changed_values(self):
+        old = {'lang': 'uk', 'location': {'latitude': 50.4, 'longitude': 30.5}}
+        new = {'lang': 'uk', 'location': {'latitude': 50.5, 'longitude': 30.5}}
+        self.assertEqual(models.json_changes(old, new), [(('location', 'latitude'), 50.5)])
+
+    def test_added_and_removed_keys(self):
+        old = {'filter': {'show_done': True}, 'state': 1}
+        new = {'filter': {'show_rejected': True}, 'page': 2}
+        self.assertEqual(models.json_changes(old, new), [
+            (('state',), models._REMOVED),
+            (('filter', 'show_done'), models._REMOVED),
+            (('filter', 'show_rejected'), True),
+            (('page',), 2),
+        ])
+
+    def test_type_changes(self):
+        self.assertEqual(models.json_changes({'a': {'b': 1}}, {'a': [1]}), [(('a',), [1])])
+        self.assertEqual(models.json_changes({'a': 1}, {'a': {'b': 1}}), [(('a',), {'b': 1})])
+        self.assertEqual(models.json_changes(None, {'a': 1}), [((), {'a': 1})])
+
+
+class TelegramUserSaveChangesTest(TestCase):
+
+    def setUp(self):
+        TelegramUser.objects.create(id=1, options={'location': {'latitude': 50.4}, 'page': 1})
+
+    def test_concurrent_keys(self):
+        first, second = TelegramUser.objects.get(id=1), TelegramUser.objects.get(id=1)
+        first.options['location']['longitude'] = 30.5
+        second.options.pop('page')
+        second.options['filter'] = {'show_done': True}
+        self.assertTrue(first.save_changes())
+        self.assertTrue(second.save_changes())
+        self.assertEqual(
+            TelegramUser.objects.get(id=1).options,
+            {'location': {'latitude': 50.4, 'longitude': 30.5}, 'filter': {'show_done': True}},
+        )
+
+    def test_nothing_changed(self):
+        user = TelegramUser.objects.get(id=1)
+        with self.assertNumQueries(0):
+            self.assertFalse(user.save_changes())
@@ -28,13 +28,17 @@ def timer(func):
 
 
 def send_action(action):
-    """Sends `action` while processing func command."""
+    """Shows `action` in the chat if processing func command takes longer than `CHAT_ACTIONS['DELAY']`."""
 
     def decorator(func):
         @wraps(func)
         def command_func(context, bot, update, *args, **kwargs):
-            bot.send_chat_action(chat_id=update.effective_message.chat_id, action=action)
-            return func(context, bot, update, *args, **kwargs)
+            from backend.bot.chat_actions import indicator
+            handle = indicator.schedule(bot, update.effective_message.chat_id, action)
+            try:
+                return func(context, bot, update, *args, **kwargs)
+            finally:
+                indicator.cancel(handle)
 
         return command_func
 
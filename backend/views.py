@@ -1,5 +1,49 @@
+import json
+import logging
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import redirect
+from django.views.decorators.csrf import csrf_exempt
+from django_telegrambot.apps import DjangoTelegramBot
+
+from backend.bot import transport
+from backend.bot.chat_actions import indicator
+from backend.bot.ingress import ingress
+from backend.bot.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
 
 
 def base(request):
     return redirect('/admin/')
+
+
+@staff_member_required
+def webhook_metrics(request):
+    return JsonResponse(dict(
+        ingress.stats, scheduler=scheduler.stats, chat_actions=indicator.stats,
+        bot_api={bot.username: transport.stats(bot) for bot in DjangoTelegramBot.bots},
+    ))
+
+
+@csrf_exempt
+def webhook(request, bot_token):
+    """
+    WSGI webhook, the update is handled on the lane of its chat after Telegram got the response. Refused
+    with `429` like the ASGI endpoint when the lanes hold `WEBHOOK_INGRESS['QUEUE_SIZE']` updates.
+    """
+    dispatcher = DjangoTelegramBot.getDispatcher(bot_token, safe=False)
+    if dispatcher is None:
+        logger.warning('Request for not found token : {}'.format(bot_token))
+        return JsonResponse({})
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+    except ValueError:
+        logger.warning('Telegram bot <{}> receive invalid request'.format(dispatcher.bot.username))
+        return JsonResponse({})
+    if not ingress.submit(dispatcher, data):
+        response = JsonResponse({}, status=429)
+        response['Retry-After'] = str(ingress.retry_after)
+        return response
+    return JsonResponse({})